@@ -4,6 +4,8 @@ import os
 
 from django.core.management.base import BaseCommand
 
+from failmap.celery.worker import worker_arguments
+
 
 class Command(BaseCommand):
     """Celery command wrapper."""
@@ -14,7 +16,7 @@ class Command(BaseCommand):
     requires_system_checks = False
 
     def run_from_argv(self, argv):
-        """Replace python with celery process with given arguments."""
+        """Replace python with celery process with given arguments, and the pool of the worker role."""
         appname = __name__.split('.', 1)[0] + '.celery:app'
         appname_arguments = ['-A', appname]
-        os.execvp(argv[1], argv[1:2] + appname_arguments + argv[2:])
+        os.execvp(argv[1], argv[1:2] + appname_arguments + worker_arguments(argv[2:]))
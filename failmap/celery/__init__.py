@@ -48,6 +48,27 @@ IP_VERSION_QUEUE = {
 }
 
 
+def redis_client():
+    """Return a Redis client connected to the broker, or None if the broker is not Redis.
+
+    Used for small amounts of state that needs to be shared between workers (like caches), the broker is
+    the only thing all workers are guaranteed to be able to reach. The client is created once per process.
+    """
+    global _redis_client
+
+    if 'redis://' not in app.conf.broker_url:
+        return None
+
+    if _redis_client is None:
+        # import here, only Redis brokers need this library.
+        import redis
+        _redis_client = redis.StrictRedis.from_url(app.conf.broker_url)
+    return _redis_client
+
+
+_redis_client = None
+
+
 class DefaultTask(Task):
     """Default settings for all failmap tasks."""
 
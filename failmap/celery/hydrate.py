@@ -0,0 +1,70 @@
+"""
+Tasks receive ids of objects, not the objects.
+
+A pickled Url or Endpoint in a task message is a snapshot: by the time a worker gets the task the object might have
+changed or be deleted, and it makes messages large and requires the pickle serializer. Tasks now get primary keys
+and hydrate them on the worker, a batch of ids with a single query. A task that gets a single id costs a query of its
+own: pass batches where there are many of them.
+
+Functions that are also called directly (not as a task) still receive objects: those are used as they are.
+
+Usage:
+    some_task.s(pks(urls))
+
+    @app.task(queue='storage', serializer='json')
+    def some_task(url_ids):
+        for url in hydrate(Url, url_ids):
+            ...
+"""
+import logging
+from typing import Iterable, List
+
+from django.db import models
+
+log = logging.getLogger(__name__)
+
+
+def pk(obj) -> int:
+    """The primary key of an object, or the primary key itself."""
+    return obj.pk if isinstance(obj, models.Model) else obj
+
+
+def pks(objects: Iterable) -> List[int]:
+    return [pk(obj) for obj in objects]
+
+
+def hydrate(model, objects: Iterable, select_related: Iterable[str]=()) -> List:
+    """
+    Objects for a list of primary keys, fetched with a single query, in the same order. Objects that don't exist
+    anymore are left out.
+
+    :param model: model class, such as Url.
+    :param objects: primary keys, or objects (which are used as they are).
+    :param select_related: relations to fetch in the same query, such as 'url' for endpoints.
+    """
+    objects = list(objects)
+    ids = [obj for obj in objects if not isinstance(obj, models.Model)]
+
+    fetched = {}
+    if ids:
+        queryset = model.objects.all().filter(pk__in=ids)
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        fetched = {obj.pk: obj for obj in queryset}
+
+        if len(fetched) < len(set(ids)):
+            log.debug("%s %s objects do not exist anymore." % (len(set(ids)) - len(fetched), model.__name__))
+
+    hydrated = []
+    for obj in objects:
+        if isinstance(obj, models.Model):
+            hydrated.append(obj)
+        elif obj in fetched:
+            hydrated.append(fetched[obj])
+    return hydrated
+
+
+def hydrate_one(model, obj, select_related: Iterable[str]=()):
+    """The object for a primary key, or None if it does not exist anymore."""
+    hydrated = hydrate(model, [obj], select_related)
+    return hydrated[0] if hydrated else None
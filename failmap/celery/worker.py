@@ -1,8 +1,11 @@
 import getpass
 import logging
 import os
+import re
 import ssl
+import sys
 import tempfile
+from typing import List
 
 import certifi
 import OpenSSL
@@ -27,6 +30,8 @@ WORKER_QUEUE_CONFIGURATION = {
         Queue('scanners.qualys'),
         # for tasks that require a database connection
         Queue('storage'),
+        # storing debugging data, see scratchpad
+        Queue('scratch'),
         # default queue for task with no explicit queue assigned
         # these tasks should not expect network connectivity or database access!
         Queue('default'),
@@ -45,6 +50,7 @@ WORKER_QUEUE_CONFIGURATION = {
     # worker with access to storage allowed to connect to databases
     'storage': [
         Queue('storage'),
+        Queue('scratch'),
         Queue('default'),
         Queue('celery'),
     ],
@@ -65,6 +71,25 @@ WORKER_QUEUE_CONFIGURATION = {
         Queue('scanners'),
         Queue('scanners.ipv4'),
     ],
+    # scanner for tasks that spend nearly all their time waiting on the network, hundreds at a time in one process.
+    # Tasks on these queues don't use the database (that is done on storage) and don't use signals.
+    'scanner_io': [
+        Queue('scanners'),
+        Queue('scanners.ipv4'),
+        Queue('scanners.ipv6'),
+        Queue('scanners.endpoint_discovery.ipv4'),
+        Queue('scanners.endpoint_discovery.ipv6'),
+    ],
+}
+
+# Pool and concurrency per role, used when they are not given on the command line. Other roles run the prefork pool
+# with CELERY_WORKER_CONCURRENCY processes. The pool has to be known when the worker starts (eventlet patches the
+# standard library before anything else is imported), so these are added to the arguments of 'failmap celery worker'.
+WORKER_POOL_CONFIGURATION = {
+    'scanner_io': {
+        'pool': 'eventlet',
+        'concurrency': int(os.environ.get('WORKER_IO_CONCURRENCY', 200)),
+    },
 }
 
 
@@ -79,6 +104,39 @@ def worker_configuration():
     return {'task_queues': WORKER_QUEUE_CONFIGURATION[role]}
 
 
+def worker_arguments(arguments: List[str]) -> List[str]:
+    """Adds the pool and concurrency of the role of this worker to the arguments of the celery command."""
+
+    role = os.environ.get('WORKER_ROLE', 'default')
+    if 'worker' not in arguments or role not in WORKER_POOL_CONFIGURATION:
+        return arguments
+
+    pool = WORKER_POOL_CONFIGURATION[role]
+    arguments = list(arguments)
+    if not _given(arguments, 'P', 'pool'):
+        arguments.extend(['--pool', pool['pool']])
+    if not _given(arguments, 'c', 'concurrency'):
+        arguments.extend(['--concurrency', str(pool['concurrency'])])
+
+    log.info('Pool for role %s: %s', role, ' '.join(arguments))
+    return arguments
+
+
+def _given(arguments: List[str], short: str, long: str) -> bool:
+    pattern = re.compile(r'^(-%s.*|--%s(=.*)?)$' % (short, long))
+    return any(pattern.match(argument) for argument in arguments)
+
+
+def green_threads() -> bool:
+    """True when tasks run on green threads: eventlet has patched the standard library of this process."""
+
+    if 'eventlet' not in sys.modules:
+        return False
+
+    import eventlet.patcher
+    return eventlet.patcher.is_monkey_patched('socket')
+
+
 def tls_client_certificate():
     """Configure certificates from PKCS12 file.
 
@@ -8,7 +8,9 @@ from deepdiff import DeepDiff
 from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import Q
 
+from failmap.celery.hydrate import hydrate, pks
 from failmap.organizations.models import Organization, Url
+from failmap.scanners import heartbeat
 from failmap.scanners.models import Endpoint, EndpointGenericScan, TlsQualysScan
 
 from ..celery import Task, app
@@ -57,8 +59,8 @@ def compose_task(
             continue
 
         # make sure default organization rating is in place
-        tasks.append(rerate_urls.si(urls)
-                     | rerate_organizations.si([organization]))
+        tasks.append(rerate_urls.si(pks(urls))
+                     | rerate_organizations.si([organization.pk]))
 
     if not tasks:
         raise Exception('Applied filters resulted in no tasks!')
@@ -68,20 +70,23 @@ def compose_task(
     return task
 
 
-@app.task(queue='storage')
+@app.task(queue='storage', serializer='json')
 def rerate_urls(urls: List):
-    """Remove the rating of one url and rebuild anew."""
+    """Remove the rating of urls (ids, or Url objects when called directly) and rebuild anew."""
 
-    for url in urls:
+    # make sure the latest scan moments are in the database.
+    heartbeat.flush()
+
+    for url in hydrate(Url, urls):
         delete_url_ratings(url)
         rate_timeline(create_timeline(url), url)
 
 
-@app.task(queue='storage')
+@app.task(queue='storage', serializer='json')
 def rerate_organizations(organizations: List):
-    """Remove organization rating and rebuild anew."""
+    """Remove organization rating (ids, or Organization objects when called directly) and rebuild anew."""
 
-    for organization in organizations:
+    for organization in hydrate(Organization, organizations):
         delete_organization_ratings(organization)
         add_organization_rating(organizations=[organization], build_history=True)
 
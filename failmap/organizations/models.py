@@ -3,16 +3,21 @@
 
 import logging
 from datetime import datetime, timedelta
+from typing import List
 
 import pytz
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Max
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
 from jsonfield import JSONField
 
 logger = logging.getLogger(__package__)
 
+# Amount of rows per query when adding many urls at once. Stays below the limit of query parameters of sqlite.
+BULK_SIZE = 500
+
 
 class OrganizationType(models.Model):
     name = models.CharField(max_length=255)
@@ -236,31 +241,60 @@ class Url(models.Model):
         return False
 
     def add_subdomain(self, subdomain):
-        # import here to prevent circular/cyclic imports, this module imports Url.
-        from failmap.scanners.scanner_http import resolves
-
-        new_url = (subdomain + "." + self.url).lower()
+        added = self.add_subdomains([subdomain])
+        return added[0] if added else None
 
-        if Url.objects.all().filter(url=new_url, organization__in=self.organization.all()).exists():
-            logger.debug("Subdomain already in the database: %s" % new_url)
-            return
+    def add_subdomains(self, subdomains: List[str]) -> List['Url']:
+        """
+        Adds the subdomains of this url that resolve and are not known yet, to the organizations of this url.
 
-        if not resolves(new_url):
-            logger.debug("New subdomain did not resolve on either ipv4 and ipv6: %s" % new_url)
-            return
+        Meant for large amounts of subdomains, such as the results of a brute force scan: known subdomains are
+        filtered out with a single query, the rest is resolved concurrently and the new urls are created in bulk.
 
-        u = Url()
-        # A Url needs to have a value for field "id" before a many-to-many relationship can be used.
-        u.save()
-        u.organization = self.organization.all()
-        u.url = new_url
-        u.save()
-        logger.info("Added domain to database: %s" % new_url)
-
-        # run standard checks, so you know the
-        # discover_wildcards([u])
-
-        return u
+        :param subdomains: names without this url, for example ['www', 'mail']
+        :return: the added urls.
+        """
+        # import here to prevent circular/cyclic imports, this module imports Url.
+        from failmap.scanners import resolver, subdomain_wordlist
+
+        organizations = list(self.organization.all())
+        candidates = set((subdomain + "." + self.url).lower() for subdomain in subdomains if subdomain)
+
+        known = set(Url.objects.all().filter(
+            organization__in=organizations, url__endswith="." + self.url.lower()).values_list('url', flat=True))
+        candidates -= known
+        if not candidates:
+            logger.debug("All %s subdomains of %s are already in the database." % (len(subdomains), self.url))
+            return []
+
+        answers = resolver.resolve_many(list(candidates))
+        new_urls = sorted(name for name, (ipv4, ipv6) in answers.items() if ipv4 or ipv6)
+        logger.debug("%s of %s new subdomains of %s resolve." % (len(new_urls), len(candidates), self.url))
+        if not new_urls:
+            return []
+
+        with transaction.atomic():
+            # bulk_create does not return primary keys on every database, so the new rows are looked up after.
+            newest_id = Url.objects.all().aggregate(newest=Max('id'))['newest'] or 0
+            Url.objects.bulk_create([Url(url=new_url) for new_url in new_urls], batch_size=BULK_SIZE)
+
+            added = []
+            for start in range(0, len(new_urls), BULK_SIZE):
+                added += list(Url.objects.all().filter(id__gt=newest_id, url__in=new_urls[start:start + BULK_SIZE]))
+
+            Url.organization.through.objects.bulk_create(
+                [Url.organization.through(url_id=url.id, organization_id=organization.id)
+                 for url in added for organization in organizations], batch_size=BULK_SIZE)
+
+        for url in added:
+            logger.info("Added domain to database: %s" % url.url)
+
+        try:
+            subdomain_wordlist.add([url.url for url in added])
+        except OSError as e:
+            logger.warning("Could not update the known subdomains wordlist: %s" % e)
+
+        return added
 
 # are open ports based on IP adresses.
 # adresses might change (and thus an endpoint changes).
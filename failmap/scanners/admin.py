@@ -5,8 +5,9 @@ from jet.admin import CompactInline
 
 from failmap.map.rating import rate_url
 
-from .models import (Endpoint, EndpointGenericScan, EndpointGenericScanScratchpad, Screenshot,
-                     State, TlsQualysScan, TlsQualysScratchpad, UrlGenericScan, UrlIp)
+from .models import (Endpoint, EndpointGenericScan, EndpointGenericScanScratchpad,
+                     EndpointObservation, ScanSchedule, Screenshot, State, TlsQualysScan,
+                     TlsQualysScratchpad, UrlGenericScan, UrlIp)
 
 
 class TlsQualysScanAdminInline(CompactInline):
@@ -151,10 +152,11 @@ class TlsQualysScratchpadAdmin(ImportExportModelAdmin, admin.ModelAdmin):
 
 
 class ScreenshotAdmin(ImportExportModelAdmin, admin.ModelAdmin):
-    list_display = ('endpoint', 'domain', 'created_on', 'filename')
-    search_fields = ('endpoint__url__url', 'domain', 'created_on', 'filename')
+    list_display = ('endpoint', 'domain', 'created_on', 'last_scan_moment', 'filename', 'perceptual_hash')
+    search_fields = ('endpoint__url__url', 'domain', 'created_on', 'filename', 'content_hash', 'perceptual_hash')
     list_filter = ('endpoint', 'domain', 'created_on', 'filename')
-    fields = ('endpoint', 'domain', 'created_on', 'filename', 'width_pixels', 'height_pixels')
+    fields = ('endpoint', 'domain', 'created_on', 'last_scan_moment', 'filename', 'width_pixels', 'height_pixels',
+              'content_hash', 'perceptual_hash')
     readonly_fields = ['created_on']
 
 
@@ -166,6 +168,13 @@ class StateAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     readonly_fields = ['since']
 
 
+class ScanScheduleAdmin(admin.ModelAdmin):
+    list_display = ('scanner', 'target_id', 'last_scan_moment')
+    search_fields = ('scanner', 'target_id')
+    list_filter = ('scanner', 'last_scan_moment')
+    fields = ('scanner', 'target_id', 'last_scan_moment')
+
+
 class EndpointGenericScanAdmin(ImportExportModelAdmin, admin.ModelAdmin):
     list_display = ('endpoint', 'domain', 'type', 'rating',
                     'explanation', 'last_scan_moment', 'rating_determined_on')
@@ -199,12 +208,22 @@ class EndpointGenericScanScratchpadAdmin(ImportExportModelAdmin, admin.ModelAdmi
     fields = ('type', 'domain', 'when', 'data')
 
 
+class EndpointObservationAdmin(admin.ModelAdmin):
+    list_display = ('endpoint', 'when', 'reachable', 'status_code', 'tls', 'error')
+    search_fields = ('endpoint__url__url', 'final_url', 'error')
+    list_filter = ('reachable', 'status_code', 'when')
+    fields = ('endpoint', 'when', 'reachable', 'status_code', 'headers', 'redirects', 'final_url', 'tls', 'error')
+    readonly_fields = ['endpoint', 'when']
+
+
 admin.site.register(TlsQualysScan, TlsQualysScanAdmin)
 admin.site.register(TlsQualysScratchpad, TlsQualysScratchpadAdmin)
 admin.site.register(Endpoint, EndpointAdmin)
 admin.site.register(Screenshot, ScreenshotAdmin)
 admin.site.register(State, StateAdmin)
+admin.site.register(ScanSchedule, ScanScheduleAdmin)
 admin.site.register(EndpointGenericScan, EndpointGenericScanAdmin)
 admin.site.register(UrlGenericScan, UrlGenericScanAdmin)
 admin.site.register(EndpointGenericScanScratchpad, EndpointGenericScanScratchpadAdmin)
+admin.site.register(EndpointObservation, EndpointObservationAdmin)
 admin.site.register(UrlIp, UrlIpAdmin)
@@ -0,0 +1,118 @@
+"""
+Subdomain discovery using certificate transparency logs (crt.sh).
+
+Every certificate that is issued is logged publicly, including the names it's valid for. Asking crt.sh for all
+certificates of %.example.com gives a list of subdomains that certainly existed at some point.
+
+The answer for a large domain is big and mostly the same every time. This module:
+- asks for JSON and parses it while it's downloaded, one certificate at a time.
+- remembers the newest certificate per domain (in State) and skips all certificates up to that one next time.
+- skips names that are already known before checking DNS or the database.
+
+Usage:
+    new_urls = discover(url)
+"""
+import codecs
+import json
+import logging
+
+from django.conf import settings
+
+from failmap.organizations.models import Url
+from failmap.scanners.http_session import session
+from failmap.scanners.state_manager import StateManager
+
+logger = logging.getLogger(__package__)
+
+STATE_PREFIX = "certificate_transparency:"
+
+CHUNK_SIZE = 64 * 1024
+
+SEPARATORS = ' \t\r\n[],'
+
+
+def discover(url: Url):
+    """
+    Adds subdomains of url found in certificates that where logged since the previous discovery.
+
+    :param url: top level Url, for example example.com
+    :return: list of added Urls.
+    """
+    domain = url.url.lower()
+    state = STATE_PREFIX + domain
+
+    last_seen = int(StateManager.get_state(state) or 0)
+    newest = last_seen
+
+    known = set(Url.objects.all().filter(
+        organization__in=url.organization.all(), url__endswith="." + domain).values_list('url', flat=True))
+    candidates = set()
+
+    response = session().get(settings.CERTIFICATE_TRANSPARENCY_URL, params={'q': '%.' + domain, 'output': 'json'},
+                             stream=True, allow_redirects=False)
+    response.raise_for_status()
+
+    certificates = 0
+    for certificate in parse_stream(response.iter_content(CHUNK_SIZE)):
+        certificate_id = int(certificate.get('id') or certificate.get('min_cert_id') or 0)
+        if certificate_id <= last_seen:
+            continue
+
+        certificates += 1
+        newest = max(newest, certificate_id)
+        candidates |= subdomains(certificate, domain) - known
+
+    logger.debug("%s new certificates for %s, with %s new names." % (certificates, domain, len(candidates)))
+
+    added = url.add_subdomains([candidate[0:-len(domain) - 1] for candidate in candidates])
+
+    # the next discovery only has to look at certificates after these.
+    if newest > last_seen:
+        StateManager.set_state(state, str(newest))
+
+    return added
+
+
+def subdomains(certificate: dict, domain: str):
+    """All names in the certificate that are a subdomain of domain (wildcards are stripped)."""
+    names = set()
+    for field in ['name_value', 'common_name']:
+        for name in certificate.get(field, '').split('\n'):
+            # examples: *.apps.domain.tld. Wildcards might point to interesting things. If they exist is checked by
+            # any brute force dns scan.
+            name = name.strip().lower().replace("*.", "")
+            if name.endswith("." + domain):
+                names.add(name)
+    return names
+
+
+def parse_stream(chunks):
+    """
+    Yields the objects of a JSON array, while the array is received in chunks.
+
+    crt.sh also has been seen to send objects without the surrounding array, that is supported as well.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+
+        position = 0
+        while True:
+            # skip the array and the separators between objects.
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # incomplete object, wait for more.
+                break
+            yield value
+        buffer = buffer[position:]
+
+    if buffer.strip(SEPARATORS):
+        logger.warning("Certificate transparency answer ended with incomplete data: %s" % buffer[0:100])
@@ -0,0 +1,285 @@
+"""
+DNS brute forcing: finds subdomains by asking DNS for every word in a wordlist.
+
+Asking a name server is nearly all waiting, so all questions are sent from a single event loop over UDP: many
+questions are on their way at the same time, at most `rate` new ones per second. Only one question is asked per
+word (the A record) and nothing is written to disk: names that exist are handed to Url.add_subdomains per batch of
+words, while the wordlist is being read.
+
+Wildcards are checked first, by asking for a few random names that can't exist. If one of those exists, every name
+exists and brute forcing is pointless. Some wildcards only answer part of the names (or a name server answers
+everything), so the brute force also stops when nearly every word turns out to exist.
+
+Usage:
+    added = brute_force(url, words_from_file("knownsubdomains.txt"))
+    wildcard = uses_wildcard("example.com")
+"""
+import asyncio
+import itertools
+import logging
+import random
+import string
+from typing import Iterable, List
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.resolver
+from django.conf import settings
+
+from failmap.organizations.models import Url
+
+logger = logging.getLogger(__package__)
+
+# words per batch: every batch is resolved and the found names are added before the next batch is read.
+BATCH_SIZE = 2000
+
+# amount of random names asked when checking for wildcards, and their length.
+WILDCARD_PROBES = 3
+WILDCARD_LABEL_LENGTH = 10
+
+# after this amount of words, the brute force stops when more than WILDCARD_RATIO of them exist.
+WILDCARD_SAMPLE = 500
+WILDCARD_RATIO = 0.8
+
+# seconds to wait for an answer, and the amount of times a question is asked again after that.
+TIMEOUT = 2
+RETRIES = 2
+
+# maximum amount of questions waiting for an answer.
+CONCURRENCY = 200
+
+DNS_PORT = 53
+
+
+class NameServerProtocol(asyncio.DatagramProtocol):
+    """Receives answers from a name server and hands them to the question with the same id and name."""
+
+    def __init__(self):
+        # id: (name, future)
+        self.waiting = {}
+
+    def datagram_received(self, data, addr):
+        try:
+            answer = dns.message.from_wire(data)
+        except Exception as e:
+            logger.debug("Unreadable DNS answer from %s: %s" % (addr, e))
+            return
+
+        name, future = self.waiting.get(answer.id, (None, None))
+        if future is None or future.done():
+            return
+
+        # the id is only 16 bits, the name makes sure this is the answer to the question.
+        if not answer.question or answer.question[0].name != name:
+            return
+
+        future.set_result(answer)
+
+    def error_received(self, exc):
+        # such as ICMP port unreachable. The question that caused it times out and is asked again.
+        logger.debug("Name server error: %s" % exc)
+
+
+class BruteForcer:
+    """
+    Asks if subdomains of a domain exist. Must be opened (and closed) inside the event loop that uses it:
+
+        async with BruteForcer("example.com") as forcer:
+            existing = await forcer.existing(["www", "mail"])
+    """
+
+    def __init__(self, domain: str, rate: int=None, nameservers: List[str]=None, port: int=DNS_PORT,
+                 concurrency: int=CONCURRENCY, timeout: float=TIMEOUT, retries: int=RETRIES):
+        self.domain = domain.lower().rstrip('.')
+        self.rate = rate or settings.DNS_BRUTE_FORCE_RATE
+        self.nameservers = nameservers or configured_nameservers()
+        self.port = port
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+
+        self.connections = []
+        self.waiting_room = None
+        self.next_question = 0
+
+        # words that where checked, that exist and that did not get an answer at all.
+        self.checked = 0
+        self.found = 0
+        self.unanswered = 0
+        # questions asked, including the ones asked again.
+        self.questions = 0
+
+    async def __aenter__(self):
+        loop = asyncio.get_event_loop()
+        self.waiting_room = asyncio.Semaphore(self.concurrency)
+        self.next_question = loop.time()
+        for nameserver in self.nameservers:
+            self.connections.append(await loop.create_datagram_endpoint(
+                NameServerProtocol, remote_addr=(nameserver, self.port)))
+        return self
+
+    async def __aexit__(self, *args):
+        for transport, _ in self.connections:
+            transport.close()
+        self.connections = []
+
+    async def wildcard(self) -> bool:
+        """True if random names exist."""
+        probes = [nonsense_label() for _ in range(WILDCARD_PROBES)]
+        return any(await asyncio.gather(*[self.exists(probe) for probe in probes]))
+
+    async def existing(self, subdomains: List[str]) -> List[str]:
+        """The subdomains that exist."""
+        answers = await asyncio.gather(*[self.exists(subdomain) for subdomain in subdomains])
+        found = [subdomain for subdomain, exists in zip(subdomains, answers) if exists]
+
+        self.checked += len(subdomains)
+        self.found += len(found)
+        return found
+
+    async def exists(self, subdomain: str) -> bool:
+        try:
+            query = dns.message.make_query("%s.%s" % (subdomain, self.domain), 'A')
+        except (dns.exception.DNSException, UnicodeError, ValueError) as e:
+            # not a name that can exist, such as labels that are too long.
+            logger.debug("Skipping %s: %s" % (subdomain, e))
+            return False
+
+        loop = asyncio.get_event_loop()
+        async with self.waiting_room:
+            for attempt in range(self.retries + 1):
+                await self._pace()
+
+                # spread the questions over the name servers.
+                transport, protocol = self.connections[self.questions % len(self.connections)]
+                self.questions += 1
+
+                while query.id in protocol.waiting:
+                    query.id = random.randint(0, 65535)
+                future = loop.create_future()
+                protocol.waiting[query.id] = (query.question[0].name, future)
+
+                try:
+                    transport.sendto(query.to_wire())
+                    answer = await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    continue
+                finally:
+                    protocol.waiting.pop(query.id, None)
+
+                if answer.rcode() != dns.rcode.NOERROR:
+                    return False
+
+                # a truncated answer does not contain the records, but the name exists.
+                return bool(answer.answer) or bool(answer.flags & dns.flags.TC)
+
+        self.unanswered += 1
+        return False
+
+    async def _pace(self):
+        """Waits until the next question may be asked, to stay under the rate."""
+        now = asyncio.get_event_loop().time()
+        moment = max(now, self.next_question)
+        self.next_question = moment + 1 / self.rate
+        if moment > now:
+            await asyncio.sleep(moment - now)
+
+
+def brute_force(url: Url, words: Iterable[str], rate: int=None, nameservers: List[str]=None,
+                port: int=DNS_PORT) -> List[Url]:
+    """
+    Adds all subdomains of url that are in words and exist.
+
+    Wildcard usage is checked first and stored on the url. Urls with wildcards are not brute forced.
+
+    :param url: top level Url, for example example.com
+    :param words: subdomains to try, only a batch at a time is read.
+    :param rate: questions per second, default DNS_BRUTE_FORCE_RATE.
+    :param nameservers: ip addresses of name servers, default DNS_BRUTE_FORCE_NAMESERVERS or the system ones.
+    :return: list of added Urls.
+    """
+    added = []
+    forcer = BruteForcer(url.url, rate=rate, nameservers=nameservers, port=port)
+
+    # Every call gets its own loop: this function is called from celery workers that don't run an event loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(forcer.__aenter__())
+
+        wildcard = loop.run_until_complete(forcer.wildcard())
+        if url.uses_dns_wildcard != wildcard:
+            url.uses_dns_wildcard = wildcard
+            url.save()
+        if wildcard:
+            logger.info("Domain %s uses wildcards, DNS brute force not possible" % url.url)
+            return added
+
+        for batch in batches(words, BATCH_SIZE):
+            existing = loop.run_until_complete(forcer.existing(batch))
+
+            if forcer.checked >= WILDCARD_SAMPLE and forcer.found / forcer.checked > WILDCARD_RATIO:
+                logger.warning("%s of %s words exist on %s, this looks like a wildcard. Stopping brute force." % (
+                    forcer.found, forcer.checked, url.url))
+                url.uses_dns_wildcard = True
+                url.save()
+                break
+
+            if existing:
+                added += url.add_subdomains(existing)
+
+        if forcer.unanswered:
+            logger.info("%s of %s words on %s did not get an answer." % (
+                forcer.unanswered, forcer.checked, url.url))
+    finally:
+        loop.run_until_complete(forcer.__aexit__())
+        loop.close()
+        asyncio.set_event_loop(None)
+
+    logger.debug("Checked %s words on %s, %s exist, %s added." % (forcer.checked, url.url, forcer.found, len(added)))
+    return added
+
+
+def uses_wildcard(domain: str, nameservers: List[str]=None, port: int=DNS_PORT) -> bool:
+    """True if random subdomains of domain exist."""
+    async def check():
+        async with BruteForcer(domain, nameservers=nameservers, port=port) as forcer:
+            return await forcer.wildcard()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(check())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def words_from_file(path: str):
+    """Yields the words in a wordlist, one per line. Empty lines and comments (#) are skipped."""
+    with open(path, encoding='utf-8', errors='replace') as wordlist:
+        for line in wordlist:
+            word = line.strip().lower()
+            if word and not word.startswith('#'):
+                yield word
+
+
+def batches(words: Iterable[str], size: int):
+    """Yields lists of at most size unique words."""
+    words = iter(words)
+    while True:
+        batch = list(dict.fromkeys(itertools.islice(words, size)))
+        if not batch:
+            return
+        yield batch
+
+
+def nonsense_label():
+    # the chance of getting this back as existing is one in gazillions, except for wildcards.
+    return ''.join(random.choice(string.ascii_lowercase) for i in range(WILDCARD_LABEL_LENGTH))
+
+
+def configured_nameservers() -> List[str]:
+    return settings.DNS_BRUTE_FORCE_NAMESERVERS or dns.resolver.get_default_resolver().nameservers
@@ -0,0 +1,159 @@
+"""
+Checks DNSSEC of many zones with long running dnssec_batch.pl processes.
+
+dnssec.pl checks a single zone. Starting perl and loading the DNSCheck modules takes most of the time of a check, so
+running it per zone is slow. dnssec_batch.pl keeps running: it reads zones from stdin and writes the same output as
+dnssec.pl, followed by a line that says the zone is done. When DNSCheck fails on a zone, it says so instead of giving
+output: that zone was not checked at all.
+
+A number of these checkers run side by side, each checking zones from a shared list. A zone that takes longer than
+the timeout stops its checker, which is started again for the next zone.
+
+Usage:
+    results = check(["faalkaart.nl", "example.com"])  # {zone: [output lines], or the exception of a failed check}
+"""
+import logging
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+DONE = "DNSSEC_BATCH_DONE"
+FAILED = "DNSSEC_BATCH_FAILED"
+
+# seconds a checker gets to stop after its input is closed.
+STOP_TIMEOUT = 5
+
+
+class CheckerError(Exception):
+    """The checker stopped, failed on a zone or did not finish a zone in time."""
+
+
+class Checker:
+    """A dnssec_batch.pl process, started when needed."""
+
+    def __init__(self, command: List[str]=None, timeout: float=None):
+        self.command = command or [settings.TOOLS['dnscheck']['batch_executable']]
+        self.timeout = timeout or settings.DNSSEC_TIMEOUT
+        self.process = None
+        self.lines = None
+
+    def check(self, zone: str) -> List[str]:
+        """The output lines of checking a zone."""
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            self.process.stdin.write(zone + "\n")
+            self.process.stdin.flush()
+        except OSError as e:
+            self.stop()
+            raise CheckerError("Checker stopped before checking %s: %s" % (zone, e))
+
+        output = []
+        failure = None
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # the checker is stuck on this zone.
+                self.stop(kill=True)
+                raise CheckerError("Checking %s took more than %s seconds." % (zone, self.timeout))
+
+            if line is None:
+                self.stop()
+                raise CheckerError("Checker stopped while checking %s." % zone)
+
+            if line == "%s %s" % (DONE, zone):
+                if failure is not None:
+                    raise CheckerError("DNSCheck failed on %s: %s" % (zone, failure))
+                return output
+
+            if line.startswith("%s %s" % (FAILED, zone)):
+                # the checker itself keeps running, only this zone was not checked.
+                failure = line[len("%s %s" % (FAILED, zone)):].strip()
+                continue
+
+            output.append(line)
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, universal_newlines=True, bufsize=1)
+        # output is read by a thread, so reading it can be given up at the deadline.
+        self.lines = queue.Queue()
+        threading.Thread(target=read_lines, args=(self.process, self.lines), daemon=True).start()
+
+    def stop(self, kill: bool=False):
+        process, self.process = self.process, None
+        if process is None or process.poll() is not None:
+            return
+
+        if not kill:
+            try:
+                process.stdin.close()
+                process.wait(STOP_TIMEOUT)
+                return
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+
+        process.kill()
+        process.wait()
+
+
+def read_lines(process: subprocess.Popen, lines: queue.Queue):
+    for line in process.stdout:
+        lines.put(line.rstrip("\n"))
+    # end of output: the process stopped.
+    lines.put(None)
+
+
+def check(zones: List[str], checkers: int=None, timeout: float=None, command: List[str]=None) -> Dict[str, object]:
+    """
+    Checks all zones with at most `checkers` checker processes at the same time.
+
+    :param zones: zones (top level urls) to check, duplicates are checked once.
+    :param checkers: amount of checker processes, default DNSSEC_CHECKERS.
+    :param timeout: seconds per zone, default DNSSEC_TIMEOUT.
+    :param command: the checker, default the dnscheck batch_executable.
+    :return: dictionary of zone: list of output lines, or the exception if checking failed.
+    """
+    zones = list(dict.fromkeys(zones))
+    if not zones:
+        return {}
+
+    pending = queue.Queue()
+    for zone in zones:
+        pending.put(zone)
+
+    results = {}
+
+    def work():
+        checker = Checker(command, timeout)
+        try:
+            while True:
+                try:
+                    zone = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    results[zone] = checker.check(zone)
+                except (CheckerError, OSError) as e:
+                    log.info("DNSSEC check of %s failed: %s", zone, e)
+                    results[zone] = e
+        finally:
+            checker.stop()
+
+    amount = min(checkers or settings.DNSSEC_CHECKERS, len(zones))
+    with ThreadPoolExecutor(max_workers=amount) as executor:
+        for future in [executor.submit(work) for _ in range(amount)]:
+            future.result()
+
+    return results
@@ -1,9 +1,12 @@
 import logging
 from datetime import datetime
+from typing import List
 
 import pytz
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import OuterRef, Subquery
 
+from . import heartbeat
 from .models import Endpoint, EndpointGenericScan
 
 logger = logging.getLogger(__package__)
@@ -31,8 +34,7 @@ class EndpointScanManager:
         # last scan date.
         if gs.explanation == message and gs.rating == rating:
             logger.debug("Scan had the same rating and message, updating last_scan_moment only.")
-            gs.last_scan_moment = datetime.now(pytz.utc)
-            gs.save()
+            heartbeat.beat(gs)
         else:
             # message and rating changed for this scan_type, so it's worth while to save the scan.
             logger.debug("Message or rating changed: making a new generic scan.")
@@ -46,6 +48,67 @@ class EndpointScanManager:
             gs.rating_determined_on = datetime.now(pytz.utc)
             gs.save()
 
+    @staticmethod
+    def add_scans(scans: List[tuple]):
+        """
+        Stores many scans at once, with the same deduplication as add_scan.
+
+        The latest scans of all given endpoints and scan types are retrieved in one query. Scans that did not
+        change get their last_scan_moment updated via a heartbeat, changed scans are inserted in one query.
+
+        :param scans: list of (scan_type, endpoint, rating, message) or (scan_type, endpoint, rating, message,
+                      evidence). If the same endpoint and scan_type occur more than once, the last one is stored.
+        """
+        if not scans:
+            return
+
+        # one scan per endpoint and type
+        new_scans = {}
+        for scan in scans:
+            scan_type, endpoint, rating, message = scan[0:4]
+            evidence = scan[4] if len(scan) > 4 else ""
+            new_scans[(scan_type, endpoint.pk)] = (scan_type, endpoint, rating, message, evidence)
+
+        latest = EndpointGenericScan.objects.filter(
+            type=OuterRef('type'),
+            endpoint=OuterRef('endpoint'),
+        ).order_by('-last_scan_moment').values('id')[:1]
+
+        current_scans = EndpointGenericScan.objects.all().filter(
+            type__in=set(scan_type for scan_type, _ in new_scans.keys()),
+            endpoint__in=set(pk for _, pk in new_scans.keys()),
+            id=Subquery(latest),
+        ).only('id', 'type', 'endpoint_id', 'rating', 'explanation')
+        current = {(gs.type, gs.endpoint_id): gs for gs in current_scans}
+
+        now = datetime.now(pytz.utc)
+        unchanged = []
+        changed = []
+        for key, (scan_type, endpoint, rating, message, evidence) in new_scans.items():
+            gs = current.get(key, None)
+
+            # last scan had exactly the same result, so don't create a new scan and just update the
+            # last scan date.
+            if gs and gs.explanation == message and gs.rating == rating:
+                unchanged.append(gs)
+            else:
+                changed.append(EndpointGenericScan(
+                    explanation=message,
+                    rating=rating,
+                    endpoint=endpoint,
+                    type=scan_type,
+                    evidence=evidence,
+                    last_scan_moment=now,
+                    rating_determined_on=now,
+                ))
+
+        logger.debug("Storing %s scans: %s unchanged, %s changed." % (len(new_scans), len(unchanged), len(changed)))
+
+        for gs in unchanged:
+            heartbeat.beat(gs, now)
+        if changed:
+            EndpointGenericScan.objects.bulk_create(changed)
+
     @staticmethod
     def had_scan_with_points(scan_type: str, endpoint: Endpoint):
         """
@@ -0,0 +1,194 @@
+"""
+Write-behind buffer for "nothing changed" scan results.
+
+Most scans don't change anything: the only thing that is stored is that the latest scan is still valid, by
+moving its last_scan_moment forward. Saving a complete row for every one of those is a lot of work for the
+database. Instead, these heartbeats are collected and written periodically as a few
+UPDATE ... SET last_scan_moment = CASE id WHEN ... END WHERE id IN (...) per table.
+
+The buffer lives in Redis when that is the broker, so any worker can flush what all workers collected. Otherwise
+every process keeps its own buffer, which is flushed when it becomes too large or too old, and when the worker
+process stops.
+
+Readers that need the exact last_scan_moment call flush() first.
+
+Usage:
+    beat(previous_scan)
+    flush()
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pytz
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Case, Value, When
+
+from failmap.celery import app, redis_client
+
+log = logging.getLogger(__package__)
+
+# Flush at least this often (seconds) and when more than this amount of heartbeats are waiting.
+FLUSH_INTERVAL = getattr(settings, 'HEARTBEAT_FLUSH_INTERVAL', 300)
+FLUSH_SIZE = getattr(settings, 'HEARTBEAT_FLUSH_SIZE', 5000)
+
+KEY_PREFIX = 'failmap:heartbeat'
+
+# The amount of rows that are written in a single query.
+ROWS_PER_UPDATE = 500
+
+
+# The fields that represent the moment of the latest scan, per model.
+def _moment_fields(moment: datetime):
+    return {'last_scan_moment': moment}
+
+
+def _tls_moment_fields(moment: datetime):
+    return {'last_scan_moment': moment, 'scan_time': moment.time(), 'scan_date': moment.date()}
+
+
+MODELS = {
+    'scanners.EndpointGenericScan': _moment_fields,
+    'scanners.UrlGenericScan': _moment_fields,
+    'scanners.TlsQualysScan': _tls_moment_fields,
+}
+
+
+class MemoryBuffer:
+    """Heartbeats of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.beats = defaultdict(dict)
+        self.since = time.time()
+
+    def add(self, model_label: str, pk: int, moment: float):
+        with self.lock:
+            self.beats[model_label][pk] = moment
+            return sum(len(beats) for beats in self.beats.values())
+
+    def take(self):
+        with self.lock:
+            beats, self.beats = self.beats, defaultdict(dict)
+            self.since = time.time()
+        return beats
+
+    def age(self):
+        return time.time() - self.since
+
+
+class RedisBuffer:
+    """Heartbeats of all workers, stored as a hash of id: timestamp per model."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def add(self, model_label: str, pk: int, moment: float):
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.hset(self.key(model_label), pk, moment)
+        pipeline.hlen(self.key(model_label))
+        return pipeline.execute()[1]
+
+    def take(self):
+        beats = {}
+        for model_label in MODELS:
+            # read and empty in one go, so no heartbeats of other workers get lost in between.
+            pipeline = self.client.pipeline(transaction=True)
+            pipeline.hgetall(self.key(model_label))
+            pipeline.delete(self.key(model_label))
+            stored = pipeline.execute()[0]
+            beats[model_label] = {int(pk): float(moment) for pk, moment in stored.items()}
+        return beats
+
+    def age(self):
+        # periodic flushing is done by the flush_heartbeats task.
+        return 0
+
+    @staticmethod
+    def key(model_label: str):
+        return "%s:%s" % (KEY_PREFIX, model_label)
+
+
+_memory_buffer = MemoryBuffer()
+
+
+def _buffer():
+    if getattr(settings, 'HEARTBEAT_BACKEND', 'auto') != 'memory':
+        client = redis_client()
+        if client:
+            return RedisBuffer(client)
+    return _memory_buffer
+
+
+def beat(scan, moment: datetime=None):
+    """
+    Registers that the scan is still valid at this moment. Written to the database later, see flush().
+
+    :param scan: an EndpointGenericScan, UrlGenericScan or TlsQualysScan.
+    :param moment: moment of the scan, defaults to now.
+    """
+    model_label = scan._meta.label
+    if model_label not in MODELS:
+        raise ValueError("No heartbeats for %s." % model_label)
+
+    moment = moment or datetime.now(pytz.utc)
+
+    buffer = _buffer()
+    try:
+        waiting = buffer.add(model_label, scan.pk, moment.timestamp())
+    except Exception as ex:
+        # the broker is unreachable, keep the heartbeat in this process instead.
+        log.debug("Could not store heartbeat in shared buffer: %s" % ex)
+        buffer = _memory_buffer
+        waiting = buffer.add(model_label, scan.pk, moment.timestamp())
+
+    if waiting >= FLUSH_SIZE or buffer.age() >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    """
+    Writes all waiting heartbeats to the database, with an update per ROWS_PER_UPDATE rows per table.
+
+    Every row gets the moment of its own latest heartbeat. Newer scans of the same thing are stored as a new row, so
+    an older row never ends up with a later moment than the row that replaced it.
+    """
+    buffers = [_memory_buffer]
+    if _buffer() is not _memory_buffer:
+        buffers.append(_buffer())
+
+    for buffer in buffers:
+        try:
+            _write(buffer.take())
+        except Exception as ex:
+            log.warning("Could not flush heartbeats: %s" % ex)
+
+
+def _write(beats):
+    for model_label, moments in beats.items():
+        if not moments:
+            continue
+
+        model = apps.get_model(model_label)
+        fields = {pk: MODELS[model_label](datetime.fromtimestamp(moment, pytz.utc)) for pk, moment in moments.items()}
+        pks = list(fields.keys())
+
+        updated = 0
+        for i in range(0, len(pks), ROWS_PER_UPDATE):
+            chunk = pks[i:i + ROWS_PER_UPDATE]
+            values = {
+                name: Case(*[When(id=pk, then=Value(fields[pk][name])) for pk in chunk],
+                           output_field=model._meta.get_field(name))
+                for name in fields[chunk[0]]
+            }
+            updated += model.objects.all().filter(id__in=chunk).update(**values)
+        log.debug("Flushed %s heartbeats of %s." % (updated, model_label))
+
+
+@app.task(queue='storage')
+def flush_heartbeats():
+    """Periodic task, see the production fixture."""
+    flush()
@@ -0,0 +1,163 @@
+"""
+Batched, asynchronous discovery of http(s) endpoints.
+
+Endpoint discovery used to create a task per url, port, protocol and ip version, where every task waited on a
+single blocking socket for up to a minute. Almost all of that time is spent idle. This module contacts a whole batch
+of targets from a single event loop on a single worker, which answers the same question as `can_connect` in
+scanner_http: is there "something" that speaks http(s) on this ip and port?
+
+The amount of simultaneous connections is capped in two ways:
+- globally, so our own network (card) and firewalls can keep up.
+- per ip address, so a single server (or the firewall in front of it) is never contacted more than a few times at once.
+  We don't want to look hostile.
+Next to that, every target waits for a token of the rate limit that is shared by all workers and scanners, see
+ratelimit. Tokens are taken in a thread, so waiting on redis doesn't stall the other probes.
+
+Only python standard library is used: we only need the first line of a response, not a complete http client.
+"""
+import asyncio
+import logging
+import random
+import ssl
+from collections import defaultdict, namedtuple
+from typing import List
+
+from failmap.scanners import ratelimit
+from failmap.scanners.http_session import get_random_user_agent
+
+logger = logging.getLogger(__package__)
+
+# A single thing to contact. The host is the name of the url, which is sent as Host header. The url_id is passed on
+# to store the result.
+Target = namedtuple('Target', ['url_id', 'host', 'ip', 'port', 'protocol'])
+
+# maximum amount of open connections from one batch
+GLOBAL_CONCURRENCY = 200
+
+# maximum amount of open connections to a single ip address
+PER_HOST_CONCURRENCY = 2
+
+# 30 seconds network timeout, 30 seconds timeout for server response. The same as can_connect.
+TIMEOUTS = (30, 30)
+
+
+def probe_batch(targets: List[Target], concurrency: int=GLOBAL_CONCURRENCY,
+                per_host_concurrency: int=PER_HOST_CONCURRENCY, timeouts=TIMEOUTS) -> List[bool]:
+    """
+    Contacts all targets concurrently and returns if there is a http(s) server on each of them.
+
+    :param targets: list of Target
+    :param concurrency: maximum number of simultaneous connections for the whole batch.
+    :param per_host_concurrency: maximum number of simultaneous connections to the same ip address.
+    :param timeouts: tuple with connect timeout and read timeout in seconds.
+    :return: list of booleans, in the same order as the targets.
+    """
+    if not targets:
+        return []
+
+    # Every batch gets its own loop: this function is called from celery workers that don't run an event loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(_probe_all(targets, concurrency, per_host_concurrency, timeouts))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+async def _probe_all(targets, concurrency, per_host_concurrency, timeouts):
+    everything = asyncio.Semaphore(concurrency)
+    per_host = defaultdict(lambda: asyncio.Semaphore(per_host_concurrency))
+
+    async def limited(target):
+        # wait for the host first, so a busy host does not claim slots of the global limit.
+        async with per_host[target.ip]:
+            await polite(target)
+            async with everything:
+                return await probe(target, timeouts)
+
+    # Start in random order: this spreads the load over the hosts in the batch.
+    order = list(range(len(targets)))
+    random.shuffle(order)
+    results = await asyncio.gather(*[limited(targets[index]) for index in order])
+
+    # and return them in the order they where asked for.
+    ordered = [False] * len(targets)
+    for index, result in zip(order, results):
+        ordered[index] = result
+    return ordered
+
+
+async def polite(target: Target):
+    """
+    Waits until the target may be contacted. Other targets of the batch are contacted in the mean time.
+
+    Taking a token is a round trip to redis: it's done in a thread, so the loop keeps serving the other probes.
+    """
+    loop = asyncio.get_event_loop()
+    buckets = ratelimit.target(target.host, target.ip)
+    wait = await loop.run_in_executor(None, ratelimit.acquire, *buckets)
+    while wait:
+        await asyncio.sleep(wait)
+        wait = await loop.run_in_executor(None, ratelimit.acquire, *buckets)
+
+
+async def probe(target: Target, timeouts=TIMEOUTS) -> bool:
+    """
+    Has the same outcome as `can_connect`: any response, even a broken one, means there is a server.
+
+    TLS does not have to be successful: as long as there is a "sort of" response we assume there is a website.
+    Redirects are not followed, a redirect also means there is a server. A timeout, a refused connection or a
+    connection that is closed without a single byte of response means there is nothing.
+    """
+    connect_timeout, read_timeout = timeouts
+
+    context = None
+    if target.protocol == "https":
+        # any tls = connection, certificate validity is checked elsewhere.
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(target.ip, target.port, ssl=context,
+                                    server_hostname=target.host if context else None),
+            connect_timeout)
+    except asyncio.TimeoutError:
+        logger.debug("%s: Timeout on connect to %s:%s" % (target.host, target.ip, target.port))
+        return False
+    except ssl.SSLError as Ex:
+        # A bad handshake, the server is there, but we're not able to communicate with it correctly.
+        logger.debug("%s: TLS handshake failed, but there is a server: %s" % (target.host, Ex))
+        return True
+    except OSError as Ex:
+        # Refused, unreachable, reset and friends.
+        logger.debug("%s: Could not connect to %s:%s: %s" % (target.host, target.ip, target.port, Ex))
+        return False
+
+    request = "GET / HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nAccept: */*\r\nConnection: close\r\n\r\n" % (
+        target.host, get_random_user_agent())
+
+    try:
+        writer.write(request.encode('ascii', errors='ignore'))
+        # Any status line is enough. Also garbage: BadStatusLine means there is a server.
+        status_line = await asyncio.wait_for(reader.readline(), read_timeout)
+    except asyncio.TimeoutError:
+        logger.debug("%s: Timeout waiting for response from %s:%s" % (target.host, target.ip, target.port))
+        return False
+    except ssl.SSLError as Ex:
+        logger.debug("%s: TLS error after connect, but there is a server: %s" % (target.host, Ex))
+        return True
+    except ValueError:
+        # An absurdly long first line is still a response.
+        return True
+    except OSError as Ex:
+        logger.debug("%s: Connection error on %s:%s: %s" % (target.host, target.ip, target.port, Ex))
+        return False
+    finally:
+        writer.close()
+
+    logger.debug("%s://%s:%s Host: %s Response: %s" % (
+        target.protocol, target.ip, target.port, target.host, status_line.strip()))
+    return bool(status_line)
@@ -0,0 +1,155 @@
+"""
+Shared http sessions for scanners.
+
+Calling requests.get creates a new session, and thus a new connection (and TLS handshake), for every request. This
+module hands out a session per worker thread (per worker on green threads), so connections to the same host and port
+are reused. That matters most when following redirects, which often point to the same host, and when scanning
+multiple ports of the same server.
+
+Sessions come in profiles. A profile determines the timeouts and retry policy of every request made with it:
+- default: general purpose, for fetching pages and API's. Retries connection errors once.
+- probe: checking if something exists. Never retries: a second attempt on a dead host only doubles the time spent.
+
+Every request gets a random user agent, unless a User-Agent header is given.
+
+Usage:
+    response = session().get(uri, allow_redirects=True, verify=False)
+    response = session('probe').get(uri, allow_redirects=False, verify=False, headers={'Host': url.url})
+"""
+import logging
+import random
+import threading
+from types import SimpleNamespace
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from failmap.celery.worker import green_threads
+
+log = logging.getLogger(__package__)
+
+PROFILES = {
+    'default': {
+        # 10 seconds for network delay, 10 seconds for the site to respond.
+        'timeout': (10, 10),
+        'retries': Retry(total=1, connect=1, read=0, status=0, backoff_factor=0.5),
+    },
+    'probe': {
+        # 30 seconds network timeout, 30 seconds timeout for server response. Allow for insane network lag.
+        'timeout': (30, 30),
+        'retries': Retry(total=0, read=False),
+    },
+}
+
+# Number of hosts to keep connections of, and the number of connections kept per host. Workers scan many different
+# hosts, but only contact a few of them at the same time.
+POOL_CONNECTIONS = 50
+POOL_MAXSIZE = 4
+
+_sessions = threading.local()
+# On green threads every task is a new thread: all tasks of the worker share the same sessions instead.
+_green_sessions = SimpleNamespace()
+
+
+class ScannerSession(requests.Session):
+    """Session with default timeouts and a random user agent per request."""
+
+    def __init__(self, timeout):
+        super(ScannerSession, self).__init__()
+        self.default_timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.default_timeout)
+
+        headers = kwargs.get('headers') or {}
+        if 'User-Agent' not in headers:
+            headers = dict(headers)
+            headers['User-Agent'] = get_random_user_agent()
+        kwargs['headers'] = headers
+
+        return super(ScannerSession, self).request(method, url, **kwargs)
+
+
+def session(profile: str='default') -> ScannerSession:
+    """Returns the session of this thread for the given profile, creates it when needed."""
+    sessions = getattr(_holder(), 'sessions', None)
+    if sessions is None:
+        sessions = _holder().sessions = {}
+
+    if profile not in sessions:
+        sessions[profile] = _create_session(profile)
+    return sessions[profile]
+
+
+def _create_session(profile: str) -> ScannerSession:
+    settings = PROFILES[profile]
+
+    new_session = ScannerSession(timeout=settings['timeout'])
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                          max_retries=settings['retries'])
+    new_session.mount('http://', adapter)
+    new_session.mount('https://', adapter)
+    return new_session
+
+
+def close():
+    """Closes all sessions of this thread, for example when a worker shuts down."""
+    log.info("Http connection statistics: %s" % stats())
+
+    sessions = getattr(_holder(), 'sessions', {})
+    for profile_session in sessions.values():
+        profile_session.close()
+    _holder().sessions = {}
+
+
+def stats():
+    """
+    Connection reuse statistics of the sessions of this thread.
+
+    Every request that did not need a new connection is a reused connection.
+
+    :return: dictionary per profile with the number of pools (host/port combinations), connections and requests.
+    """
+    result = {}
+    for profile, profile_session in getattr(_holder(), 'sessions', {}).items():
+        pools = []
+        for adapter in set(profile_session.adapters.values()):
+            pools += [adapter.poolmanager.pools[key] for key in adapter.poolmanager.pools.keys()]
+
+        connections = sum(pool.num_connections for pool in pools)
+        requests_made = sum(pool.num_requests for pool in pools)
+        result[profile] = {
+            'pools': len(pools),
+            'connections': connections,
+            'requests': requests_made,
+            'reused': requests_made - connections,
+        }
+    return result
+
+
+def _holder():
+    return _green_sessions if green_threads() else _sessions
+
+
+# http://useragentstring.com/pages/useragentstring.php/
+def get_random_user_agent():
+    user_agents = [
+        # Samsung Galaxy S6
+        "Mozilla/5.0 (Linux; Android 6.0.1; SM-G920V Build/MMB29K) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/52.0.2743.98 Mobile Safari/537.36",
+        # HTC One M9
+        "Mozilla/5.0 (Linux; Android 6.0; HTC One M9 Build/MRA58K) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/52.0.2743.98 Mobile Safari/537.36",
+        # Windows 10 with Edge
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/42.0.2311.135 Safari/537.36 Edge/12.246",
+        # Safari
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_2) AppleWebKit/601.3.9 "
+        "(KHTML, like Gecko) Version/9.0.2 Safari/601.3.9",
+        # Windows 7
+        "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/47.0.2526.111 Safari/537.36"
+    ]
+
+    return random.choice(user_agents)
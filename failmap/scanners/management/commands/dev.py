@@ -145,6 +145,6 @@ def test_can_connect_to_organization():
     for url in urls:
         ipv4, ipv6 = get_ips(url.url)
         if ipv4:
-            logger.info(can_connect("http", url, 80, ipv4))
+            logger.info(can_connect("http", url.url, 80, ipv4))
         if ipv6:
-            logger.info(can_connect("http", url, 80, ipv6))
+            logger.info(can_connect("http", url.url, 80, ipv6))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from failmap.scanners.scanner_screenshot import endpoints_showing, identical_pages
+
+
+class Command(BaseCommand):
+    help = 'Lists pages that are shown by several endpoints, such as default pages of web servers and parked domains.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minimum', type=int, default=2,
+                            help="Only pages that are shown by at least this many endpoints.")
+        parser.add_argument('--days', type=int, default=31, help="Only use screenshots of the last days.")
+        parser.add_argument('--show-endpoints', action='store_true', help="List the endpoints of every page.")
+
+    def handle(self, *args, **options):
+        for page in identical_pages(minimum_endpoints=options['minimum'], days=options['days']):
+            self.stdout.write("%s: %s endpoints" % (page['perceptual_hash'], page['endpoints']))
+
+            if options['show_endpoints']:
+                for endpoint in endpoints_showing(page['perceptual_hash'], days=options['days']):
+                    self.stdout.write("    %s" % endpoint.uri_url())
@@ -0,0 +1,41 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+
+from failmap.app.common import ResultEncoder
+from failmap.scanners.qualys_manager import AssessmentManager
+from failmap.scanners.scanner_tls_qualys import process_qualys_results, urls_to_scan
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Runs Qualys assessments for all urls that need one, from this process. See qualys_manager."""
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--organization_names', nargs='*',
+                            help="Perform scans on these organizations (default is all).")
+        parser.add_argument('--max-assessments', type=int, default=None,
+                            help="Upper limit of concurrent assessments (default: QUALYS_MAX_ASSESSMENTS).")
+        parser.add_argument('--store', default='async', choices=['direct', 'async'],
+                            help="Store results in this process or on the storage queue.")
+
+    def handle(self, *args, **options):
+        organization_filter = dict()
+        if options['organization_names']:
+            # create a case-insensitive filter to match organizations by name
+            organization_filter = {'name__iregex': '^(' + '|'.join(options['organization_names']) + ')$'}
+
+        urls = urls_to_scan(organization_filter)
+        log.info("Assessing %s urls." % len(urls))
+
+        if options['store'] == 'direct':
+            handle_results = process_qualys_results
+        else:
+            handle_results = process_qualys_results.delay
+
+        manager = AssessmentManager(urls, handle_results, max_assessments=options['max_assessments'])
+        return json.dumps(manager.run(), cls=ResultEncoder)
@@ -1,8 +1,8 @@
 import logging
 
 from failmap.app.management.commands._private import ScannerTaskCommand
-from failmap.scanners import (scanner_dns, scanner_dnssec, scanner_http, scanner_plain_http,
-                              scanner_security_headers, scanner_tls_qualys)
+from failmap.scanners import (scanner_dns, scanner_dnssec, scanner_http, scanner_observation,
+                              scanner_plain_http, scanner_security_headers, scanner_tls_qualys)
 
 log = logging.getLogger(__name__)
 
@@ -24,7 +24,8 @@ class Command(ScannerTaskCommand):
             'plain': scanner_plain_http,
             'endpoints': scanner_http,
             'tls': scanner_tls_qualys,
-            'dns': scanner_dns
+            'dns': scanner_dns,
+            'observe': scanner_observation,
         }
 
         if options['scanner'][0] not in scanners:
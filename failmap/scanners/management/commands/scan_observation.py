@@ -0,0 +1,14 @@
+import logging
+
+from failmap.app.management.commands._private import ScannerTaskCommand
+from failmap.scanners import scanner_observation
+
+log = logging.getLogger(__name__)
+
+
+class Command(ScannerTaskCommand):
+    """Visit selected endpoints once and rate their security headers, plain http and liveness."""
+
+    help = __doc__
+
+    scanner_module = scanner_observation
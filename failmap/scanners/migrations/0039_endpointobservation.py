@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import jsonfield.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scanners', '0038_auto_20180313_1045'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndpointObservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('when', models.DateTimeField(db_index=True, help_text='When the endpoint was visited.')),
+                ('reachable', models.BooleanField(
+                    default=False,
+                    help_text='If there was any response at all. A failed TLS handshake is also a response.')),
+                ('status_code', models.IntegerField(
+                    blank=True, null=True,
+                    help_text='Status code of the final response, after following all redirects.')),
+                ('headers', jsonfield.fields.JSONField(
+                    default=dict, help_text='Headers of the final response, after following all redirects.')),
+                ('redirects', jsonfield.fields.JSONField(
+                    default=list, help_text='List of [status code, url] for every redirect that was followed.')),
+                ('final_url', models.TextField(blank=True, help_text='The url where the redirects ended.')),
+                ('tls', models.CharField(
+                    blank=True, max_length=255,
+                    help_text="Outcome of the TLS handshake: 'ok', the error message or empty when not using TLS.")),
+                ('error', models.CharField(blank=True, help_text='Why there was no (proper) response.',
+                                           max_length=255)),
+                ('endpoint', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE,
+                                                  related_name='observation', to='scanners.Endpoint')),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scanners', '0039_endpointobservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='screenshot',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64,
+                                   help_text='SHA-256 of the image. Images are stored once, under this name.'),
+        ),
+        migrations.AddField(
+            model_name='screenshot',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=16,
+                                   help_text='Difference hash of the image (64 bits, hex). Pages that look the same '
+                                             'have the same hash, such as default pages of web servers and parked '
+                                             'domains.'),
+        ),
+        migrations.AddField(
+            model_name='screenshot',
+            name='last_scan_moment',
+            field=models.DateTimeField(blank=True, db_index=True, null=True,
+                                       help_text="The last time the page looked like this. Unchanged pages don't "
+                                                 "get a new screenshot."),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scanners', '0040_screenshot_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scanner', models.CharField(max_length=40)),
+                ('target_id', models.PositiveIntegerField(
+                    help_text='Id of the url or endpoint, depending on the scanner.')),
+                ('last_scan_moment', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='scanschedule',
+            unique_together=set([('scanner', 'target_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='scanschedule',
+            index_together=set([('scanner', 'last_scan_moment')]),
+        ),
+    ]
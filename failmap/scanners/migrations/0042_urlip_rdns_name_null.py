@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scanners', '0041_scanschedule'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='urlip',
+            name='rdns_name',
+            field=models.CharField(
+                blank=True, help_text='The reverse name can be a server name, containing a provider or anything else.It might contain the name of a yet undiscovered url or hint to a service. Empty when the address has no reverse name, null until it is looked up.', max_length=255, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 # coding=UTF-8
 from django.db import models
+from jsonfield import JSONField
 
 from failmap.organizations.models import Url
 
@@ -101,6 +102,70 @@ class Endpoint(models.Model):
         return self.ip_version == 6
 
 
+class EndpointObservation(models.Model):
+    """
+    What an endpoint answered the last time it was visited.
+
+    Endpoints are visited once per scan cycle, after which several analyzers (security headers, plain http and
+    liveness) rate the endpoint based on this observation. This saves contacting the same endpoint for every
+    scanner and makes these scans consistent with each other.
+
+    Only the latest observation is kept.
+    """
+
+    endpoint = models.OneToOneField(
+        Endpoint,
+        on_delete=models.CASCADE,
+        related_name='observation'
+    )
+
+    when = models.DateTimeField(
+        db_index=True,
+        help_text="When the endpoint was visited."
+    )
+
+    reachable = models.BooleanField(
+        default=False,
+        help_text="If there was any response at all. A failed TLS handshake is also a response."
+    )
+
+    status_code = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Status code of the final response, after following all redirects."
+    )
+
+    headers = JSONField(
+        default=dict,
+        help_text="Headers of the final response, after following all redirects."
+    )
+
+    redirects = JSONField(
+        default=list,
+        help_text="List of [status code, url] for every redirect that was followed."
+    )
+
+    final_url = models.TextField(
+        blank=True,
+        help_text="The url where the redirects ended."
+    )
+
+    tls = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Outcome of the TLS handshake: 'ok', the error message or empty when not using TLS."
+    )
+
+    error = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="Why there was no (proper) response."
+    )
+
+    def __str__(self):
+        return "%s: %s %s" % (self.when, self.status_code, self.endpoint)
+
+
 class UrlIp(models.Model):
     """
     IP addresses of endpoints change constantly. They are more like metadata. The IP metadata can
@@ -135,8 +200,10 @@ class UrlIp(models.Model):
     rdns_name = models.CharField(
         max_length=255,
         help_text="The reverse name can be a server name, containing a provider or anything else."
-                  "It might contain the name of a yet undiscovered url or hint to a service.",
-        blank=True
+                  "It might contain the name of a yet undiscovered url or hint to a service. Empty when the "
+                  "address has no reverse name, null until it is looked up.",
+        blank=True,
+        null=True
     )
 
     discovered_on = models.DateTimeField(blank=True, null=True)
@@ -304,6 +371,16 @@ class Screenshot(models.Model):
     width_pixels = models.IntegerField(default=0)
     height_pixels = models.IntegerField(default=0)
     created_on = models.DateTimeField(auto_now_add=True, db_index=True)
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True,
+        help_text="SHA-256 of the image. Images are stored once, under this name.")
+    perceptual_hash = models.CharField(
+        max_length=16, blank=True, db_index=True,
+        help_text="Difference hash of the image (64 bits, hex). Pages that look the same have the same hash, "
+                  "such as default pages of web servers and parked domains.")
+    last_scan_moment = models.DateTimeField(
+        null=True, blank=True, db_index=True,
+        help_text="The last time the page looked like this. Unchanged pages don't get a new screenshot.")
 
 
 # A debugging table to help with API interactions.
@@ -327,3 +404,16 @@ class State(models.Model):
     scanner = models.CharField(max_length=255, unique=True)
     value = models.CharField(max_length=255)
     since = models.DateTimeField(auto_now_add=True)
+
+
+class ScanSchedule(models.Model):
+    """
+    When a target was last handed to a scanner. Used to scan the most overdue targets first, see scheduler.
+    """
+    scanner = models.CharField(max_length=40)
+    target_id = models.PositiveIntegerField(help_text="Id of the url or endpoint, depending on the scanner.")
+    last_scan_moment = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('scanner', 'target_id')
+        index_together = [('scanner', 'last_scan_moment')]
@@ -0,0 +1,161 @@
+"""
+Publishes the tasks of large scans in chunks, without flooding the broker.
+
+compose_task used to build one celery group with a task for every endpoint. That group is built in memory, pickled
+and published at once: hundreds of thousands of messages in the broker and as many results to track for the Job.
+Scanners with that many targets now compose a single produce_tasks task instead. It runs on a storage worker and:
+
+- iterates the targets with .iterator(), ordered by id, so they are never all in memory.
+- publishes the tasks of every PRODUCER_CHUNK_SIZE targets over one broker connection.
+- pauses while more than PRODUCER_HIGH_WATER messages are waiting in the queues of the scanner. A paused run does not
+  wait on the worker: it stops and is resumed by a new task PRODUCER_PAUSE seconds later.
+- keeps its progress in State, "producer <module>": status, id of the last published target and counts. A run that
+  stopped can be resumed from there. Filtered runs (from the admin or the command line) keep their own progress, in
+  "producer <module> <hash of the filters>", so they never continue or restart another run.
+
+A scanner module that is produced this way implements:
+    producer_targets(organizations_filter, urls_filter, endpoints_filter) -> QuerySet of urls or endpoints
+    producer_tasks(targets) -> list of task signatures for a chunk of targets
+    PRODUCER_QUEUES: the queues these tasks end up in
+
+Usage:
+    task = produce_tasks.si('failmap.scanners.scanner_security_headers', organizations_filter)
+    produce_tasks.delay('failmap.scanners.scanner_security_headers', resume=True)
+"""
+import hashlib
+import importlib
+import json
+import logging
+from itertools import islice
+from typing import Iterable, List
+
+from django.conf import settings
+
+from failmap.celery import app
+from failmap.scanners.state_manager import StateManager
+
+log = logging.getLogger(__package__)
+
+
+@app.task(queue='storage', bind=True)
+def produce_tasks(self, module_name: str, organizations_filter: dict=dict(), urls_filter: dict=dict(),
+                  endpoints_filter: dict=dict(), resume: bool=False) -> dict:
+    """
+    Publishes the tasks of a scanner for all its targets, chunk by chunk.
+
+    :param module_name: scanner module, see above.
+    :param resume: continue after the last published target of the previous run with the same filters, unless that
+        run was done.
+    :return: the progress record, of the part until the run paused. When executed eagerly: the results of all tasks,
+        like a group would return.
+    """
+    module = importlib.import_module(module_name)
+
+    key = state_key(module_name, organizations_filter, urls_filter, endpoints_filter)
+
+    record = {'status': 'running', 'last_pk': 0, 'targets': 0, 'tasks': 0}
+    previous = progress(key)
+    if resume and previous and previous['status'] != 'done':
+        record.update(previous, status='running')
+        log.info("Resuming %s after id %s." % (module_name, record['last_pk']))
+
+    targets = module.producer_targets(organizations_filter, urls_filter, endpoints_filter)
+    targets = targets.filter(pk__gt=record['last_pk']).order_by('pk')
+
+    results = []
+    save_progress(key, record)
+    try:
+        for chunk in chunks(targets.iterator(), settings.PRODUCER_CHUNK_SIZE):
+            tasks = module.producer_tasks(chunk)
+
+            if self.request.is_eager:
+                # executed directly (without a broker), for example by a management command.
+                results.extend(task.apply().get(propagate=False) for task in tasks)
+            else:
+                if queues_full(module.PRODUCER_QUEUES):
+                    return pause(module_name, record, organizations_filter, urls_filter, endpoints_filter)
+                publish(tasks)
+
+            record.update(last_pk=chunk[-1].pk, targets=record['targets'] + len(chunk),
+                          tasks=record['tasks'] + len(tasks))
+            save_progress(key, record)
+    except BaseException:
+        record['status'] = 'failed'
+        save_progress(key, record)
+        raise
+
+    record['status'] = 'done'
+    save_progress(key, record)
+    log.info("Published %s tasks for %s targets of %s." % (record['tasks'], record['targets'], module_name))
+    return results if self.request.is_eager else record
+
+
+def chunks(iterable: Iterable, size: int) -> Iterable[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def publish(tasks: List):
+    """Publishes tasks over a single connection to the broker."""
+    with app.producer_or_acquire() as producer:
+        for task in tasks:
+            task.apply_async(producer=producer)
+
+
+def queues_full(queues: List[str]) -> bool:
+    """If the queues are above the high water mark."""
+    return queue_depth(queues) > settings.PRODUCER_HIGH_WATER
+
+
+def pause(module_name: str, record: dict, organizations_filter: dict, urls_filter: dict, endpoints_filter: dict):
+    """Stops this run and resumes it in a new task later, so the worker is free while the scanners catch up."""
+    log.info("Queues of %s are full, pausing for %s seconds." % (module_name, settings.PRODUCER_PAUSE))
+    record['status'] = 'paused'
+    save_progress(state_key(module_name, organizations_filter, urls_filter, endpoints_filter), record)
+
+    produce_tasks.apply_async((module_name, organizations_filter, urls_filter, endpoints_filter), {'resume': True},
+                              countdown=settings.PRODUCER_PAUSE)
+    return record
+
+
+def queue_depth(queues: List[str]) -> int:
+    """Amount of messages waiting in these queues, all priorities included."""
+    depth = 0
+    with app.connection_or_acquire() as connection:
+        for queue in queues:
+            channel = connection.channel()
+            try:
+                depth += channel.queue_declare(queue=queue, passive=True).message_count
+            except Exception as e:
+                # the queue does not exist (yet): nothing is waiting.
+                log.debug("Could not get size of queue %s: %s" % (queue, e))
+            finally:
+                channel.close()
+    return depth
+
+
+def progress(key: str):
+    """The progress record of the latest run with this state_key, or None."""
+    value = StateManager.get_state(key)
+    try:
+        return json.loads(value) if value else None
+    except ValueError:
+        return None
+
+
+def save_progress(key: str, record: dict):
+    StateManager.set_state(key, json.dumps(record, separators=(',', ':'), sort_keys=True))
+
+
+def state_key(module_name: str, organizations_filter: dict=dict(), urls_filter: dict=dict(),
+              endpoints_filter: dict=dict()) -> str:
+    """Runs with different filters have different progress. The filters are hashed: keys are at most 255 long."""
+    filters = [organizations_filter or {}, urls_filter or {}, endpoints_filter or {}]
+    if not any(filters):
+        return "producer %s" % module_name
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+    return "producer %s %s" % (module_name, digest[:12])
@@ -0,0 +1,247 @@
+"""
+Runs Qualys SSL Labs assessments for many urls from a single, long running process.
+
+The qualys_scan task polls by retrying itself, which sends every poll through the broker, and its concurrency is
+limited by a rate limit per worker. The assessment manager keeps a number of assessments running and polls all of
+them from one event loop. Requests to the API are made in a thread pool, using the shared http sessions.
+
+The API tells how busy it is, and the manager adapts to that:
+- X-Max-Assessments / X-Current-Assessments headers: never run more assessments than the API allows for this client,
+  also taking assessments of other processes on the same IP into account.
+- "Concurrent assessment limit reached": lower the amount of running assessments to what is running now.
+- "Running at full capacity" and "Too many new assessments too fast": start new assessments less often.
+Every assessment that starts without complaints slowly raises the amount of assessments and the pace again.
+
+Finished assessments are handed to process_qualys_results in batches.
+
+Usage:
+    manager = AssessmentManager(urls, handle_results=process_qualys_results.delay)
+    manager.run()
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+
+from failmap.scanners.scanner_tls_qualys import assessment_request
+from failmap.scanners.scratchpad import scratch
+
+log = logging.getLogger(__name__)
+
+# Give up on an assessment after this amount of polls, about 20 minutes with the default poll interval.
+MAX_POLLS = 60
+# Give up on an url after this amount of failed requests (network errors, unknown API errors).
+MAX_FAILURES = 5
+# Give up on an url when the API was too busy to start its assessment this many times.
+MAX_REQUEUES = 10
+# Slowest pace of starting new assessments, in seconds.
+MAX_NEW_ASSESSMENT_INTERVAL = 600
+
+FULL_CAPACITY = "Running at full capacity"
+CONCURRENT_LIMIT = "Concurrent assessment limit reached"
+TOO_FAST = "Too many new assessments too fast"
+
+
+class CapacityError(Exception):
+    """The API did not start an assessment as it's too busy, the assessment has to be started again later."""
+
+
+class AssessmentManager:
+
+    def __init__(self, urls, handle_results, max_assessments: int=None, new_assessment_interval: float=None,
+                 poll_interval: float=None, batch_size: int=25, batch_timeout: float=60):
+        """
+        :param urls: Url objects to assess.
+        :param handle_results: called with a list of (data, url id) of finished assessments.
+        :param max_assessments: upper limit of concurrently running assessments.
+        :param new_assessment_interval: minimum amount of seconds between starting assessments.
+        :param poll_interval: seconds between reading out a running assessment.
+        :param batch_size: hand over results when this many are finished...
+        :param batch_timeout: ...or when the oldest finished result is waiting this many seconds.
+        """
+        self.pending = deque(urls)
+        self.handle_results = handle_results
+
+        self.max_assessments = max_assessments or settings.QUALYS_MAX_ASSESSMENTS
+        self.min_interval = settings.QUALYS_NEW_ASSESSMENT_INTERVAL if new_assessment_interval is None \
+            else new_assessment_interval
+        self.poll_interval = settings.QUALYS_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+
+        # adapted to what the API says while running.
+        self.capacity = self.max_assessments
+        self.interval = self.min_interval
+
+        self.running = 0
+        self.last_start = 0
+        self.results = []
+        self.results_since = None
+        self.requeued = Counter()
+        self.stats = {'finished': 0, 'failed': 0, 'polls': 0, 'capacity_errors': 0}
+
+    def run(self):
+        """Assesses all urls, returns statistics."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # every running assessment makes at most one request at a time.
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_assessments + 1))
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+
+        self._hand_over()
+        log.info("Qualys assessments done: %s" % self.stats)
+        return self.stats
+
+    async def _run(self):
+        self.slot_freed = asyncio.Condition()
+
+        assessments = []
+        while True:
+            # don't keep a growing list of finished assessments around.
+            assessments = [assessment for assessment in assessments if not assessment.done()]
+
+            if self.pending:
+                await self._wait_for_slot()
+                self.running += 1
+                self.last_start = time.monotonic()
+                assessments.append(asyncio.ensure_future(self._assess(self.pending.popleft())))
+                continue
+
+            if not assessments:
+                break
+
+            # running assessments can place their url back in pending when the API is too busy.
+            await asyncio.wait(assessments, timeout=self.batch_timeout, return_when=asyncio.FIRST_COMPLETED)
+            self._hand_over_when_due()
+
+    async def _wait_for_slot(self):
+        """Waits until an assessment can be started, given the capacity and pace."""
+        async with self.slot_freed:
+            while self.running >= self.capacity:
+                # timeout: the hand over of results also has to happen while all assessments are running.
+                try:
+                    await asyncio.wait_for(self.slot_freed.wait(), self.poll_interval or 1)
+                except asyncio.TimeoutError:
+                    pass
+                self._hand_over_when_due()
+
+        wait = self.last_start + self.interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _release_slot(self):
+        async with self.slot_freed:
+            self.running -= 1
+            self.slot_freed.notify_all()
+
+    async def _assess(self, url):
+        loop = asyncio.get_event_loop()
+        failures = 0
+        try:
+            for poll in range(MAX_POLLS):
+                if poll:
+                    await asyncio.sleep(self.poll_interval)
+
+                self.stats['polls'] += 1
+                try:
+                    response = await loop.run_in_executor(None, assessment_request, url.url)
+                    data = self._read(response, started=not poll)
+                except CapacityError:
+                    # the assessment did not start, try again when there is room.
+                    self.stats['capacity_errors'] += 1
+                    self.requeued[url] += 1
+                    if self.requeued[url] <= MAX_REQUEUES:
+                        self.pending.append(url)
+                        return
+                    break
+                except (requests.RequestException, ValueError) as e:
+                    failures += 1
+                    log.debug("Failed to read assessment of %s (%s/%s): %s" % (url, failures, MAX_FAILURES, e))
+                    if failures >= MAX_FAILURES:
+                        break
+                    continue
+
+                if data.get('status') in ["READY", "ERROR"]:
+                    self._finished(url, data)
+                    return
+
+            log.warning("Gave up on qualys assessment of %s." % url)
+            self.stats['failed'] += 1
+        finally:
+            await self._release_slot()
+
+    def _read(self, response, started: bool):
+        """Returns the data of an assessment, adapts capacity and pace to the answer of the API."""
+        self._adapt_to_headers(response.headers)
+
+        data = response.json()
+        errors = [error.get('message', '') for error in data.get('errors', [])]
+
+        if not errors and response.status_code == 200:
+            if started:
+                # the API accepted a new assessment: speed up a little.
+                self.interval = max(self.min_interval, self.interval * 0.75)
+                self.capacity = min(self.max_assessments, self.capacity + 1)
+            return data
+
+        message = errors[0] if errors else "HTTP %s" % response.status_code
+
+        if message.startswith(CONCURRENT_LIMIT):
+            # {'errors': [{'message': 'Concurrent assessment limit reached (7/7)'}]}
+            # Concurrent scans from the same IP slowly lower the limit. Run no more than what is running now.
+            self.capacity = max(1, min(self.capacity, self.running - 1))
+            self._slow_down(message)
+            raise CapacityError(message)
+
+        if message.startswith(FULL_CAPACITY) or message.startswith(TOO_FAST) or response.status_code in [429, 503, 529]:
+            self._slow_down(message)
+            raise CapacityError(message)
+
+        raise ValueError("Unexpected answer from API: %s" % data)
+
+    def _adapt_to_headers(self, headers):
+        try:
+            allowed = int(headers['X-Max-Assessments'])
+            current = int(headers['X-Current-Assessments'])
+        except (KeyError, ValueError):
+            return
+
+        # assessments of others on the same IP count towards the limit.
+        others = max(0, current - self.running)
+        self.capacity = max(1, min(self.capacity, self.max_assessments, allowed - others))
+
+    def _slow_down(self, message):
+        self.interval = min(MAX_NEW_ASSESSMENT_INTERVAL, max(self.interval * 2, 1))
+        log.info("Qualys asks to slow down (%s). Running %s, capacity %s, starting at most every %s seconds."
+                 % (message, self.running, self.capacity, self.interval))
+
+    def _finished(self, url, data):
+        # Store debug data in the background.
+        scratch('qualys', url, data)
+
+        self.stats['finished'] += 1
+        if not self.results:
+            self.results_since = time.monotonic()
+        self.results.append((data, url.pk))
+        self._hand_over_when_due()
+
+    def _hand_over_when_due(self):
+        if not self.results:
+            return
+        if len(self.results) >= self.batch_size or time.monotonic() - self.results_since >= self.batch_timeout:
+            self._hand_over()
+
+    def _hand_over(self):
+        if not self.results:
+            return
+        results, self.results = self.results, []
+        log.debug("Handing over %s qualys results." % len(results))
+        self.handle_results(results)
@@ -0,0 +1,192 @@
+"""
+Politeness: a limit on how fast targets are contacted, shared by all workers.
+
+Celery rate limits (such as rate_limit='6/s' on can_connect) are per worker process: every worker that is added
+multiplies the actual rate, and nothing stops different scanners from contacting the same host at the same moment.
+Scanners now take a token from a few token buckets before contacting a target:
+
+- global: all connections of all scanners together.
+- host: per domain name, such as www.faalkaart.nl.
+- ip: per ip address, many domains are hosted on the same server (behind the same firewall).
+- qualys: starting new assessments at the Qualys API.
+
+A bucket holds at most 'burst' tokens and gets 'rate' tokens per second, see RATE_LIMITS in settings. A target is only
+contacted when all its buckets have a token: tokens are taken from all buckets at once, or from none of them.
+
+The buckets live in Redis when that is the broker, so all workers share them. Otherwise every process has its own
+buckets, which limits per process like celery did.
+
+Tasks don't sleep while waiting for a token: they are published again for the moment the next token is expected, so
+the worker can do other work in the mean time. This is not a retry: waiting for a token does not count towards the
+max_retries of the task. Code that is not running as a task on a worker waits for the token instead.
+
+Usage:
+    throttle(self, *target(host=url.url, ip=ip))  # in a bound task
+    wait = acquire(('qualys', 'assessments'))  # 0: token taken, otherwise seconds until the next token
+"""
+import logging
+import random
+import threading
+import time
+from typing import List, Tuple
+
+from celery.exceptions import Ignore
+from django.conf import settings
+
+from failmap.celery import redis_client
+
+log = logging.getLogger(__package__)
+
+KEY_PREFIX = 'failmap:ratelimit'
+
+# Above this amount of buckets, buckets that are full again are removed from the in process buckets.
+LOCAL_BUCKETS = 100000
+
+# Takes a token from all buckets, or from none. KEYS: the buckets, ARGV: the current time in seconds, followed by the
+# rate and burst of every bucket. Returns the seconds until all buckets have a token, 0 when the tokens were taken.
+# A string is returned, numbers returned by scripts are truncated to integers.
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local available = {}
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'moment')
+    local tokens = tonumber(bucket[1]) or burst
+    local moment = tonumber(bucket[2]) or now
+    available[i] = math.min(burst, tokens + math.max(0, now - moment) * rate)
+    if available[i] < 1 then
+        wait = math.max(wait, (1 - available[i]) / rate)
+    end
+end
+
+if wait > 0 then
+    return tostring(wait)
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HMSET', key, 'tokens', available[i] - 1, 'moment', now)
+    -- a bucket that is full again is the same as no bucket.
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+
+class MemoryBuckets:
+    """Buckets of this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def take(self, limits: List[Tuple[str, float, int]], now: float) -> float:
+        with self.lock:
+            available = []
+            for key, rate, burst in limits:
+                tokens, moment, _ = self.buckets.get(key, (burst, now, now))
+                available.append(min(burst, tokens + max(0, now - moment) * rate))
+
+            wait = max([(1 - tokens) / rate for tokens, (key, rate, burst) in zip(available, limits) if tokens < 1],
+                       default=0)
+            if wait:
+                return wait
+
+            if len(self.buckets) > LOCAL_BUCKETS:
+                self.buckets = {key: bucket for key, bucket in self.buckets.items() if bucket[2] > now}
+            for tokens, (key, rate, burst) in zip(available, limits):
+                self.buckets[key] = (tokens - 1, now, now + (burst - tokens + 1) / rate)
+            return 0
+
+
+class RedisBuckets:
+    """Buckets of all workers, stored as a hash of tokens and moment of the last update per bucket."""
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, limits: List[Tuple[str, float, int]], now: float) -> float:
+        args = [now]
+        for key, rate, burst in limits:
+            args.extend([rate, burst])
+        return float(self.script(keys=["%s:%s" % (KEY_PREFIX, key) for key, rate, burst in limits], args=args))
+
+
+_memory_buckets = MemoryBuckets()
+_redis_buckets = None
+
+
+def _buckets():
+    global _redis_buckets
+
+    if getattr(settings, 'RATE_LIMIT_BACKEND', 'auto') != 'memory':
+        client = redis_client()
+        if client:
+            if _redis_buckets is None or _redis_buckets.client is not client:
+                _redis_buckets = RedisBuckets(client)
+            return _redis_buckets
+    return _memory_buckets
+
+
+def target(host: str=None, ip: str=None) -> List[Tuple[str, str]]:
+    """The buckets of contacting a target: the global bucket and the bucket of its host and ip address."""
+    buckets = [('global', 'all')]
+    if host:
+        buckets.append(('host', host.lower().rstrip('.')))
+    if ip:
+        buckets.append(('ip', ip))
+    return buckets
+
+
+def acquire(*buckets: Tuple[str, str]) -> float:
+    """
+    Takes a token from all buckets at once.
+
+    :param buckets: (kind, name) tuples, the kind is a key of RATE_LIMITS. Kinds without a limit are ignored.
+    :return: 0 when the tokens are taken, otherwise the seconds until all buckets have a token again.
+    """
+    limits = []
+    for kind, name in buckets:
+        limit = settings.RATE_LIMITS.get(kind)
+        if limit and limit['rate']:
+            limits.append(("%s:%s" % (kind, name), limit['rate'], max(1, limit['burst'])))
+    if not limits:
+        return 0
+
+    backend = _buckets()
+    try:
+        return backend.take(limits, time.time())
+    except Exception as ex:
+        # the broker is unreachable, limit within this process instead.
+        log.debug("Could not take tokens from shared rate limit: %s" % ex)
+        return _memory_buckets.take(limits, time.time())
+
+
+def throttle(task, *buckets: Tuple[str, str]):
+    """
+    Returns when a token is taken from all buckets. Otherwise a task on a worker is published again for when the next
+    token is expected (and this run is ignored), and a task that is called directly (or executed eagerly) waits for it.
+
+    :param task: the bound task that is going to contact the target.
+    """
+    while True:
+        wait = acquire(*buckets)
+        if not wait:
+            return
+
+        if task.request.called_directly or task.request.is_eager:
+            time.sleep(wait)
+            continue
+
+        # spread the tasks: tasks that wait for the same bucket should not all return at the same moment.
+        countdown = wait * random.uniform(1, 2)
+        log.debug("No token for %s, running %s again in %.1f seconds." % (buckets, task.name, countdown))
+
+        # the same task (id, chain, queue) with the same amount of retries: task.retry would count this as a retry.
+        task.signature_from_request(countdown=countdown, retries=task.request.retries or 0).apply_async()
+        raise Ignore()
@@ -0,0 +1,307 @@
+"""
+Cached DNS resolution for all scanners.
+
+During a scan cycle the same name is resolved many times: once per port during endpoint discovery, again by the
+plain http scanner, again when checking redirects and so on. Every one of those lookups used to be a blocking
+call to the system resolver.
+
+This module asks DNS directly (via dnspython) so the time to live of the answer is known. Answers are cached for
+that time in this process and in a cache that is shared between all workers (Redis, if that is the broker). Names
+that do not exist, or that have no records of a type, are cached as well: otherwise every dead subdomain is asked
+over and over again.
+
+Reverse names (PTR records) of addresses are cached the same way. Many urls are hosted on the same address, so most
+reverse lookups are answered from cache.
+
+Usage:
+    ipv4, ipv6 = resolve("faalkaart.nl")
+    answers = resolve_many(["faalkaart.nl", "www.faalkaart.nl"])  # {name: (ipv4, ipv6)}
+    name = reverse("192.0.2.1")  # "" when there is no reverse name, None when the lookup failed
+    names = reverse_many(["192.0.2.1", "2001:db8::1"])  # {ip: name}
+"""
+import json
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import dns.exception
+import dns.resolver
+import dns.reversename
+from django.conf import settings
+
+from failmap.celery import redis_client
+
+logger = logging.getLogger(__package__)
+
+# Respect the TTL of the answer, within these bounds. Some names have a TTL of a few seconds, which would mean
+# no caching at all. Others have a TTL of days, which would hide changes from the scanners.
+MIN_TTL = getattr(settings, 'DNS_CACHE_MIN_TTL', 60)
+MAX_TTL = getattr(settings, 'DNS_CACHE_MAX_TTL', 3600)
+
+# How long a "does not exist" or "no records of this type" answer is kept.
+NEGATIVE_TTL = getattr(settings, 'DNS_CACHE_NEGATIVE_TTL', 300)
+
+# Amount of simultaneous lookups in resolve_many.
+CONCURRENCY = getattr(settings, 'DNS_RESOLVER_CONCURRENCY', 50)
+
+# Prefix of the keys in the shared cache.
+KEY_PREFIX = 'failmap:dns'
+
+# Above this number of entries, expired entries are removed from the in process cache.
+LOCAL_CACHE_SIZE = 100000
+
+_local_cache = {}
+_local_lock = threading.Lock()
+
+
+def resolve(name: str) -> Tuple[str, str]:
+    """
+    Returns the first IPv4 and IPv6 address of a name. An empty string means no address of that type.
+
+    Only the ip versions that the network of this worker supports are looked up.
+    """
+    ipv4 = ""
+    ipv6 = ""
+
+    if settings.NETWORK_SUPPORTS_IPV4:
+        addresses = lookup(name, 'A')
+        if addresses:
+            ipv4 = addresses[0]
+            logger.debug("%s has IPv4 address: %s" % (name, ipv4))
+
+    if settings.NETWORK_SUPPORTS_IPV6:
+        addresses = lookup(name, 'AAAA')
+        if addresses:
+            ipv6 = addresses[0]
+
+            # six to four addresses make no sense
+            if str(ipv6).startswith("::ffff:"):
+                logger.error("Six-to-Four address %s discovered on %s, "
+                             "did you configure IPv6 connectivity correctly? "
+                             "Removing this IPv6 address from result to prevent "
+                             "database pollution." %
+                             (ipv6, name))
+                ipv6 = ""
+            else:
+                logger.debug("%s has IPv6 address: %s" % (name, ipv6))
+
+    return ipv4, ipv6
+
+
+def resolve_many(names: List[str]) -> Dict[str, Tuple[str, str]]:
+    """
+    Resolves a lot of names concurrently. Cached answers are retrieved in one go from the shared cache.
+
+    :param names: list of names, duplicates are resolved once.
+    :return: dictionary with name: (ipv4, ipv6), the same as resolve().
+    """
+    names = list(set(names))
+    if not names:
+        return {}
+
+    # warm up the local cache with everything the other workers already know.
+    rdtypes = []
+    if settings.NETWORK_SUPPORTS_IPV4:
+        rdtypes.append('A')
+    if settings.NETWORK_SUPPORTS_IPV6:
+        rdtypes.append('AAAA')
+    _fetch_shared([(name, rdtype) for name in names for rdtype in rdtypes])
+
+    with ThreadPoolExecutor(max_workers=min(CONCURRENCY, len(names))) as executor:
+        return dict(zip(names, executor.map(resolve, names)))
+
+
+def reverse(ip: str) -> Optional[str]:
+    """
+    Returns the reverse name of an address, without the trailing dot. An empty string means no reverse name, None
+    means the lookup failed (a timeout for example) and should be tried again later.
+    """
+    name = _reverse_name(ip)
+    if not name:
+        return ""
+
+    names = lookup(name, 'PTR')
+    if names is None:
+        return None
+    return names[0] if names else ""
+
+
+def reverse_many(ips: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Looks up the reverse names of a lot of addresses concurrently, see resolve_many.
+
+    :return: dictionary with ip: reverse name, the same as reverse().
+    """
+    ips = list(set(ips))
+    if not ips:
+        return {}
+
+    _fetch_shared([(_reverse_name(ip), 'PTR') for ip in ips if _reverse_name(ip)])
+
+    with ThreadPoolExecutor(max_workers=min(CONCURRENCY, len(ips))) as executor:
+        return dict(zip(ips, executor.map(reverse, ips)))
+
+
+def lookup(name: str, rdtype: str) -> Optional[List[str]]:
+    """
+    Returns all addresses (or names, for PTR) of a type for a name, from cache if possible. None when a PTR lookup
+    failed.
+    """
+    name = name.lower().rstrip('.')
+
+    addresses = _get_local(name, rdtype)
+    if addresses is not None:
+        return addresses
+
+    _fetch_shared([(name, rdtype)])
+    addresses = _get_local(name, rdtype)
+    if addresses is not None:
+        return addresses
+
+    addresses, ttl = _query(name, rdtype)
+    if ttl:
+        _store(name, rdtype, addresses, ttl)
+    return addresses
+
+
+def forget(name: str):
+    """Removes a name from the caches, for example when it is known to have changed."""
+    name = name.lower().rstrip('.')
+
+    with _local_lock:
+        for rdtype in ['A', 'AAAA']:
+            _local_cache.pop((name, rdtype), None)
+
+    client = _shared_cache()
+    if client:
+        client.delete(*[_key(name, rdtype) for rdtype in ['A', 'AAAA']])
+
+
+def _query(name: str, rdtype: str) -> Tuple[List[str], int]:
+    """
+    Asks DNS for the addresses of a name.
+
+    :return: addresses and the number of seconds they may be cached. Zero seconds means: don't cache. The addresses
+        are None when a PTR lookup failed.
+    """
+    try:
+        answer = _resolver_query(name, rdtype)
+        if rdtype == 'PTR':
+            addresses = [record.target.to_text().rstrip('.') for record in answer.rrset]
+        else:
+            addresses = [record.address for record in answer.rrset]
+        return addresses, max(MIN_TTL, min(MAX_TTL, answer.rrset.ttl))
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        logger.debug("%s has no %s records." % (name, rdtype))
+        return [], NEGATIVE_TTL
+    except (dns.name.EmptyLabel, dns.name.LabelTooLong, dns.name.NameTooLong) as ex:
+        # not a name that can ever exist.
+        logger.debug("Invalid name %s: %s" % (name, ex))
+        return [], NEGATIVE_TTL
+    except dns.exception.DNSException as ex:
+        if rdtype == 'PTR':
+            # the system resolver has no timeout for reverse lookups, try again another time.
+            logger.debug("Reverse lookup of %s failed: %s" % (name, ex))
+            return None, 0
+        # Timeouts and unreachable nameservers say nothing about the name. Ask the system resolver instead,
+        # which also knows about things like /etc/hosts. This answer is not cached: there is no TTL.
+        logger.debug("DNS lookup of %s failed (%s), falling back to system resolver." % (name, ex))
+        return _system_query(name, rdtype), 0
+
+
+def _reverse_name(ip: str) -> str:
+    """The name to ask the PTR record of, for example 1.2.0.192.in-addr.arpa. Empty for invalid addresses."""
+    try:
+        return dns.reversename.from_address(ip).to_text()
+    except (ValueError, dns.exception.SyntaxError):
+        logger.debug("Invalid address %s, no reverse name." % ip)
+        return ""
+
+
+def _system_query(name: str, rdtype: str) -> List[str]:
+    family = socket.AF_INET if rdtype == 'A' else socket.AF_INET6
+    try:
+        return list(set(info[4][0] for info in socket.getaddrinfo(name, None, family)))
+    except Exception as ex:
+        # when not known: [Errno 8] nodename nor servname provided, or not known
+        logger.debug("Get %s error: %s" % (rdtype, ex))
+        return []
+
+
+def _resolver_query(name: str, rdtype: str):
+    # dnspython 2 renamed query to resolve, which no longer uses the search domains by default.
+    resolver = dns.resolver.get_default_resolver()
+    if hasattr(resolver, 'resolve'):
+        return resolver.resolve(name, rdtype, search=False)
+    return resolver.query(name, rdtype)
+
+
+def _get_local(name: str, rdtype: str):
+    entry = _local_cache.get((name, rdtype))
+    if entry is None:
+        return None
+
+    expires, addresses = entry
+    if expires < time.time():
+        return None
+    return addresses
+
+
+def _set_local(name: str, rdtype: str, addresses: List[str], ttl: int):
+    with _local_lock:
+        if len(_local_cache) > LOCAL_CACHE_SIZE:
+            now = time.time()
+            for key in [key for key, (expires, _) in _local_cache.items() if expires < now]:
+                del _local_cache[key]
+        _local_cache[(name, rdtype)] = (time.time() + ttl, addresses)
+
+
+def _store(name: str, rdtype: str, addresses: List[str], ttl: int):
+    _set_local(name, rdtype, addresses, ttl)
+
+    client = _shared_cache()
+    if client:
+        try:
+            client.setex(_key(name, rdtype), ttl, json.dumps(addresses))
+        except Exception as ex:
+            # the shared cache is an optimization, never a reason to fail a scan.
+            logger.debug("Could not write to shared DNS cache: %s" % ex)
+
+
+def _fetch_shared(entries: List[Tuple[str, str]]):
+    """Copies everything that is in the shared cache, and not in the local cache, to the local cache."""
+    entries = [(name.lower().rstrip('.'), rdtype) for name, rdtype in entries]
+    entries = [entry for entry in entries if _get_local(*entry) is None]
+
+    client = _shared_cache()
+    if not client or not entries:
+        return
+
+    try:
+        pipeline = client.pipeline(transaction=False)
+        for name, rdtype in entries:
+            key = _key(name, rdtype)
+            pipeline.get(key)
+            pipeline.ttl(key)
+        replies = pipeline.execute()
+    except Exception as ex:
+        logger.debug("Could not read from shared DNS cache: %s" % ex)
+        return
+
+    for index, (name, rdtype) in enumerate(entries):
+        value, ttl = replies[index * 2], replies[index * 2 + 1]
+        if value is not None and ttl and ttl > 0:
+            _set_local(name, rdtype, json.loads(value.decode('utf-8')), ttl)
+
+
+def _shared_cache():
+    if not getattr(settings, 'DNS_CACHE_SHARED', True):
+        return None
+    return redis_client()
+
+
+def _key(name: str, rdtype: str):
+    return "%s:%s:%s" % (KEY_PREFIX, rdtype, name)
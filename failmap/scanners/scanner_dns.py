@@ -16,15 +16,15 @@ https://github.com/anonion0/nsec3map
 
 import itertools
 import logging
-import random
-import string
 import subprocess
-from typing import List
+from typing import List, Union
 
+import requests
 import untangle
 from django.conf import settings
 
 from failmap.organizations.models import Organization, Url
+from failmap.scanners import ct_log, dns_brute, subdomain_wordlist
 
 logger = logging.getLogger(__package__)
 
@@ -49,12 +49,6 @@ wordlists = {
         'path': settings.TOOLS['dnsrecon']['wordlist_dir'] + "knownsubdomains.txt",
         'length': 200
     },
-    # We want to know if a domain uses wildcards, and also store it. So dnsrecon might be suited
-    # for this, it doesn't output if a url has wildcard support.
-    'nonsense': {
-        'path': settings.TOOLS['dnsrecon']['wordlist_dir'] + "nonsense.txt",
-        'length': 2
-    }
 }
 
 
@@ -92,17 +86,10 @@ def brute_three_letters(organizations: List[Organization]=None, urls: List[Url]=
 
 
 def brute_known_subdomains(organizations: List[Organization]=None, urls: List[Url]=None):
-    if organizations:
-        for organization in organizations:
-            update_subdomain_wordlist()
-            urls = toplevel_urls_without_wildcards(organization)
-            return bruteforce_scan(urls, str(wordlists["known_subdomains"]["path"]))
+    urls = toplevel_urls_without_wildcards(organizations) if organizations else [] + urls if urls else []
 
-    if urls:
-        # this list of subdomains can be extended per url
-        for url in urls:
-            update_subdomain_wordlist()
-            return bruteforce_scan([url], str(wordlists["known_subdomains"]["path"]))
+    # the wordlist is kept up to date while urls are added, so it's read once for all urls.
+    return bruteforce_scan(urls, subdomain_wordlist.words())
 
 
 def standard(organizations: List[Organization]=None, urls: List[Url]=None):
@@ -208,38 +195,10 @@ def discover_wildcard_scan(url: Url):
     We need to perform a check ourselves, since we cannot get from the DNSRecon report if the url
     uses wildcards. We store this ourselves so we can better filter domains.
 
-    In some cases DNSrecon makes a wrong assumption about wildcard usage. This is hopefully a bit better.
+    Asks for a few random subdomains, if any of them exist the domain uses wildcards. See dns_brute.
     """
     logger.debug("Checking for DNS wildcards on domain: %s" % url.url)
-    file = "%s_data_wildcards.json" % url.url
-    path = settings.TOOLS['dnsrecon']['output_dir'] + file
-
-    logger.debug("DNS results will be stored in file: %s" % path)
-
-    # never continue with wildcard domains
-    # solving https://sentry.io/internet-cleanup-foundation/faalkaart/issues/467465408/
-    randomize_nonsense_subdomains_wordlist()
-    command = ['python', dnsrecon,
-               '--domain', url.url,
-               '-t', 'brt',
-               '--iw',  # --iw: # always try wild card domains.
-               '-D', wordlists["nonsense"]["path"],
-               '-j', path]
-
-    subprocess.check_output(command)
-
-    import json
-    wildcard = False
-    with open(path) as data_file:
-        data = json.load(data_file)
-        for record in data:
-            if "arguments" in record.keys():
-                continue
-
-            if record["name"].endswith(url.url):
-                wildcard = True
-
-    return wildcard
+    return dns_brute.uses_wildcard(url.url)
 
 
 def import_dnsrecon_report(url: Url, path: str):
@@ -247,7 +206,7 @@ def import_dnsrecon_report(url: Url, path: str):
     import json
     with open(path) as data_file:
         data = json.load(data_file)
-        addedlist = []
+        subdomains = []
         for record in data:
             # brutally ignore all kinds of info from other structures.
             logger.debug("Record: %s" % record)
@@ -271,11 +230,10 @@ def import_dnsrecon_report(url: Url, path: str):
                 if subdomain[0:2] == "*.":
                     subdomain = subdomain[2:len(subdomain)]
 
-                # will check for resolve and if this is a wildcard.
-                added = url.add_subdomain(subdomain.lower())
-                if added:
-                    addedlist.append(added)
-    return addedlist
+                subdomains.append(subdomain.lower())
+
+    # will check for resolve and if this is a wildcard.
+    return url.add_subdomains(subdomains)
 
 
 def search_engines_scan(urls: List[Url]):
@@ -329,105 +287,52 @@ def search_engines_scan(urls: List[Url]):
 
         logger.debug("Found subdomains: %s" % subdomains)
 
-        for subdomain in subdomains:
-            added = url.add_subdomain(subdomain)
-            if added:
-                addedlist.append(added)
+        addedlist += url.add_subdomains(list(subdomains))
     return addedlist
 
 
-def bruteforce_scan(urls: List[Url], wordlist: str):
+def bruteforce_scan(urls: List[Url], wordlist: Union[str, List[str]]):
     """
+    Tries every word in the wordlist as subdomain of the urls, see dns_brute.
 
     :param urls:
-    :param wordlist:
+    :param wordlist: path to a file with a word per line, or the words.
     :return:
     """
 
     # any organization can determine at any points that there are now wildcards in effect
     # would we not check this, all urls below the current url will be seen as valid, which
-    # results in database polution and a lot of extra useless scans.
-    urls = remove_wildcards(urls)
-
+    # results in database polution and a lot of extra useless scans. The brute force checks (and stores) this
+    # before starting.
     imported_urls = []
     for url in urls:
         logger.info("Bruting DNS of toplevel domain: %s" % url.url)
-        logger.debug("Using wordlist: %s" % wordlist)
-        file = "%s_data_brute.json" % url.url
-        path = settings.TOOLS['dnsrecon']['output_dir'] + file
-
-        logger.debug("DNS results will be stored in file: %s" % path)
-
-        # never continue with wildcard domains
-        p = subprocess.Popen(['python', dnsrecon,
-                              '--domain', url.url,
-                              '-t', 'brt',
-                              '-D', wordlist,
-                              '-j', path], stdin=subprocess.PIPE)
-        p.stdin.write('n'.encode(encoding='utf-8'))
-        p.stdin.write('n'.encode(encoding='utf-8'))
-        p.stdin.write('n'.encode(encoding='utf-8'))
-        p.stdin.write('n'.encode(encoding='utf-8'))
-        p.stdin.write('n'.encode(encoding='utf-8'))
-        p.stdin.write('n'.encode(encoding='utf-8'))  # never brute a wildcard,
-        # The above input doens't always work it seems...
-        p.communicate()
-
-        imported_urls += import_dnsrecon_report(url, path)
+        if isinstance(wordlist, str):
+            logger.debug("Using wordlist: %s" % wordlist)
+            words = dns_brute.words_from_file(wordlist)
+        else:
+            words = wordlist
+        imported_urls += dns_brute.brute_force(url, words)
 
     return imported_urls
 
 
 def certificate_transparency_scan(urls: List[Url]):
     """
-    Checks the certificate transparency database for subdomains. Using a regex the subdomains
-    are extracted. This method is extremely fast and reliable: these certificates all exist.
+    Checks the certificate transparency database for subdomains. This method is extremely fast and reliable: these
+    certificates all exist. Only certificates that are new since the previous scan are checked, see ct_log.
 
     Hooray for transparency :)
 
     :param urls: List of Url objects
     :return:
     """
-    import requests
-    import re
-
     addedlist = []
     for url in urls:
-
-        # https://crt.sh/?q=%25.zutphen.nl
-        crt_sh_url = "https://crt.sh/?q=%25." + str(url.url)
-        pattern = r"[^\s%>]*\." + str(url.url.replace(".", "\."))  # harder string formatting :)
-
-        response = requests.get(crt_sh_url, timeout=(10, 10), allow_redirects=False)
-        matches = re.findall(pattern, response.text)
-
-        subdomains = []
-        for match in matches:
-            # handle wildcards, sometimes subdomains have nice features.
-            # examples: *.apps.domain.tld.
-            # done: perhaps store that it was a wildcard cert, for further inspection?
-            # - no we don't as that can change and this information can be outdated. We will check on that using any
-            # brute force dns scan and some other places. Adding the logic here will increase complexity.
-            match = match.replace("*.", "")
-            if match != url.url:
-                subdomains.append(match[0:len(match) - len(url.url) - 1])  # wraps around
-
-        subdomains = [x.lower() for x in subdomains]  # do lowercase normalization elsewhere
-        subdomains = set(subdomains)
-
-        # 25 and '' are created due to the percentage and empty subdomains. Remove them
-        # wildcards (*) are also not allowed.
-        if '' in subdomains:
-            subdomains.remove('')
-        if '25' in subdomains:
-            subdomains.remove('25')
-
-        logger.debug("Found subdomains: %s" % subdomains)
-
-        for subdomain in subdomains:
-            added = url.add_subdomain(subdomain)
-            if added:
-                addedlist.append(added)
+        try:
+            addedlist += ct_log.discover(url)
+        except requests.RequestException as e:
+            logger.info("Could not read certificate transparency log for %s: %s" % (url, e))
     return addedlist
 
 
@@ -473,21 +378,8 @@ def nsec_scan(urls: List[Url]):
 
 
 def update_subdomain_wordlist():
-    # todo: per branche wordlists, more to the point
-    prefixes = []
-    urls = Url.objects.all()
-    for url in urls:
-        positions = [pos for pos, char in enumerate(url.url) if char == '.']
-        if len(positions) > 1:
-            prefixes.append(url.url[0:positions[len(positions) - 2]])
-    # print(set(prefixes))
-    unique_prefixes = set(prefixes)
-
-    with open(str(wordlists["known_subdomains"]["path"]), "w") as text_file:
-        for unique_prefix in unique_prefixes:
-            text_file.write(unique_prefix + '\n')
-
-    return unique_prefixes
+    """Rebuilds the known subdomains wordlist from all urls, normally it's updated when urls are added."""
+    return set(subdomain_wordlist.rebuild())
 
 
 def make_threeletter_wordlist():
@@ -504,16 +396,3 @@ def make_threeletter_wordlist():
             text_file.write(x + '\n')
         for x in twoletters:
             text_file.write(x + '\n')
-
-# the chance of getting one or both domains back as existing is one in gazillions.
-# but for the astronomically small chance there is another factor of gazillions.
-
-
-def randomize_nonsense_subdomains_wordlist():
-    letters = string.ascii_lowercase
-    words = [''.join(random.choice(letters) for i in range(10)),
-             ''.join(random.choice(letters) for i in range(10))]
-
-    with open(wordlists["nonsense"]["path"], "w") as text_file:
-        for word in words:
-            text_file.write(word + '\n')
@@ -18,17 +18,22 @@ and then follow the installation instructions here:
 https://github.com/dotse/dnscheck/tree/master/engine
 
 We strongly recomend using the docker approach.
+
+Urls are checked in batches by long running checker processes (dnssec_batch.pl), see dnssec_checker. The results of
+a batch are stored at once.
 """
 
 import logging
 import subprocess
-from typing import List
+from typing import Dict, List
 
 from celery import Task, group
 from django.conf import settings
 
 from failmap.celery import ParentFailed, app
+from failmap.celery.hydrate import hydrate, hydrate_one, pks
 from failmap.organizations.models import Organization, Url
+from failmap.scanners import dnssec_checker
 from failmap.scanners.url_scan_manager import UrlScanManager
 
 from .models import Endpoint
@@ -43,6 +48,17 @@ RETRY_DELAY = 10
 # can also be a datetime.
 EXPIRES = 3600  # one hour is more then enough
 
+# Messages are translated for display. Add the exact messages in: /failmap/map/static/js/script.js
+# Run "failmap translate" to have the messages added to:
+# /failmap/map/locale/*/djangojs.po
+# /failmap/map/locale/*/django.po
+# translate them and then run "failmap translate" again.
+MESSAGES = {
+    'ERROR': 'DNSSEC is incorrectly or not configured (errors found).',
+    'WARNING': 'DNSSEC is incorrectly configured (warnings found).',
+    'INFO': 'DNSSEC seems to be implemented sufficiently.'
+}
+
 
 def compose_task(
     organizations_filter: dict = dict(),
@@ -84,10 +100,13 @@ def compose_task(
     # The number of top level urls is negligible, so randomization is not needed.
 
     # create tasks for scanning all selected endpoints as a single managable group
-    # Sending entire objects is possible. How signatures (.s and .si) work is documented:
+    # Tasks get names and ids of urls, not the objects, see hydrate. How signatures (.s and .si) work is documented:
     # http://docs.celeryproject.org/en/latest/reference/celery.html#celery.signature
+    # Every batch is checked by the same checker processes and stored at once.
+    batch_size = settings.DNSSEC_BATCH_SIZE
+    batches = [urls[start:start + batch_size] for start in range(0, len(urls), batch_size)]
     task = group(
-        scan_dnssec.s(url.url) | store_dnssec.s(url) for url in urls
+        scan_dnssec_batch.s([url.url for url in batch]) | store_dnssec_batch.s(pks(batch)) for batch in batches
     )
 
     return task
@@ -97,38 +116,67 @@ def compose_task(
 def store_dnssec(result: List[str], url: Url):
     """
 
-    :param result: param endpoint:
-    :param endpoint:
+    :param result: output lines of dnssec.pl
+    :param url: id of the Url, or the Url itself when called directly.
 
     """
     # if scan task failed, ignore the result (exception) and report failed status
     if isinstance(result, Exception):
         return ParentFailed('skipping result parsing because scan failed.', cause=result)
 
+    url = hydrate_one(Url, url)
+    if not url:
+        return {'status': 'skipped'}
+
     # relevant helps to store the minimum amount of information.
     level, relevant = analyze_result(result)
 
-    # Messages are translated for display. Add the exact messages in: /failmap/map/static/js/script.js
-    # Run "failmap translate" to have the messages added to:
-    # /failmap/map/locale/*/djangojs.po
-    # /failmap/map/locale/*/django.po
-    # translate them and then run "failmap translate" again.
-    messages = {
-        'ERROR': 'DNSSEC is incorrectly or not configured (errors found).',
-        'WARNING': 'DNSSEC is incorrectly configured (warnings found).',
-        'INFO': 'DNSSEC seems to be implemented sufficiently.'
-    }
-
     log.debug('Storing result: %s, for url: %s.', result, url)
     # You can save any (string) value and any (string) message.
     # The EndpointScanManager deduplicates the data for you automatically.
     if result:
-        UrlScanManager.add_scan('DNSSEC', url, level, messages[level], evidence=",\n".join(relevant))
+        UrlScanManager.add_scan('DNSSEC', url, level, MESSAGES[level], evidence=",\n".join(relevant))
 
     # return something informative
     return {'status': 'success', 'result': level}
 
 
+@app.task(queue='storage')
+def store_dnssec_batch(results: Dict[str, object], urls: List[Url]):
+    """
+    Stores the results of scan_dnssec_batch at once.
+
+    :param results: dictionary of url: output lines, or the exception when the url could not be checked.
+    :param urls: ids of the urls of the batch (or the Url objects, when called directly).
+    """
+    if isinstance(results, Exception):
+        return ParentFailed('skipping result parsing because scan failed.', cause=results)
+
+    urls = hydrate(Url, urls)
+
+    scans = []
+    failed = []
+    for url in urls:
+        result = results.get(url.url)
+        if not isinstance(result, list):
+            failed.append(url.url)
+            continue
+
+        try:
+            level, relevant = analyze_result(result)
+        except ValueError as e:
+            log.info('Could not read DNSSEC result of %s: %s', url, e)
+            failed.append(url.url)
+            continue
+
+        scans.append(('DNSSEC', url, level, MESSAGES[level], ",\n".join(relevant)))
+
+    log.debug('Storing %s DNSSEC results, %s urls could not be checked.', len(scans), len(failed))
+    UrlScanManager.add_scans(scans)
+
+    return {'status': 'success', 'stored': len(scans), 'failed': failed}
+
+
 @app.task(queue='scanners',
           bind=True,
           default_retry_delay=RETRY_DELAY,
@@ -169,6 +217,20 @@ def scan_dnssec(self, url: str):
             return e
 
 
+@app.task(queue='scanners', expires=EXPIRES)
+def scan_dnssec_batch(urls: List[str]):
+    """
+    Checks many urls with long running checker processes, see dnssec_checker.
+
+    :param urls: top level urls.
+    :return: dictionary of url: output lines, or the exception when the url could not be checked.
+    """
+    log.info('Start scanning %s urls', len(urls))
+    results = dnssec_checker.check(urls)
+    log.info('Done scanning %s urls', len(urls))
+    return results
+
+
 def analyze_result(result: List[str]):
     """
     All possible outcomes:
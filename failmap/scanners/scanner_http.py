@@ -25,25 +25,33 @@ Likely: 80, 8080, 8008, 8888, 8088
 
 """
 import logging
+import operator
 import random
 import socket
+from collections import defaultdict
 from datetime import datetime
-from typing import List
+from functools import reduce
+from typing import Dict, List, Optional, Tuple
 
 import pytz
-import requests
 # suppress InsecureRequestWarning, we do those request on purpose.
 import urllib3
 from celery import Task, group
 from django.conf import settings
+from django.db.models import Q
 from requests import ConnectTimeout, HTTPError, ReadTimeout, Timeout
 from requests.exceptions import ConnectionError
 
 from failmap.celery import app
+from failmap.celery.hydrate import hydrate, hydrate_one, pks
+from failmap.celery.worker import green_threads
 from failmap.organizations.models import Organization, Url
+from failmap.scanners.http_prober import (GLOBAL_CONCURRENCY, PER_HOST_CONCURRENCY, Target,
+                                          probe_batch)
+from failmap.scanners.http_session import session
 from failmap.scanners.models import Endpoint, UrlIp
 
-from .timeout import timeout
+from . import ratelimit, resolver, scheduler
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
@@ -53,6 +61,16 @@ logger = logging.getLogger(__package__)
 STANDARD_HTTP_PORTS = [80, 8008, 8080]
 STANDARD_HTTPS_PORTS = [443, 8443]
 
+# the amount of urls that are resolved and probed in a single task. Each url results in about 10 targets:
+# (3 http ports + 2 https ports) * 2 ip versions.
+URLS_PER_TASK = 50
+
+# the amount of endpoints that are killed in a single query.
+ENDPOINTS_PER_UPDATE = 500
+
+# the amount of addresses of which the reverse name is looked up in a single task.
+IPS_PER_TASK = 200
+
 # Discover Endpoints generic task
 
 
@@ -77,28 +95,24 @@ def compose_task(
         raise ValueError("No filtering available for endpoints: this method discovers new "
                          "endpoints based on Url or Organization.")
 
+    if organizations_filter or urls_filter:
+        # scan what is asked for, outside the plan of the periodic scan.
+        urls = list(urls.distinct())
+    else:
+        # the urls that were not scanned for the longest time, as many as the budget allows.
+        urls = scheduler.plan('http', urls)
+
     logger.info('Creating scan task for %s urls for %s organizations.',
                 len(urls), len(organizations))
 
-    # make sure we're dealing with a list for the coming random function
-    urls = list(urls)
-    # randomize the endpoints to better spread load over urls.
-    random.shuffle(urls)
-    tasks = []
-
-    # even with a randomized url order, still try to add as much time as possible between contacting
-    # the same url, to not disrupt running services.
-
     # We found we're getting useless endpoints that contain little to no data when
     # opening non-tls port 443 and tls port 80. We're not doing that anymore.
-    for port in STANDARD_HTTP_PORTS:
-        for url in urls:
-            tasks.append(resolve_and_scan.s(protocol="http", url=url, port=port))
+    protocols_and_ports = [("http", port) for port in STANDARD_HTTP_PORTS] + \
+                          [("https", port) for port in STANDARD_HTTPS_PORTS]
 
-    for port in STANDARD_HTTPS_PORTS:
-        for url in urls:
-            tasks.append(resolve_and_scan.s(protocol="https", url=url, port=port))
-    task = group(tasks)
+    # The prober contacts all ports of a batch of urls at once, spreading the load per host is done there.
+    task = group(resolve_and_scan_batch.s(pks(urls[i:i + URLS_PER_TASK]), protocols_and_ports)
+                 for i in range(0, len(urls), URLS_PER_TASK))
 
     return task
 
@@ -149,12 +163,23 @@ def verify_endpoints(urls: List[Url]=None, port: int=None, protocol: str=None, o
     if organizations:
         endpoints = endpoints.filter(url__organization__in=organizations)
 
-    # randomize the endpoints to better spread load.
-    endpoints = list(endpoints)
-    random.shuffle(endpoints)
+    # all endpoints of an url are verified together: the url is resolved once and all its ports are probed in the
+    # same task, see verify_batch.
+    hosts = {}
+    endpoints_per_url = defaultdict(set)
+    for url_id, host, endpoint_protocol, endpoint_port, ip_version in endpoints.values_list(
+            'url_id', 'url__url', 'protocol', 'port', 'ip_version'):
+        hosts[url_id] = host
+        endpoints_per_url[url_id].add((endpoint_protocol, endpoint_port, ip_version))
+
+    batch = [[url_id, hosts[url_id], sorted(url_endpoints)] for url_id, url_endpoints in endpoints_per_url.items()]
 
-    for endpoint in endpoints:
-        scan_url(endpoint.protocol, endpoint.url, endpoint.port)
+    # randomize the urls to better spread load.
+    random.shuffle(batch)
+
+    logger.info("Verifying %s endpoints on %s urls." % (sum(len(url[2]) for url in batch), len(batch)))
+    for i in range(0, len(batch), URLS_PER_TASK):
+        verify_batch.si(batch[i:i + URLS_PER_TASK]).apply_async()
 
 
 # TODO: make queue explicit, split functionality in storage and scanner
@@ -224,17 +249,15 @@ def scan_urls(protocols: List[str], urls: List[Url], ports: List[int]):
     for protocol in protocols:
         validate_protocol(protocol)
 
-    # put some distance between the times an url is contacted, so it is less pressuring
-    # therefore, we do this per port and protocol instead of per url.
-    for port in ports:
-        for protocol in protocols:
-            for url in urls:
-                scan_url(protocol, url, port)
+    # the distance between contacting the same url is managed by the prober, see http_prober.
+    protocols_and_ports = [(protocol, port) for port in ports for protocol in protocols]
+    for i in range(0, len(urls), URLS_PER_TASK):
+        resolve_and_scan_batch.s(pks(urls[i:i + URLS_PER_TASK]), protocols_and_ports).apply_async()
 
 
 # TODO: make queue explicit, split functionality in storage and scanner
 def scan_url(protocol: str, url: Url, port: int):
-    resolve_task = resolve_and_scan.s(protocol, url, port)
+    resolve_task = resolve_and_scan.s(protocol, url.pk, port)
     resolve_task.apply_async()
 
 
@@ -242,102 +265,151 @@ def scan_url_direct(protocol: str, url: Url, port: int):
     resolve_and_scan(protocol, url, port)
 
 
-# todo: apply rate limiting
-# also rate limited for the same reason as can_connect is rate limited.
-# would this be faster the ip discovery and actual scan grow to far apart.
+# can_connect is rate limited, so the ip discovery and actual scan might grow apart.
 # also it would mean an intense series of questions to the dns server.
 # TODO: make queue explicit, split functionality in storage and scanner
-@app.task
-def resolve_and_scan(protocol: str, url: Url, port: int):
+@app.task(serializer='json')
+def resolve_and_scan(protocol: str, url_id: int, port: int):
+    url = hydrate_one(Url, url_id)
+    if not url:
+        return
+
     ips = get_ips(url.url)
 
     # this can take max 20 seconds, no use to wait
-    store_task = store_url_ips.s(url, ips)  # administrative, does reverse dns query
+    store_task = store_url_ips.s(url.pk, ips)  # administrative, reverse names are looked up later
     store_task.apply_async()
 
     # todo: this should be re-checked a few times before it's really killed. Retry?
     if not any(ips):
-        kill_url_task = kill_url.s(url)  # administrative
+        kill_url_task = kill_url.s(url.pk)  # administrative
         kill_url_task.apply_async()
         return
 
     # this is not a stacking solution. Weird. Why not?
-    url_revive_task = revive_url.s(url)
+    url_revive_task = revive_url.s(url.pk)
     url_revive_task.apply_async()
 
     (ipv4, ipv6) = ips
     if ipv4:
         # http://docs.celeryproject.org/en/latest/reference/celery.html#celery.signature
-        connect_task = can_connect.s(protocol=protocol, url=url, port=port, ip=ipv4).set(
+        connect_task = can_connect.s(protocol=protocol, host=url.url, port=port, ip=ipv4).set(
             queue='scanners.endpoint_discovery.ipv4')
-        result_task = connect_result.s(protocol, url, port, 4)  # administrative task
+        result_task = connect_result.s(protocol, url.pk, port, 4)  # administrative task
         task = (connect_task | result_task)
         task.apply_async()
 
     if ipv6:
-        connect_task = can_connect.s(protocol=protocol, url=url, port=port, ip=ipv6).set(
+        connect_task = can_connect.s(protocol=protocol, host=url.url, port=port, ip=ipv6).set(
             queue='scanners.endpoint_discovery.ipv6')
-        result_task = connect_result.s(protocol, url, port, 6)  # administrative task
+        result_task = connect_result.s(protocol, url.pk, port, 6)  # administrative task
         task = (connect_task | result_task)
         task.apply_async()
 
 
+# TODO: make queue explicit, split functionality in storage and scanner
+@app.task(serializer='json')
+def resolve_and_scan_batch(url_ids: List[int], protocols_and_ports: List[Tuple[str, int]]):
+    """
+    Resolves a batch of urls and probes all given protocols and ports on them. Instead of a task per
+    url, port, protocol and ip version, there is one probe task per ip version for the whole batch.
+
+    :param url_ids: list of Url ids
+    :param protocols_and_ports: list of tuples, for example: [("http", 80), ("https", 443)]
+    """
+    targets = {4: [], 6: []}
+    resolvable, unresolvable, url_ips = [], [], []
+    urls = hydrate(Url, url_ids)
+
+    # resolve all names concurrently, instead of one after the other.
+    all_ips = resolver.resolve_many([url.url for url in urls])
+
+    for url in urls:
+        ips = all_ips[url.url]
+        url_ips.append([url.pk, list(ips)])
+
+        if not any(ips):
+            unresolvable.append(url.pk)
+            continue
+        resolvable.append(url.pk)
+
+        (ipv4, ipv6) = ips
+        for protocol, port in protocols_and_ports:
+            if ipv4:
+                targets[4].append(Target(url_id=url.pk, host=url.url, ip=ipv4, port=port, protocol=protocol))
+            if ipv6:
+                targets[6].append(Target(url_id=url.pk, host=url.url, ip=ipv6, port=port, protocol=protocol))
+
+    # administrative, the reverse names of new addresses are looked up later.
+    store_url_liveness.si(resolvable, unresolvable, url_ips).apply_async()
+
+    for ip_version, ip_targets in targets.items():
+        if not ip_targets:
+            continue
+
+        probe_task = can_connect_batch.s(ip_targets).set(
+            queue='scanners.endpoint_discovery.ipv%s' % ip_version)
+        result_task = connect_results.s(ip_version)  # administrative task
+        task = (probe_task | result_task)
+        task.apply_async()
+
+
+@app.task(queue='scanners', serializer='json')
+def verify_batch(urls: List[list]):
+    """
+    Verifies the known endpoints of a batch of urls. Every url is resolved once, and all endpoints of all urls are
+    probed in a single task per ip version. What changed is stored in bulk: one storage task for the urls and one per
+    ip version for the endpoints.
+
+    Endpoints of an ip version that the url has no address for (anymore), or that the network of this worker does not
+    support, are left alone.
+
+    :param urls: list of [url id, url, list of [protocol, port, ip version]], see verify_endpoints.
+    """
+    targets = {4: [], 6: []}
+    resolvable, unresolvable, url_ips = [], [], []
+
+    # resolve all names concurrently, instead of one after the other.
+    all_ips = resolver.resolve_many([host for url_id, host, endpoints in urls])
+
+    for url_id, host, endpoints in urls:
+        ips = all_ips[host]
+        url_ips.append([url_id, list(ips)])
+
+        if not any(ips):
+            unresolvable.append(url_id)
+            continue
+        resolvable.append(url_id)
+
+        for protocol, port, ip_version in endpoints:
+            ip = ips[0] if ip_version == 4 else ips[1]
+            if ip:
+                targets[ip_version].append(Target(url_id=url_id, host=host, ip=ip, port=port, protocol=protocol))
+
+    store_url_liveness.si(resolvable, unresolvable, url_ips).apply_async()
+
+    for ip_version, ip_targets in targets.items():
+        if not ip_targets:
+            continue
+
+        probe_task = can_connect_batch.s(ip_targets).set(queue='scanners.endpoint_discovery.ipv%s' % ip_version)
+        result_task = store_endpoint_liveness.s(ip_version).set(queue='storage')
+        (probe_task | result_task).apply_async()
+
+    return {'resolvable': len(resolvable), 'unresolvable': len(unresolvable),
+            'targets': sum(len(ip_targets) for ip_targets in targets.values())}
+
+
 def get_ips(url: str):
-    ipv4 = ""
-    ipv6 = ""
-
-    if settings.NETWORK_SUPPORTS_IPV4:
-        try:
-            ipv4 = socket.gethostbyname(url)
-            logger.debug("%s has IPv4 address: %s" % (url, ipv4))
-        except Exception as ex:
-            # when not known: [Errno 8] nodename nor servname provided, or not known
-            logger.debug("Get IPv4 error: %s" % ex)
-
-    if settings.NETWORK_SUPPORTS_IPV6:
-        try:
-            # dig AAAA faalkaart.nl +short (might be used for debugging)
-            x = socket.getaddrinfo(url, None, socket.AF_INET6)
-            ipv6 = x[0][4][0]
-
-            # six to four addresses make no sense
-            if str(ipv6).startswith("::ffff:"):
-                logger.error("Six-to-Four address %s discovered on %s, "
-                             "did you configure IPv6 connectivity correctly? "
-                             "Removing this IPv6 address from result to prevent "
-                             "database pollution." %
-                             (ipv6, url))
-                ipv6 = ""
-            else:
-                logger.debug("%s has IPv6 address: %s" % (url, ipv6))
-        except Exception as ex:
-            # when not known: [Errno 8nodename nor servname provided, or not known
-            logger.debug("Get IPv6 error: %s" % ex)
-
-    return ipv4, ipv6
-
-
-@app.task(
-    # When doing a lot of connections, try to do them in semi-random order also not to overload networks/firewalls
-
-    # Don't try and overload the network with too many connections.
-    # The (virtual) network (card) might have a problem keeping up.
-    # Firewalls might see it as hostile.
-    # Our database might be overloaded with work,
-
-    # To consider the rate limit:
-    # There are about 11000 endpoints at this moment.
-    # 3/s = 180/m = 1800/10m = 10800/h
-    # 4/s = 240/m = 2400/10m = 14400/h
-    # 5/s = 300/m = 3000/10m = 18000/h
-    # 10/s = 600/m = 6000/10m = 36000/h
-
-    # on the development machine it scans all within 10 minutes. About 20/s.
-
-    rate_limit='6/s',
-    # queue needs to be set based on ip, either scanners.endpoint_discovery.ipv4 or scanners.endpoint_discovery.ipv4
-)
-def can_connect(protocol: str, url: Url, port: int, ip: str) -> bool:
+    """Returns the first IPv4 and IPv6 address of an url. Answers are cached, see resolver."""
+    return resolver.resolve(url)
+
+
+# queue needs to be set based on ip, either scanners.endpoint_discovery.ipv4 or scanners.endpoint_discovery.ipv4
+# Don't try and overload the network with too many connections: firewalls might see it as hostile. The rate is limited
+# for all workers together, per host and per ip, see ratelimit.
+@app.task(bind=True)
+def can_connect(self, protocol: str, host: str, port: int, ip: str) -> bool:
     """
     Searches for both IPv4 and IPv6 IP addresses / types.
 
@@ -376,7 +448,9 @@ def can_connect(protocol: str, url: Url, port: int, ip: str) -> bool:
     else:
         uri = "%s://%s:%s" % (protocol, ip, port)
 
-    logger.debug("Attempting connect on: %s: host: %s IP: %s" % (uri, url.url, ip))
+    ratelimit.throttle(self, *ratelimit.target(host, ip))
+
+    logger.debug("Attempting connect on: %s: host: %s IP: %s" % (uri, host, ip))
 
     try:
         """
@@ -403,20 +477,19 @@ def can_connect(protocol: str, url: Url, port: int, ip: str) -> bool:
         # Certificate did not match expected hostname: 85.119.104.84.
         Certificate: {'subject': ((('commonName', 'webdiensten.drechtsteden.nl'),),)
         """
-        r = requests.get(uri, timeout=(30, 30),
-                         allow_redirects=False,  # redirect = connection
-                         verify=False,  # any tls = connection
-                         headers={'Host': url.url,
-                                  'User-Agent': get_random_user_agent()})
+        r = session('probe').get(uri,
+                                 allow_redirects=False,  # redirect = connection
+                                 verify=False,  # any tls = connection
+                                 headers={'Host': host})
         if r.status_code:
-            logger.debug("%s: Host: %s Status: %s" % (uri, url.url, r.status_code))
+            logger.debug("%s: Host: %s Status: %s" % (uri, host, r.status_code))
             return True
         else:
-            logger.debug("No status code? Now what?! %s" % url)
+            logger.debug("No status code? Now what?! %s" % host)
             # probably never reached, exception thrown when no status code is present
             return True
     except (ConnectTimeout, Timeout, ReadTimeout) as Ex:
-        logger.debug("%s: Timeout! - %s" % (url, Ex))
+        logger.debug("%s: Timeout! - %s" % (host, Ex))
         return False
     except (ConnectionRefusedError, ConnectionError, HTTPError) as Ex:
         """
@@ -432,7 +505,7 @@ def can_connect(protocol: str, url: Url, port: int, ip: str) -> bool:
         Perhaps: (todo)
         - EOF occurred in violation of protocol
         """
-        logger.debug("%s: Exception returned: %s" % (url, Ex))
+        logger.debug("%s: Exception returned: %s" % (host, Ex))
         strerror = Ex.args  # this can be multiple.  # zit in nested exception?
         strerror = str(strerror)  # Cast whatever we get back to a string. Instead of trace.
         if any(["BadStatusLine" in strerror,
@@ -447,8 +520,60 @@ def can_connect(protocol: str, url: Url, port: int, ip: str) -> bool:
             return False
 
 
+# queue needs to be set based on ip, either scanners.endpoint_discovery.ipv4 or scanners.endpoint_discovery.ipv6
+@app.task
+def can_connect_batch(targets: List[Target]) -> List[Tuple[Target, bool]]:
+    """
+    Bulk version of can_connect. All targets are contacted concurrently from a single worker, where the
+    amount of connections is capped globally and per host. See http_prober.
+
+    On green threads (see the scanner_io worker role) every target gets a green thread that uses can_connect
+    instead: the event loop of the prober does not work with the patched standard library.
+
+    :param targets: list of Target, all of the same ip version.
+    :return: list of tuples of the target and the connect result.
+    """
+    logger.info("Probing %s targets." % len(targets))
+    if green_threads():
+        return list(zip(targets, probe_batch_green(targets)))
+    return list(zip(targets, probe_batch(targets)))
+
+
+def probe_batch_green(targets: List[Target]) -> List[bool]:
+    """Same as probe_batch, with the same limits, using green threads."""
+    # import here, only workers with green threads need this library.
+    import eventlet
+    from eventlet.semaphore import Semaphore
+
+    per_host = defaultdict(lambda: Semaphore(PER_HOST_CONCURRENCY))
+
+    def probe(target):
+        with per_host[target.ip]:
+            return can_connect(target.protocol, target.host, target.port, target.ip)
+
+    return list(eventlet.GreenPool(GLOBAL_CONCURRENCY).imap(probe, targets))
+
+
+@app.task(queue='storage')
+def connect_results(results: List[Tuple[Target, bool]], ip_version: int):
+    """Stores the result of can_connect_batch."""
+    urls = {url.pk: url for url in hydrate(Url, set(target.url_id for target, result in results))}
+    for target, result in results:
+        if target.url_id in urls:
+            connect_result(result, target.protocol, urls[target.url_id], target.port, ip_version)
+
+
 @app.task(queue='storage')
 def connect_result(result, protocol: str, url: Url, port: int, ip_version: int):
+    """
+    Stores the result of can_connect.
+
+    :param url: id of the Url, or the Url itself when called directly.
+    """
+    url = hydrate_one(Url, url)
+    if not url:
+        return
+
     logger.info("%s %s" % (url, result))
     # logger.info("%s %s" % (url, url))
     # logger.info("%s %s" % (url, port))
@@ -461,6 +586,27 @@ def connect_result(result, protocol: str, url: Url, port: int, ip_version: int):
         kill_endpoint(protocol, url, port, ip_version)
 
 
+@app.task(queue='storage')
+def store_endpoint_liveness(results: List[Tuple[Target, bool]], ip_version: int):
+    """
+    Stores the result of can_connect_batch for known endpoints, see verify_batch. Endpoints that could not be
+    contacted are killed in bulk, the others already exist and stay as they are.
+    """
+    unreachable = [target for target, result in results if not result]
+
+    killed = 0
+    for i in range(0, len(unreachable), ENDPOINTS_PER_UPDATE):
+        endpoints = reduce(operator.or_, (Q(url_id=target.url_id, protocol=target.protocol, port=target.port)
+                                          for target in unreachable[i:i + ENDPOINTS_PER_UPDATE]))
+        killed += Endpoint.objects.all().filter(endpoints, ip_version=ip_version, is_dead=False).update(
+            is_dead=True,
+            is_dead_since=datetime.now(pytz.utc),
+            is_dead_reason="Not found in HTTP Scanner anymore.")
+
+    logger.info("Verified %s IPv%s endpoints, killed %s." % (len(results), ip_version, killed))
+    return killed
+
+
 def resolves(url: str):
     (ip4, ip6) = get_ips(url)
     if ip4 or ip6:
@@ -521,8 +667,8 @@ def save_endpoint(protocol: str, url: Url, port: int, ip_version: int):
     return
 
 
-@app.task(queue='storage')
-def revive_url(url: Url):
+@app.task(queue='storage', serializer='json')
+def revive_url(url_id: int):
     """
     Sets a URL as resolvable. Does not touches the is_dead (layer 8) field.
 
@@ -532,90 +678,163 @@ def revive_url(url: Url):
 
     Should this add a new url instead of reviving the old one to better reflect the network?
 
-    :param url:
+    :param url_id:
     :return:
     """
-    if url.not_resolvable:
-        url.not_resolvable = False
-        url.not_resolvable_since = datetime.now(pytz.utc)
-        url.not_resolvable_reason = "Made resolvable again since ip address was found."
-        url.save()
+    revive_urls([url_id])
 
 
-@app.task(queue='storage')
-def kill_url(url: Url):
+@app.task(queue='storage', serializer='json')
+def kill_url(url_id: int):
     """
     Sets a URL as not resolvable. Does not touches the is_dead (layer 8) field.
 
-    :param url:
+    :param url_id:
     :return:
     """
-    url.not_resolvable = True
-    url.not_resolvable_since = datetime.now(pytz.utc)
-    url.not_resolvable_reason = "No IPv4 or IPv6 address found in http scanner."
-    url.save()
+    kill_urls([url_id])
+
+
+@app.task(queue='storage', serializer='json')
+def store_url_liveness(resolvable: List[int], unresolvable: List[int], url_ips: List[list]):
+    """
+    Bulk version of revive_url, kill_url and store_url_ips, see verify_batch.
+
+    :param resolvable: ids of urls that have an ip address.
+    :param unresolvable: ids of urls without an ip address.
+    :param url_ips: list of [url id, ips].
+    """
+    revive_urls(resolvable)
+    kill_urls(unresolvable)
 
-    Endpoint.objects.all().filter(url=url).update(is_dead=True,
-                                                  is_dead_since=datetime.now(pytz.utc),
-                                                  is_dead_reason="Url was killed")
+    urls = {url.pk: url for url in hydrate(Url, [url_id for url_id, ips in url_ips])}
+    new_ips = save_url_ips([(urls[url_id], ips) for url_id, ips in url_ips if url_id in urls])
+    enrich_rdns_names(new_ips)
 
-    UrlIp.objects.all().filter(url=url).update(
+
+def revive_urls(url_ids: List[int]):
+    Url.objects.all().filter(pk__in=url_ids, not_resolvable=True).update(
+        not_resolvable=False,
+        not_resolvable_since=datetime.now(pytz.utc),
+        not_resolvable_reason="Made resolvable again since ip address was found."
+    )
+
+
+def kill_urls(url_ids: List[int]):
+    if not url_ids:
+        return
+
+    Url.objects.all().filter(pk__in=url_ids).update(
+        not_resolvable=True,
+        not_resolvable_since=datetime.now(pytz.utc),
+        not_resolvable_reason="No IPv4 or IPv6 address found in http scanner."
+    )
+
+    Endpoint.objects.all().filter(url__in=url_ids, is_dead=False).update(
+        is_dead=True,
+        is_dead_since=datetime.now(pytz.utc),
+        is_dead_reason="Url was killed"
+    )
+
+    UrlIp.objects.all().filter(url__in=url_ids, is_unused=False).update(
         is_unused=True,
         is_unused_since=datetime.now(pytz.utc),
         is_unused_reason="Url was killed"
     )
 
 
-@app.task(queue='storage')
+@app.task(queue='storage', serializer='json')
 def store_url_ips(url: Url, ips):
     """
     Todo: method should be stored in manager
 
     Be sure to give all ip's that are currently active in one call. Mix IPv4 and IPv6.
 
+    :param url: id of the Url, or the Url itself when called directly.
+
     the http endpoint finder will clash with qualys on this method, until we're using the same
     method to discover all ip's this url currently has.
     """
+    url = hydrate_one(Url, url)
+    if not url:
+        return
 
-    for ip in ips:
+    enrich_rdns_names(save_url_ips([(url, ips)]))
 
+
+def save_url_ips(url_ips: List[Tuple[Url, List[str]]]) -> List[str]:
+    """
+    Stores the current ip's of urls in bulk. New addresses are stored without reverse name: looking those up can take
+    seconds per address, which is done later by enrich_rdns_names.
+
+    :param url_ips: list of tuples of an url and all its current ip's.
+    :return: the addresses that were new.
+    """
+    current = defaultdict(set)
+    for url_id, ip in UrlIp.objects.all().filter(url__in=[url for url, ips in url_ips], is_unused=False).values_list(
+            'url_id', 'ip'):
+        current[url_id].add(ip)
+
+    new = []
+    for url, ips in url_ips:
         # sometimes there is no ipv4 or 6 address... or you get some other dirty dataset.
-        if not ip:
-            continue
+        ips = set(ip for ip in ips if ip)
 
         # the same thing that exists already? don't do anything about it.
-        if UrlIp.objects.all().filter(url=url, ip=ip, is_unused=False).count():
-            continue
+        for ip in sorted(ips - current[url.pk]):
+            new.append(UrlIp(url=url, ip=ip, is_unused=False, discovered_on=datetime.now(pytz.utc), rdns_name=None))
 
-        epip = UrlIp()
-        epip.ip = ip
-        epip.url = url
-        epip.is_unused = False
-        epip.discovered_on = datetime.now(pytz.utc)
-        epip.rdns_name = get_rdns_name(ip)
-        epip.save()
+        # and then clean up all that are not in the current set of ip's.
+        if current[url.pk] - ips:
+            UrlIp.objects.all().filter(url=url, is_unused=False).exclude(ip__in=ips).update(
+                is_unused=True,
+                is_unused_since=datetime.now(pytz.utc),
+                is_unused_reason="cleanup at storing new endpoints"
+            )
 
-    # and then clean up all that are not in the current set of ip's.
-    UrlIp.objects.all().filter(url=url, is_unused=False).exclude(ip__in=ips).update(
-        is_unused=True,
-        is_unused_since=datetime.now(pytz.utc),
-        is_unused_reason="cleanup at storing new endpoints"
-    )
+    UrlIp.objects.bulk_create(new)
+    return sorted(set(url_ip.ip for url_ip in new))
 
 
-@timeout(10)
-def get_rdns_name(ip):
-    reverse_name = ""
-    try:
-        reverse_name = socket.gethostbyaddr(ip)
-    except (TimeoutError, socket.herror):
-        # takes too long
-        # host doesn't exist
-        pass
-    except BaseException as e:
-        logger.error('Unknown rdns failure %s on ip %s' % (str(e), ip))
+def enrich_rdns_names(ips: List[str]):
+    """Looks up the reverse names of addresses on a scanner, and stores them on a storage worker afterwards."""
+    for i in range(0, len(ips), IPS_PER_TASK):
+        lookup_task = lookup_rdns_names.si(ips[i:i + IPS_PER_TASK]).set(queue='scanners')
+        store_task = store_rdns_names.s().set(queue='storage')
+        (lookup_task | store_task).apply_async()
+
+
+@app.task(queue='storage')
+def enrich_pending_rdns_names():
+    """
+    Looks up the reverse names of all addresses that don't have one yet. For example when the enrichment task was lost
+    because a worker was restarted.
+    """
+    ips = list(UrlIp.objects.all().filter(rdns_name__isnull=True, is_unused=False).values_list(
+        'ip', flat=True).distinct())
+    logger.info("Looking up reverse names of %s addresses." % len(ips))
+    enrich_rdns_names(ips)
+
 
-    return reverse_name
+@app.task(queue='scanners', serializer='json')
+def lookup_rdns_names(ips: List[str]) -> Dict[str, Optional[str]]:
+    """Reverse names of addresses, from the shared DNS cache if possible. See resolver."""
+    return resolver.reverse_many(ips)
+
+
+@app.task(queue='storage', serializer='json')
+def store_rdns_names(rdns_names: Dict[str, Optional[str]]):
+    """
+    Fills in the reverse names of addresses that were stored without one, an update per distinct name. Addresses of
+    which the lookup failed (None) stay without one, so enrich_pending_rdns_names tries them again.
+    """
+    ips_per_name = defaultdict(list)
+    for ip, rdns_name in rdns_names.items():
+        if rdns_name is not None:
+            ips_per_name[rdns_name].append(ip)
+
+    for rdns_name, ips in ips_per_name.items():
+        UrlIp.objects.all().filter(ip__in=ips, rdns_name__isnull=True).update(rdns_name=rdns_name)
 
 
 def endpoint_exists(url, port, protocol, ip_version):
@@ -663,10 +882,10 @@ def check_network(code_location=""):
 
     (ipv4, ipv6) = ips
     if ipv4:
-        can_ipv4 = can_connect("https", url, 443, ipv4)
+        can_ipv4 = can_connect("https", url.url, 443, ipv4)
 
     if ipv6:
-        can_ipv6 = can_connect("https", url, 443, ipv6)
+        can_ipv6 = can_connect("https", url.url, 443, ipv6)
 
     if not can_ipv4 and not can_ipv6:
         raise ConnectionError("Both ipv6 and ipv4 networks could not be reached via %s."
@@ -719,12 +938,10 @@ def redirects_to_safety(endpoint: Endpoint):
         uri = "%s://[%s]:%s" % ("http", ipv6, "80")
 
     try:
-        response = requests.get(uri,
-                                timeout=(30, 30),  # allow for insane network lag
-                                allow_redirects=True,  # point is: redirects to safety
-                                verify=False,  # certificate validity is checked elsewhere, having some https > none
-                                headers={'Host': endpoint.url.url,
-                                         'User-Agent': get_random_user_agent()})
+        response = session('probe').get(uri,
+                                        allow_redirects=True,  # point is: redirects to safety
+                                        verify=False,  # certificate validity is checked elsewhere, https > none
+                                        headers={'Host': endpoint.url.url})
         if response.history:
             logger.debug("Request was redirected, there is hope. Redirect path:")
             for resp in response.history:
@@ -742,26 +959,3 @@ def redirects_to_safety(endpoint: Endpoint):
     except (ConnectTimeout, HTTPError, ReadTimeout, Timeout, ConnectionError, requests.exceptions.TooManyRedirects):
         logger.debug("Request resulted into an error, it's not redirecting properly.")
         return False
-
-
-# http://useragentstring.com/pages/useragentstring.php/
-def get_random_user_agent():
-    user_agents = [
-        # Samsung Galaxy S6
-        "Mozilla/5.0 (Linux; Android 6.0.1; SM-G920V Build/MMB29K) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/52.0.2743.98 Mobile Safari/537.36",
-        # HTC One M9
-        "Mozilla/5.0 (Linux; Android 6.0; HTC One M9 Build/MRA58K) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/52.0.2743.98 Mobile Safari/537.36",
-        # Windows 10 with Edge
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/42.0.2311.135 Safari/537.36 Edge/12.246",
-        # Safari
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_2) AppleWebKit/601.3.9 "
-        "(KHTML, like Gecko) Version/9.0.2 Safari/601.3.9",
-        # Windows 7
-        "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 "
-        "(KHTML, like Gecko) Chrome/47.0.2526.111 Safari/537.36"
-    ]
-
-    return random.choice(user_agents)
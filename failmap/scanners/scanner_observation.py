@@ -0,0 +1,216 @@
+"""
+Visit every http(s) endpoint once and rate it with several analyzers.
+
+The security headers, plain http and endpoint discovery scanners all contact the same endpoints, often minutes
+apart. This scanner visits an endpoint once, stores what it answered (an EndpointObservation) and lets the
+analyzers rate the endpoint using that observation:
+
+- liveness: endpoints that don't respond anymore are declared dead.
+- security headers: see scanner_security_headers.header_ratings.
+- plain http: see scanner_plain_http.plain_http_rating.
+
+Visiting happens on the scanner queues, analyzing on the storage queue. Analyzers never contact the endpoint.
+"""
+import logging
+from datetime import datetime
+from typing import List
+from urllib.parse import urlparse
+
+import pytz
+import urllib3
+from celery import Task
+from requests.exceptions import ConnectionError, SSLError, Timeout, TooManyRedirects
+
+from failmap.celery import IP_VERSION_QUEUE, ParentFailed, app
+from failmap.celery.hydrate import hydrate_one
+from failmap.organizations.models import Organization, Url
+from failmap.scanners import ratelimit
+from failmap.scanners.endpoint_scan_manager import EndpointScanManager
+from failmap.scanners.http_session import session
+from failmap.scanners.models import Endpoint, EndpointObservation
+from failmap.scanners.producer import produce_tasks
+from failmap.scanners.scanner_plain_http import plain_http_rating
+from failmap.scanners.scanner_security_headers import header_ratings
+
+log = logging.getLogger(__name__)
+
+
+# queues the tasks of this scanner end up in, see producer.
+PRODUCER_QUEUES = list(IP_VERSION_QUEUE.values()) + ['storage']
+
+
+def compose_task(
+    organizations_filter: dict = dict(),
+    urls_filter: dict = dict(),
+    endpoints_filter: dict = dict(),
+) -> Task:
+    """Compose taskset to observe specified endpoints.
+
+    *This is an implementation of `compose_task`. For more documentation about this concept, arguments and concrete
+    examples of usage refer to `compose_task` in `types.py`.*
+
+    There is a task for every endpoint: the tasks are published in chunks by the producer, see producer.
+    """
+    if not producer_targets(organizations_filter, urls_filter, endpoints_filter).exists():
+        raise Exception('Applied filters resulted in no tasks!')
+
+    return produce_tasks.si(__name__, organizations_filter, urls_filter, endpoints_filter)
+
+
+def producer_targets(organizations_filter: dict = dict(), urls_filter: dict = dict(),
+                     endpoints_filter: dict = dict()):
+    """Endpoints to observe, see producer."""
+    # apply filter to organizations (or if no filter, all organizations)
+    organizations = Organization.objects.filter(**organizations_filter)
+    # apply filter to urls in organizations (or if no filter, all urls)
+    urls = Url.objects.filter(organization__in=organizations, **urls_filter)
+
+    # select endpoints to scan based on filters
+    return Endpoint.objects.filter(
+        # apply filter to endpoints (or if no filter, all endpoints)
+        url__in=urls, **endpoints_filter,
+        # also apply manditory filters to only select valid endpoints for this action
+        is_dead=False, protocol__in=['http', 'https']).select_related('url')
+
+
+def producer_tasks(endpoints: List[Endpoint]) -> List[Task]:
+    """Tasks for a chunk of endpoints, see producer."""
+    return [
+        observe.signature(
+            (endpoint.uri_url(),),
+            options={'queue': IP_VERSION_QUEUE[endpoint.ip_version]}
+        ) | store_observation.s(endpoint.pk) for endpoint in endpoints
+    ]
+
+
+@app.task(bind=True)
+def observe(self, uri_url: str) -> dict:
+    """
+    Visits an endpoint, following all redirects, and returns what it answered.
+
+    Any answer means the endpoint exists, also broken TLS and garbage responses. See can_connect in scanner_http.
+
+    :param uri_url: protocol, url and port, for example: https://faalkaart.nl:443
+    :return: dictionary with the fields of EndpointObservation.
+    """
+    observation = {
+        'when': datetime.now(pytz.utc),
+        'reachable': False,
+        'status_code': None,
+        'headers': {},
+        'redirects': [],
+        'final_url': '',
+        'tls': '',
+        'error': '',
+    }
+
+    ratelimit.throttle(self, *ratelimit.target(urlparse(uri_url).hostname))
+
+    try:
+        # certificate validity is checked elsewhere
+        response = session().get(uri_url, allow_redirects=True, verify=False)
+    except SSLError as Ex:
+        # There is a server, but we're not able to communicate with it correctly.
+        observation.update({'reachable': True, 'tls': str(Ex)[0:255], 'error': 'TLS handshake failed.'})
+    except (TooManyRedirects, ValueError, urllib3.exceptions.LocationValueError) as Ex:
+        # There is a server, it just doesn't redirect to anything sensible.
+        observation.update({'reachable': True, 'error': str(Ex)[0:255]})
+    except Timeout as Ex:
+        observation['error'] = str(Ex)[0:255]
+    except ConnectionError as Ex:
+        observation.update({'reachable': indicates_server(Ex), 'error': str(Ex)[0:255]})
+    else:
+        observation.update({
+            'reachable': True,
+            'status_code': response.status_code,
+            'headers': dict(response.headers),
+            'redirects': [[redirect.status_code, redirect.url] for redirect in response.history],
+            'final_url': response.url,
+        })
+
+    if uri_url.startswith('https://') and observation['reachable'] and not observation['tls']:
+        observation['tls'] = 'ok'
+
+    log.debug("Observed %s: %s" % (uri_url, observation))
+    return observation
+
+
+def indicates_server(exception: Exception) -> bool:
+    """Some connection errors still mean there is a server. Same reasoning as can_connect in scanner_http."""
+    strerror = str(exception.args)
+    return any(["BadStatusLine" in strerror,
+                "CertificateError" in strerror,
+                "certificate verify failed" in strerror,
+                "bad handshake" in strerror])
+
+
+# database related tasks should by default be handled by a worker connected to the database
+@app.task(queue='storage')
+def store_observation(result: dict, endpoint: Endpoint):
+    """:param endpoint: id of the Endpoint, or the Endpoint itself when called directly."""
+    # if scan task failed, ignore the result (exception) and report failed status
+    if isinstance(result, Exception):
+        return ParentFailed('skipping result parsing because observation failed.', cause=result)
+
+    endpoint = hydrate_one(Endpoint, endpoint, ['url'])
+    if not endpoint:
+        return {'status': 'skipped'}
+
+    observation, created = EndpointObservation.objects.update_or_create(endpoint=endpoint, defaults=result)
+
+    analyze_liveness(observation)
+    if not observation.reachable:
+        return {'status': 'success'}
+
+    analyze_security_headers(observation)
+    analyze_plain_http(observation)
+
+    return {'status': 'success'}
+
+
+def analyze_liveness(observation: EndpointObservation):
+    """An endpoint that does not respond at all is dead."""
+    endpoint = observation.endpoint
+
+    if observation.reachable or endpoint.is_dead:
+        return
+
+    log.info("Endpoint did not respond, declaring it dead: %s" % endpoint)
+    endpoint.is_dead = True
+    endpoint.is_dead_since = observation.when
+    endpoint.is_dead_reason = "Not reachable during observation: %s" % observation.error[0:200]
+    endpoint.save()
+
+
+def analyze_security_headers(observation: EndpointObservation):
+    # without a response there are no headers to judge.
+    if not observation.status_code:
+        return
+
+    endpoint = observation.endpoint
+
+    # runs any unsecured http service? (on ANY port).
+    unsecure_services = endpoint.protocol == "https" and Endpoint.objects.all().filter(
+        url=endpoint.url, protocol="http", is_dead=False).exists()
+
+    ratings = header_ratings(endpoint.protocol, observation.headers, unsecure_services)
+    EndpointScanManager.add_scans([(scan_type, endpoint, rating, message) for scan_type, rating, message in ratings])
+
+
+def analyze_plain_http(observation: EndpointObservation):
+    """Only sites on the standard http port are judged, the same as scanner_plain_http."""
+    endpoint = observation.endpoint
+
+    if endpoint.protocol != "http" or endpoint.port != 80:
+        return
+
+    has_https = Endpoint.objects.all().filter(
+        url=endpoint.url, ip_version=endpoint.ip_version, protocol="https", port=443, is_dead=False).exists()
+
+    rating = plain_http_rating(
+        has_https=has_https,
+        redirects_to_https=observation.final_url.startswith("https://"),
+        had_scan_with_points=EndpointScanManager.had_scan_with_points("plain_https", endpoint))
+
+    if rating:
+        EndpointScanManager.add_scan("plain_https", endpoint, rating[0], rating[1])
@@ -20,6 +20,11 @@ from .models import Endpoint
 
 log = logging.getLogger(__package__)
 
+SAVED_BY_THE_BELL = "Redirects to a secure site, while a secure counterpart on the standard port is missing."
+NO_HTTPS_AT_ALL = "Site does not redirect to secure url, and has no secure alternative on a standard port."
+CLEANED_UP = "Has a secure equivalent, which wasn't so in the past."
+NOT_RESOLVABLE_AT_ALL = "Cannot be resolved anymore, seems to be cleaned up."
+
 
 def compose_task(
     organizations_filter: dict = dict(),
@@ -84,11 +89,6 @@ def scan_url(url: Url):
     http_v4_endpoint = None
     http_v6_endpoint = None
 
-    saved_by_the_bell = "Redirects to a secure site, while a secure counterpart on the standard port is missing."
-    no_https_at_all = "Site does not redirect to secure url, and has no secure alternative on a standard port."
-    cleaned_up = "Has a secure equivalent, which wasn't so in the past."
-    not_resolvable_at_all = "Cannot be resolved anymore, seems to be cleaned up."
-
     # The default ports matter for normal humans. All services on other ports are special services.
     # we only give points if there is not a normal https site when there is a normal http site.
 
@@ -133,7 +133,7 @@ def scan_url(url: Url):
         if not resolves_on_v4(url.url):
             # the endpoint scanner will probably find there is no endpoint anymore as well...
             log.debug("Does not resolve at all, so has no insecure endpoints. %s" % url)
-            scan_manager.add_scan("plain_https", http_v4_endpoint, "0", not_resolvable_at_all)
+            scan_manager.add_scan("plain_https", http_v4_endpoint, "0", NOT_RESOLVABLE_AT_ALL)
         else:
             log.debug("This url seems to have no https at all: %s" % url)
             log.debug("Checking if they exist, to be sure there is nothing.")
@@ -145,15 +145,15 @@ def scan_url(url: Url):
                 log.info("Checking if the URL redirects to a secure url: %s" % url)
                 if redirects_to_safety(http_v4_endpoint):
                     log.info("%s redirects to safety, saved by the bell." % url)
-                    scan_manager.add_scan("plain_https", http_v4_endpoint, "25", saved_by_the_bell)
+                    scan_manager.add_scan("plain_https", http_v4_endpoint, "25", SAVED_BY_THE_BELL)
 
                 else:
                     log.info("%s does not have a https site. Saving/updating scan." % url)
-                    scan_manager.add_scan("plain_https", http_v4_endpoint, "1000", no_https_at_all)
+                    scan_manager.add_scan("plain_https", http_v4_endpoint, "1000", NO_HTTPS_AT_ALL)
     else:
         # it is secure, and if there was a rating, then reduce it to 0 (with a new rating).
         if scan_manager.had_scan_with_points("plain_https", http_v4_endpoint):
-            scan_manager.add_scan("plain_https", http_v4_endpoint, "0", cleaned_up)
+            scan_manager.add_scan("plain_https", http_v4_endpoint, "0", CLEANED_UP)
 
     if has_http_v6 and not has_https_v6:
 
@@ -161,16 +161,37 @@ def scan_url(url: Url):
         if not resolves_on_v6(url.url):
             # the endpoint scanner will probably find there is no endpoint anymore as well...
             log.debug("Does not resolve at all, so has no insecure endpoints. %s" % url)
-            scan_manager.add_scan("plain_https", http_v6_endpoint, "0", not_resolvable_at_all)
+            scan_manager.add_scan("plain_https", http_v6_endpoint, "0", NOT_RESOLVABLE_AT_ALL)
         else:
             if not verify_is_secure(http_v6_endpoint):
                 if redirects_to_safety(http_v6_endpoint):
-                    scan_manager.add_scan("plain_https", http_v6_endpoint, "25", saved_by_the_bell)
+                    scan_manager.add_scan("plain_https", http_v6_endpoint, "25", SAVED_BY_THE_BELL)
                 else:
-                    scan_manager.add_scan("plain_https", http_v6_endpoint, "1000", no_https_at_all)
+                    scan_manager.add_scan("plain_https", http_v6_endpoint, "1000", NO_HTTPS_AT_ALL)
     else:
         # it is secure, and if there was a rating, then reduce it to 0 (with a new rating).
         if scan_manager.had_scan_with_points("plain_https", http_v6_endpoint):
-            scan_manager.add_scan("plain_https", http_v6_endpoint, "0", cleaned_up)
+            scan_manager.add_scan("plain_https", http_v6_endpoint, "0", CLEANED_UP)
 
     return
+
+
+def plain_http_rating(has_https: bool, redirects_to_https: bool, had_scan_with_points: bool):
+    """
+    Rates a http endpoint on the standard port, without contacting anything.
+
+    :param has_https: if there is a https endpoint on the standard port for the same url and ip version.
+    :param redirects_to_https: if the http endpoint redirects to a https url.
+    :param had_scan_with_points: if the previous plain_https scan of this endpoint had points.
+    :return: rating and message, or None if there is nothing to store.
+    """
+    if not has_https:
+        if redirects_to_https:
+            return "25", SAVED_BY_THE_BELL
+        return "1000", NO_HTTPS_AT_ALL
+
+    # it is secure, and if there was a rating, then reduce it to 0 (with a new rating).
+    if had_scan_with_points:
+        return "0", CLEANED_UP
+
+    return None
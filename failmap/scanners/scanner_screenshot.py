@@ -25,6 +25,10 @@ was the way to go.
 - Runner up: headless firefox
 Too bleeding edge: while you can specify a filename, it had a bug that prevented it to quit / restart.
 
+- Now: a pool of headless chromes, driven by pyppeteer
+Starting chrome for every screenshot is what made it slow. When pyppeteer is installed, screenshots are made by a
+few long running browsers with several tabs each, see screenshot_service.
+
 """
 
 import logging
@@ -36,11 +40,12 @@ from datetime import datetime, timedelta
 
 import pytz
 from django.conf import settings
-from PIL import Image
+from django.db.models import Count, OuterRef, Q, Subquery
 
 from failmap.celery import app
+from failmap.scanners import scheduler, screenshot_service
 from failmap.scanners.models import Endpoint, Screenshot
-from failmap.scanners.timeout import timeout
+from failmap.scanners.timeout import Deadline, run
 
 logger = logging.getLogger(__package__)
 
@@ -48,8 +53,7 @@ logger = logging.getLogger(__package__)
 # TODO: make queue explicit, split functionality in storage and scanner
 @app.task
 def screenshot_urls(urls):
-    for url in urls:
-        screenshot_url(url)
+    screenshot_endpoints(Endpoint.objects.all().filter(url__in=urls))
 
 
 # TODO: make queue explicit, split functionality in storage and scanner
@@ -61,12 +65,23 @@ def screenshot_url(url):
     :param urls: list of url objects
     :return:
     """
-    endpoints = Endpoint.objects.all().filter(url=url)
+    screenshot_endpoints(Endpoint.objects.all().filter(url=url))
+
+
+def screenshot_endpoints(endpoints):
+    """
+    Screenshots of all endpoints: with the browser pool if possible, otherwise one by one.
+
+    :return: statistics of the browser pool, None when not used.
+    """
+    if screenshot_service.available():
+        endpoints = list(endpoints)
+        hashes = latest_perceptual_hashes(endpoints)
+        return screenshot_service.ScreenshotService(
+            endpoints, handle_result=save_screenshot, previous_hash=lambda endpoint: hashes.get(endpoint.id, '')).run()
+
     for endpoint in endpoints:
-        try:
-            screenshot_with_chrome(endpoint)
-        except TimeoutError:
-            pass
+        screenshot_endpoint(endpoint)
 
 
 def screenshot_endpoint(endpoint):
@@ -77,58 +92,51 @@ def screenshot_endpoint(endpoint):
 
 
 def screenshots_of_new_urls():
-    one_month_ago = datetime.now(pytz.utc) - timedelta(days=31)
-
-    # never had a screenshot or only has screenshots older than a month
-    no_screenshots = Endpoint.objects.all().filter(is_dead=False,
-                                                   url__not_resolvable=False,
-                                                   screenshot__isnull=True)
-    outdated_screenshots = Endpoint.objects.all().filter(
-        is_dead=False,
-        url__not_resolvable=False,
-        screenshot__created_on__lt=one_month_ago)
-    endpoints = list(no_screenshots) + list(outdated_screenshots)
+    fresh_since = datetime.now(pytz.utc) - timedelta(hours=settings.SCAN_SCHEDULE['screenshot']['freshness'])
+
+    # never had a screenshot or the page was not seen for a month. Unchanged pages only update last_scan_moment.
+    recent_screenshots = Screenshot.objects.all().filter(
+        Q(last_scan_moment__gte=fresh_since) | Q(last_scan_moment__isnull=True, created_on__gte=fresh_since))
+    endpoints = Endpoint.objects.all().filter(
+        is_dead=False, url__not_resolvable=False).exclude(id__in=recent_screenshots.values('endpoint_id'))
+
+    # the endpoints that were not tried for the longest time, as many as the budget allows.
+    endpoints = scheduler.plan('screenshot', endpoints)
 
     if len(endpoints):
         logger.info("Trying to make %s screenshot!" % len(endpoints))
 
-    for endpoint in endpoints:
-        screenshot_endpoint(endpoint)
+    screenshot_endpoints(endpoints)
 
 
 # only one copy of firefox can be open at a time
 # Firefox doesn't close and show dialogs in headless: https://bugzilla.mozilla.org/show_bug.cgi?id=1403934
-@timeout(30, 'Took too long to make screenshot')
 def screenshot_with_firefox(endpoint, skip_if_latest=False):
+    deadline = Deadline(30, 'Took too long to make screenshot')
     if not check_installation('firefox'):
         return
 
+    output_dir = settings.TOOLS['firefox']['screenshot_output_dir']
     now = str(datetime.now(pytz.utc).strftime("_%Y%m%d_%H%M%S_%f"))
     filename = str(re.sub(r'[^a-zA-Z0-9_]', '', str(endpoint.ip_version) + '_' + endpoint.uri_url() + now))
-    screenshot_image = settings.TOOLS['firefox']['screenshot_output_dir'] + filename + '.png'
-    screenshot_thumbnail = settings.TOOLS['firefox']['screenshot_output_dir'] + filename + '_small.png'
-    latest_thumbnail = settings.TOOLS['firefox']['screenshot_output_dir'] + filename + '_latest.png'
+    screenshot_image = output_dir + filename + '.png'
+    latest_thumbnail = screenshot_service.latest_path(output_dir, endpoint)
 
     logger.debug("screenshot image: %s" % screenshot_image)
-    logger.debug("screenshot thumbnail: %s" % screenshot_thumbnail)
     logger.debug("latest thumbnail: %s" % latest_thumbnail)
 
     if skip_if_latest and os.path.exists(latest_thumbnail):
         logger.debug("Skipped making screenshot, by request")
         return
 
-    subprocess.call([settings.TOOLS['firefox']['executable'][platform.system()],
-                     '-screenshot',
-                     screenshot_image,
-                     endpoint.uri_url(),
-                     '--window-size=1920,3000',
-                     ])
+    run([settings.TOOLS['firefox']['executable'][platform.system()],
+         '-screenshot',
+         screenshot_image,
+         endpoint.uri_url(),
+         '--window-size=1920,3000',
+         ], deadline)
 
-    save_screenshot(endpoint, screenshot_image)  # administration
-    thumbnail(screenshot_image, screenshot_thumbnail)
-
-    # make copies of these images, so the latest are easily accessible.
-    subprocess.call(['cp', screenshot_thumbnail, latest_thumbnail])
+    return store_screenshot_file(endpoint, screenshot_image, output_dir)
 
 
 # s.make_screenshot_threaded(urllist)  # doesn't work well with cd.
@@ -137,7 +145,6 @@ def screenshot_with_firefox(endpoint, skip_if_latest=False):
 # working with processes also results into the same sorts of troubles.
 # maybe chrome shares some state for the cwd in their processes?
 # as long as we can't specify the filename for chrome headless, it's not going to work.
-@timeout(30, 'Took too long to make screenshot')
 def screenshot_with_chrome(endpoint, skip_if_latest=False):
     """
     Chrome headless, albeit single threaded, is pretty reliable and fast for existing urls.
@@ -151,22 +158,22 @@ def screenshot_with_chrome(endpoint, skip_if_latest=False):
     :param skip_if_latest:
     :return:
     """
+    deadline = Deadline(30, 'Took too long to make screenshot')
     if not check_installation('chrome'):
         return
 
     logger.debug("Chrome Screenshot: %s over IPv%s" % (endpoint.uri_url(), endpoint.ip_version))
 
     # using a temporary dir because all screenshots will be named screenshot.png, which might result in various issues.
+    output_dir = settings.TOOLS['chrome']['screenshot_output_dir']
     now = str(datetime.now(pytz.utc).strftime("_%Y%m%d_%H%M%S_%f"))
-    tmp_dir = settings.TOOLS['chrome']['screenshot_output_dir'] + now
+    tmp_dir = output_dir + now
 
     filename = str(re.sub(r'[^a-zA-Z0-9_]', '', str(endpoint.ip_version) + '_' + endpoint.uri_url() + now))
-    screenshot_image = settings.TOOLS['chrome']['screenshot_output_dir'] + filename + '.png'
-    screenshot_thumbnail = settings.TOOLS['chrome']['screenshot_output_dir'] + filename + '_small.png'
-    latest_thumbnail = settings.TOOLS['chrome']['screenshot_output_dir'] + filename + '_latest.png'
+    screenshot_image = output_dir + filename + '.png'
+    latest_thumbnail = screenshot_service.latest_path(output_dir, endpoint)
 
     logger.debug("screenshot image: %s" % screenshot_image)
-    logger.debug("screenshot thumbnail: %s" % screenshot_thumbnail)
     logger.debug("latest thumbnail: %s" % latest_thumbnail)
 
     # skip if there is already a latest image, just to speed things up.
@@ -174,31 +181,23 @@ def screenshot_with_chrome(endpoint, skip_if_latest=False):
         logger.debug("Skipped making screenshot, by request")
         return
 
-    # Save the screenshot administration _before_ it was made.
-    # The browser hangs when the site delivers downloads. Without administation this
-    # script wil try again and again.
-    save_screenshot(endpoint, screenshot_image)
-
     # since headless always creates the file "screenshot.png", just work in a
     # temporary dir:
     # chrome timeout doesn't work, it just blocks the process and hangs it.
-    # so use a
+    # so chrome (and everything it started) is killed at the deadline.
     subprocess.call(['mkdir', tmp_dir])
     subprocess.call(['cd', tmp_dir])
-    subprocess.call([settings.TOOLS['chrome']['executable'][platform.system()],
-                     '--disable-gpu',
-                     '--headless',
-                     '--screenshot',
-                     '--window-size=1920,3000',
-                     endpoint.uri_url()])
+    run([settings.TOOLS['chrome']['executable'][platform.system()],
+         '--disable-gpu',
+         '--headless',
+         '--screenshot',
+         '--window-size=1920,3000',
+         endpoint.uri_url()], deadline)
     subprocess.call(['mv', "screenshot.png", screenshot_image])
     subprocess.call(['cd', '..'])
     subprocess.call(['rmdir', tmp_dir])
 
-    thumbnail(screenshot_image, screenshot_thumbnail)
-
-    # make copies of these images, so the latest are easily accessible.
-    subprocess.call(['cp', screenshot_thumbnail, latest_thumbnail])
+    return store_screenshot_file(endpoint, screenshot_image, output_dir)
 
 
 def check_installation(browser):
@@ -221,20 +220,83 @@ def check_installation(browser):
     return True
 
 
-def save_screenshot(endpoint, safe_filename):
+def store_screenshot_file(endpoint, path: str, output_dir: str):
+    """Moves an image that was written by a browser to the content addressed storage, see screenshot_service."""
+    if not os.path.exists(path):
+        logger.debug("Browser did not make a screenshot of %s" % endpoint.uri_url())
+        return None
+
+    with open(path, 'rb') as f:
+        image = f.read()
+    os.unlink(path)
+
+    stored = screenshot_service.store_image(image, output_dir, screenshot_service.latest_path(output_dir, endpoint),
+                                            latest_perceptual_hashes([endpoint]).get(endpoint.id, ''))
+    return save_screenshot(endpoint, stored)
+
+
+def latest_perceptual_hashes(endpoints):
+    """The perceptual hash of the latest screenshot of every endpoint that has one: {endpoint id: hash}."""
+    latest = Screenshot.objects.all().filter(endpoint=OuterRef('pk')).order_by('-created_on')
+    hashes = (Endpoint.objects.all()
+              .filter(id__in=[endpoint.id for endpoint in endpoints])
+              .annotate(latest_hash=Subquery(latest.values('perceptual_hash')[:1]))
+              .values_list('id', 'latest_hash'))
+    return {pk: latest_hash for pk, latest_hash in hashes if latest_hash}
+
+
+def save_screenshot(endpoint, stored):
+    """
+    Stores that a screenshot was made. When the page looks the same as on the latest screenshot of the endpoint, only
+    the last_scan_moment of that screenshot is updated: store_image did not write the image then.
+
+    :param stored: the image, as returned by screenshot_service.store_image. None when no screenshot was made.
+    """
+    if not stored:
+        return None
+
+    now = datetime.now(pytz.utc)
+
+    latest = Screenshot.objects.all().filter(endpoint=endpoint).order_by('-created_on').first()
+    if latest and latest.perceptual_hash == stored['perceptual_hash']:
+        logger.debug("Page of %s did not change since %s." % (endpoint.uri_url(), latest.created_on))
+        latest.last_scan_moment = now
+        latest.save(update_fields=['last_scan_moment'])
+        return latest
+
     scr = Screenshot()
-    scr.created_on = datetime.now(pytz.utc)
+    scr.created_on = now
+    scr.last_scan_moment = now
     scr.domain = endpoint.uri_url()
     scr.endpoint = endpoint
-    scr.filename = safe_filename
+    scr.filename = stored['filename']
+    scr.content_hash = stored['content_hash']
+    scr.perceptual_hash = stored['perceptual_hash']
     scr.width_pixels = 1920
     scr.height_pixels = 3000
     scr.save()
+    return scr
 
 
-def thumbnail(image_path, output_path):
-    # resizing a bit? a 320px wide version.
-    im = Image.open(image_path)
-    size = 320, 500
-    im.thumbnail(size, Image.ANTIALIAS)
-    im.save(output_path, "PNG")
+def identical_pages(minimum_endpoints: int=2, days: int=31):
+    """
+    Pages that are shown by several endpoints, such as default pages of web servers, parked domains and wildcard
+    hosts. Only screenshots of the last days are used.
+
+    :return: list of {'perceptual_hash': ..., 'endpoints': amount of endpoints}, the most shown page first.
+    """
+    since = datetime.now(pytz.utc) - timedelta(days=days)
+    return list(Screenshot.objects.all()
+                .filter(last_scan_moment__gte=since)
+                .exclude(perceptual_hash='')
+                .values('perceptual_hash')
+                .annotate(endpoints=Count('endpoint', distinct=True))
+                .filter(endpoints__gte=minimum_endpoints)
+                .order_by('-endpoints', 'perceptual_hash'))
+
+
+def endpoints_showing(perceptual_hash: str, days: int=31):
+    """Endpoints of which a screenshot of the last days has this perceptual hash."""
+    since = datetime.now(pytz.utc) - timedelta(days=days)
+    return Endpoint.objects.all().filter(screenshot__perceptual_hash=perceptual_hash,
+                                         screenshot__last_scan_moment__gte=since).distinct()
@@ -3,22 +3,32 @@ Check if the https site uses HSTS to tell the browser the site should only be re
 (useful until browsers do https by default, instead of by choice)
 """
 import logging
-from datetime import datetime
+from typing import List, Tuple
+from urllib.parse import urlparse
 
-import pytz
 import requests
 import urllib3
-from celery import Task, group
+from celery import Task
 from requests import ConnectionError, ConnectTimeout, HTTPError, ReadTimeout, Timeout
+from requests.structures import CaseInsensitiveDict
 
 from failmap.celery import IP_VERSION_QUEUE, ParentFailed, app
+from failmap.celery.hydrate import hydrate_one
 from failmap.organizations.models import Organization, Url
+from failmap.scanners import ratelimit
 from failmap.scanners.endpoint_scan_manager import EndpointScanManager
-from failmap.scanners.models import Endpoint, EndpointGenericScanScratchpad
+from failmap.scanners.http_session import session
+from failmap.scanners.models import Endpoint
+from failmap.scanners.producer import produce_tasks
+from failmap.scanners.scratchpad import scratch
 
 log = logging.getLogger(__name__)
 
 
+# queues the tasks of this scanner end up in, see producer.
+PRODUCER_QUEUES = list(IP_VERSION_QUEUE.values()) + ['storage']
+
+
 def compose_task(
     organizations_filter: dict = dict(),
     urls_filter: dict = dict(),
@@ -29,14 +39,23 @@ def compose_task(
     *This is an implementation of `compose_task`. For more documentation about this concept, arguments and concrete
     examples of usage refer to `compose_task` in `types.py`.*
 
+    There is a task for every endpoint: the tasks are published in chunks by the producer, see producer.
     """
 
+    if not producer_targets(organizations_filter, urls_filter, endpoints_filter).exists():
+        raise Exception('Applied filters resulted in no tasks!')
+
+    return produce_tasks.si(__name__, organizations_filter, urls_filter, endpoints_filter)
+
+
+def producer_targets(organizations_filter: dict = dict(), urls_filter: dict = dict(),
+                     endpoints_filter: dict = dict()):
+    """Endpoints to scan, see producer."""
+
     # The dummy scanner is an example of a scanner that scans on an endpoint
     # level. Meaning to create tasks for scanning, this function needs to be
     # smart enough to translate (filtered) lists of organzations and urls into a
-    # (filtered) lists of endpoints (or use a url filter directly). This list of
-    # endpoints is then used to create a group of tasks which would perform the
-    # scan.
+    # (filtered) lists of endpoints (or use a url filter directly).
 
     # apply filter to organizations (or if no filter, all organizations)
     organizations = Organization.objects.filter(**organizations_filter)
@@ -44,49 +63,77 @@ def compose_task(
     urls = Url.objects.filter(organization__in=organizations, **urls_filter)
 
     # select endpoints to scan based on filters
-    endpoints = Endpoint.objects.filter(
+    return Endpoint.objects.filter(
         # apply filter to endpoints (or if no filter, all endpoints)
         url__in=urls, **endpoints_filter,
         # also apply manditory filters to only select valid endpoints for this action
-        is_dead=False, protocol__in=['http', 'https'])
+        is_dead=False, protocol__in=['http', 'https']).select_related('url')
 
-    if not endpoints:
-        raise Exception('Applied filters resulted in no tasks!')
 
-    log.info('Creating scan task for %s endpoints for %s urls for %s organizations.',
-             len(endpoints), len(urls), len(organizations))
+def producer_tasks(endpoints: List[Endpoint]) -> List[Task]:
+    """Tasks for a chunk of endpoints, see producer."""
+
+    # urls that run any unsecured http service, determined once per chunk instead of once per endpoint.
+    # See header_ratings.
+    unsecure_urls = set(Endpoint.objects.all().filter(
+        url__in=set(endpoint.url_id for endpoint in endpoints), protocol="http", is_dead=False
+    ).values_list('url_id', flat=True))
 
-    # create tasks for scanning all selected endpoints as a single managable group
-    task = group(
+    return [
         get_headers.signature(
             (endpoint.uri_url(),),
             options={'queue': IP_VERSION_QUEUE[endpoint.ip_version]}
-        ) | analyze_headers.s(endpoint) for endpoint in endpoints
-    )
-
-    return task
+        ) | analyze_headers.s(endpoint.pk, endpoint.url_id in unsecure_urls) for endpoint in endpoints
+    ]
 
 
 # database related tasks should by default be handled by a worker connected to the database
 @app.task(queue="storage")
-def analyze_headers(result: requests.Response, endpoint):
+def analyze_headers(result: requests.Response, endpoint, unsecure_services: bool=None):
+    """:param endpoint: id of the Endpoint, or the Endpoint itself when called directly."""
     # if scan task failed, ignore the result (exception) and report failed status
     if isinstance(result, Exception):
         return ParentFailed('skipping result parsing because scan failed.', cause=result)
 
+    endpoint = hydrate_one(Endpoint, endpoint, ['url'])
+    if not endpoint:
+        return {'status': 'skipped'}
+
     response = result
 
     # scratch it, for debugging.
-    egss = EndpointGenericScanScratchpad()
-    egss.when = datetime.now(pytz.utc)
-    egss.data = "Status: %s, Headers: %s, Redirects: %s" % (response.status_code, response.headers, response.history)
-    egss.type = "security headers"
-    egss.domain = endpoint.uri_url()
-    egss.save()
+    scratch("security headers", endpoint.uri_url(),
+            "Status: %s, Headers: %s, Redirects: %s" % (response.status_code, response.headers, response.history))
+
+    # runs any unsecured http service? (on ANY port). See header_ratings. Usually determined in compose_task.
+    if unsecure_services is None:
+        unsecure_services = endpoint.protocol == "https" and Endpoint.objects.all().filter(
+            url=endpoint.url, protocol="http", is_dead=False).exists()
 
-    generic_check(endpoint, response.headers, 'X-XSS-Protection')
-    generic_check(endpoint, response.headers, 'X-Frame-Options')
-    generic_check(endpoint, response.headers, 'X-Content-Type-Options')
+    ratings = header_ratings(endpoint.protocol, response.headers, unsecure_services)
+    EndpointScanManager.add_scans([(scan_type, endpoint, rating, message) for scan_type, rating, message in ratings])
+
+    return {'status': 'success'}
+
+
+def header_ratings(protocol: str, headers, offers_unsecure_services: bool) -> List[Tuple[str, str, str]]:
+    """
+    Rates the security headers of a response. This does not contact anything, so it can be used on headers from
+    any source, such as a stored observation.
+
+    :param protocol: protocol of the endpoint, http or https.
+    :param headers: headers of the response, a dictionary.
+    :param offers_unsecure_services: if the url of the endpoint has any http endpoints (on any port).
+    :return: list of scan type, rating and message.
+    """
+    # header names are case insensitive.
+    headers = CaseInsensitiveDict(headers)
+
+    ratings = [
+        generic_check(headers, 'X-XSS-Protection'),
+        generic_check(headers, 'X-Frame-Options'),
+        generic_check(headers, 'X-Content-Type-Options'),
+    ]
 
     """
     https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Strict-Transport-Security
@@ -112,44 +159,31 @@ def analyze_headers(result: requests.Response, endpoint):
 
     If you think it works differently, just file an issue or make a pull request. We want to get it right.
     """
-    if endpoint.protocol == "https":
+    if protocol == "https":
 
-        # runs any unsecured http service? (on ANY port).
-        unsecure_services = Endpoint.objects.all().filter(url=endpoint.url, protocol="http", is_dead=False).exists()
-        if unsecure_services:
-            generic_check(endpoint, response.headers, 'Strict-Transport-Security')
+        if offers_unsecure_services:
+            ratings.append(generic_check(headers, 'Strict-Transport-Security'))
         else:
-            if 'Strict-Transport-Security' in response.headers:
+            if 'Strict-Transport-Security' in headers:
                 log.debug('Has Strict-Transport-Security')
-                EndpointScanManager.add_scan('Strict-Transport-Security',
-                                             endpoint,
-                                             'True',
-                                             response.headers['Strict-Transport-Security'])
+                ratings.append(('Strict-Transport-Security', 'True', headers['Strict-Transport-Security']))
             else:
                 log.debug('Has no Strict-Transport-Security, yet offers no insecure http service.')
-                EndpointScanManager.add_scan('Strict-Transport-Security',
-                                             endpoint,
-                                             'False',
-                                             "Security Header not present: Strict-Transport-Security, "
-                                             "yet offers no insecure http service.")
+                ratings.append(('Strict-Transport-Security', 'False',
+                                "Security Header not present: Strict-Transport-Security, "
+                                "yet offers no insecure http service."))
 
-    return {'status': 'success'}
+    return ratings
 
 
-def generic_check(endpoint: Endpoint, headers, header):
+def generic_check(headers, header):
     # this is case insensitive
     if header in headers.keys():
         log.debug('Has %s' % header)
-        EndpointScanManager.add_scan(header,
-                                     endpoint,
-                                     'True',
-                                     headers[header])
+        return header, 'True', headers[header]
     else:
         log.debug('Has no %s' % header)
-        EndpointScanManager.add_scan(header,
-                                     endpoint,
-                                     'False',
-                                     "Security Header not present: %s" % header)
+        return header, 'False', "Security Header not present: %s" % header
 
 
 def error_response_400_500(endpoint):
@@ -192,10 +226,12 @@ def get_headers(self, uri_url):
         :return: requests.response
         """
 
+    ratelimit.throttle(self, *ratelimit.target(urlparse(uri_url).hostname))
+
     try:
         # ignore wrong certificates, those are handled in a different scan.
         # 10 seconds for network delay, 10 seconds for the site to respond.
-        response = requests.get(uri_url, timeout=(10, 10), allow_redirects=True, verify=False)
+        response = session().get(uri_url, timeout=(10, 10), allow_redirects=True, verify=False)
 
         # Removed: only continue for valid responses (eg: 200)
         # Error pages, such as 404 are super fancy, with forms and all kinds of content.
@@ -23,7 +23,6 @@ https://github.com/ssllabs/ssllabs-scan/blob/stable/ssllabs-api-docs.md
 
 """
 import ipaddress
-import json
 import logging
 from datetime import date, datetime, timedelta
 
@@ -33,10 +32,13 @@ from celery import Task, group
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
+from failmap.celery.hydrate import hydrate, hydrate_one, pk
 from failmap.organizations.models import Organization, Url
-from failmap.scanners.models import (Endpoint, EndpointGenericScan, TlsQualysScan,
-                                     TlsQualysScratchpad)
+from failmap.scanners import heartbeat, ratelimit, scheduler
+from failmap.scanners.http_session import session
+from failmap.scanners.models import Endpoint, EndpointGenericScan, TlsQualysScan
 from failmap.scanners.scanner_http import store_url_ips
+from failmap.scanners.scratchpad import scratch
 
 from ..celery import PRIO_HIGH, PRIO_NORMAL, app
 
@@ -65,16 +67,41 @@ def compose_task(
     # endpoints is then used to create a group of tasks which would perform the
     # scan.
 
+    if endpoints_filter:
+        raise NotImplementedError('This scanner needs to be refactored to scan per endpoint.')
+
+    organizations = Organization.objects.filter(**organizations_filter)
+    urls = urls_to_scan(organizations_filter, urls_filter)
+
+    if not urls:
+        # nothing is overdue, or the filters matched nothing.
+        log.info('No urls to scan.')
+        return group()
+
+    log.info('Creating scan task for %s urls for %s organizations.',
+             len(urls), len(organizations))
+
+    # create tasks for scanning all selected urls as a single managable group
+    task = group(qualys_scan.s(url.url) | process_qualys_result.s(url.pk) for url in urls)
+
+    return task
+
+
+def urls_to_scan(organizations_filter: dict = dict(), urls_filter: dict = dict()):
+    """
+    Urls with a https endpoint on port 443 that were not scanned recently. Without filters: the ones that are most
+    overdue for a scan, as many as the budget allows, see scheduler.
+    """
+
     # apply filter to organizations (or if no filter, all organizations)
     organizations = Organization.objects.filter(**organizations_filter)
 
     # Discover Endpoints will figure out if there is https and if port 443 is open.
     # apply filter to urls in organizations (or if no filter, all urls)
-    # do not scan the same url within 24 hours.
     # we assume all endpoints are scanned at the same time (this is what qualys does)
 
-    # scan only once in seven days. an emergency fix to make sure everything is scanned.
-    # todo: force re-scan, where days is < 7, with 5000 scanning takes a while and a lot still goes wrong.
+    # urls that were scanned recently (also before the scheduler existed) don't need another scan yet.
+    fresh_since = datetime.now(tz=pytz.utc) - timedelta(hours=settings.SCAN_SCHEDULE['tls_qualys']['freshness'])
     urls = Url.objects.filter(
         is_dead=False,
         not_resolvable=False,
@@ -82,79 +109,60 @@ def compose_task(
         endpoint__port=443,
         endpoint__is_dead=False,
         organization__in=organizations, **urls_filter,
-    ).exclude(endpoint__tlsqualysscan__last_scan_moment__gte=datetime.now(tz=pytz.utc) - timedelta(days=7)
-              ).order_by("?")  # used to be endpoint__tlsqualysscan__last_scan_moment
+    ).exclude(endpoint__tlsqualysscan__last_scan_moment__gte=fresh_since)
 
-    # ordered randomly: i didn't get a distinct set of urls due to the inner join on endpoint. Would like to do
-    # oldest first to make sure everything is scanned more recently. To remove the join.
-    urls = list(set(urls))
-
-    if endpoints_filter:
-        raise NotImplementedError('This scanner needs to be refactored to scan per endpoint.')
+    if organizations_filter or urls_filter:
+        # scan what is asked for, outside the plan of the periodic scan.
+        return list(urls.distinct())
 
-    if not urls:
-        raise Exception('Applied filters resulted in no tasks!')
-
-    log.info('Creating scan task for %s urls for %s organizations.',
-             len(urls), len(organizations))
-
-    # create tasks for scanning all selected urls as a single managable group
-    task = group(qualys_scan.s(url) | process_qualys_result.s(url) for url in urls)
-
-    return task
+    return scheduler.plan('tls_qualys', urls)
 
 
 @app.task(
-    # http://docs.celeryproject.org/en/latest/userguide/tasks.html#Task.rate_limit
-    # start at most 1 qualys task per minute to not get our IP blocked
+    # Start at most 1 new qualys scan per two minutes, for all workers together, to not get our IP blocked. See the
+    # 'qualys' rate limit in settings and ratelimit.
 
     # After starting a scan you can read it out as much as you want. The problem lies with rate limiting
     # of starting the task.
 
-    # Celery will at most start 1 new qualys_scan per minute, the 'retry' at
-    # the end of this task will turn it from a rate_limited into a scheduled
-    # tasks which makes this work nicely with Qualys API restrictions.
-
-    # after starting a scan (1/m) you can read out every 20 seconds.
+    # after starting a scan you can read out every 20 seconds.
     # You can do so in the 10 minutes. If you don't, it will start a new scan which affects your rate limit.
 
     bind=True,
     # this task should run on an internet connected, distributed worker
     # also because of rate limiting put in its own queue to prevent blocking other tasks
     queue='scanners.qualys',
-    # start at most 1 new task per minute (per worker)
-
-    # 7 march 2018, qualys has new rate limits due to service outage.
-    # We used to do 1/m which was fine, but we're now doing 1 every 2 minutes.
-    rate_limit='0.5/m',
 )
-def qualys_scan(self, url):
+def qualys_scan(self, domain: str):
     """Acquire JSON scan result data for given URL from Qualys.
 
     A scan usually takes about two minutes. It _can_ take much longer depending on the amount
     of ip's qualys is able to find. Having eight different IP's is not special for some cloud
     hosters.
 
-    :param url: object representing an url
+    :param domain: the url to scan, for example faalkaart.nl
     :return:
     """
 
+    # Only starting a scan counts towards the rate limit. Reading out a running scan is done via the scanners queue.
+    if (self.request.delivery_info or {}).get('routing_key') != 'scanners':
+        ratelimit.throttle(self, ('qualys', 'assessments'))
+
     # Query Qualys API for information about this URL.
     try:
-        data = service_provider_scan_via_api(url.url)
+        data = service_provider_scan_via_api(domain)
     except requests.RequestException as e:
         # ex: ('Connection aborted.', ConnectionResetError(54, 'Connection reset by peer'))
         # ex: EOF occurred in violation of protocol (_ssl.c:749)
-        log.exception("(Network or Server) Error when contacting Qualys for scan on %s", url.url)
+        log.exception("(Network or Server) Error when contacting Qualys for scan on %s", domain)
         # Initial scan (with rate limiting) has not been received yet, so add to the qualys queue again.
         raise self.retry(countdown=60, priorty=PRIO_NORMAL, max_retries=30, queue='scanners.qualys')
 
-    # Create task for storage worker to store debug data in database (this
-    # task has no direct DB access due to scanners queue).
-    scratch.apply_async([url, data])
+    # Store debug data in the background.
+    scratch('qualys', domain, data)
 
     if settings.DEBUG:
-        report_to_console(url.url, data)  # for more debugging
+        report_to_console(domain, data)  # for more debugging
 
     # Qualys is running a scan...
     if 'status' in data:
@@ -179,7 +187,7 @@ def qualys_scan(self, url):
                      "%s" % data['errors'][0]['message'])
             raise self.retry(countdown=120, priorty=PRIO_NORMAL, max_retries=30, queue='scanners.qualys')
         else:
-            log.exception("Unexpected error from API on %s: %s", url.url, str(data))
+            log.exception("Unexpected error from API on %s: %s", domain, str(data))
             # We don't have to keep on failing... lowering the amount of retries.
             raise self.retry(countdown=60, priorty=PRIO_NORMAL, max_retries=5, queue='scanners.qualys')
 
@@ -190,10 +198,8 @@ def qualys_scan(self, url):
     """
     log.info('Still waiting for Qualys result. Retrying task in 20 seconds.')
     # 10 minutes of retries... (20s seconds * 30 = 10 minutes)
-    # The 'retry' converts this task instance from a rate_limited into a
-    # scheduled task, so retrying tasks won't interfere with new tasks to be
-    # started
-    # We use a different queue here as only initial requests count toward the rate limit set by Qualys.
+    # We use a different queue here as only initial requests count toward the rate limit set by Qualys, retries on
+    # this queue don't take a token of the rate limit.
     # Do note: this really needs to be picked up within the first five minutes of starting the scan. If you don't
     # a new scan is started on this url and you'll run into rate limiting problems.
     raise self.retry(countdown=30, priorty=PRIO_HIGH, max_retries=30, queue='scanners')
@@ -201,7 +207,14 @@ def qualys_scan(self, url):
 
 @app.task(queue='storage')
 def process_qualys_result(data, url):
-    """Receive the JSON response from Qualys API, processes this result and stores it in database."""
+    """
+    Receive the JSON response from Qualys API, processes this result and stores it in database.
+
+    :param url: id of the Url, or the Url itself when called directly.
+    """
+    url = hydrate_one(Url, url)
+    if not url:
+        return
 
     # a normal completed scan.
     if data['status'] == "READY" and 'endpoints' in data.keys():
@@ -213,7 +226,7 @@ def process_qualys_result(data, url):
     elif data['status'] == "READY":
         # no endpoints whut?
         log.error("Found no endpoints in ready scan. Todo: How to handle this?")
-        scratch(url, data)
+        scratch('qualys', url, data)
 
     # Not resolving
     if data['status'] == "ERROR":
@@ -221,11 +234,33 @@ def process_qualys_result(data, url):
         Error is usually "unable to resolve domain". This should kill the endpoint(s).
         todo: actually check on this.
         """
-        scratch(url, data)  # we always want to see what happened.
+        scratch('qualys', url, data)  # we always want to see what happened.
         clean_endpoints(url, [])
         return '%s error' % url
 
 
+@app.task(queue='storage')
+def process_qualys_results(results):
+    """
+    Processes a batch of finished assessments: a list of (data, url id). Used by the assessment manager. The urls of
+    the batch are fetched in one query.
+    """
+    urls = {url.pk: url for url in hydrate(Url, set(pk(url) for data, url in results))}
+
+    processed = []
+    for data, url in results:
+        url = urls.get(pk(url))
+        if not url:
+            continue
+
+        try:
+            processed.append(process_qualys_result(data, url))
+        except Exception as e:
+            # one broken result should not prevent storing the rest of the batch.
+            log.exception("Could not process qualys result of %s: %s", url, e)
+    return processed
+
+
 def report_to_console(domain, data):
     """
     Gives some impression of what is currently going on in the scan.
@@ -272,6 +307,20 @@ def report_to_console(domain, data):
 
 
 def service_provider_scan_via_api(domain):
+    response = assessment_request(domain)
+
+    # log.debug(vars(response))  # extreme debugging
+    log.debug("Running assessments: max: %s, current: %s, client: %s",
+              response.headers.get('X-Max-Assessments'),
+              response.headers.get('X-Current-Assessments'),
+              response.headers.get('X-ClientMaxAssessments')
+              )
+
+    return response.json()
+
+
+def assessment_request(domain):
+    """Starts or reads out an assessment. Returns the response, as its headers tell how busy the API is."""
     # API Docs: https://github.com/ssllabs/ssllabs-scan/blob/stable/ssllabs-api-docs.md
     payload = {
         'host': domain,  # host that will be scanned for tls
@@ -282,23 +331,14 @@ def service_provider_scan_via_api(domain):
         'all': "done"  # ?
     }
 
-    response = requests.get(
-        "https://api.ssllabs.com/api/v2/analyze",
+    return session().get(
+        settings.QUALYS_API_URL + "analyze",
         params=payload,
         timeout=(API_NETWORK_TIMEOUT, API_SERVER_TIMEOUT),  # 30 seconds network, 30 seconds server.
         headers={'User-Agent': "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_2) AppleWebKit/601.3.9 "
                                "(KHTML, like Gecko) Version/9.0.2 Safari/601.3.9", }
     )
 
-    # log.debug(vars(response))  # extreme debugging
-    log.debug("Running assessments: max: %s, current: %s, client: %s",
-              response.headers['X-Max-Assessments'],
-              response.headers['X-Current-Assessments'],
-              response.headers['X-ClientMaxAssessments']
-              )
-
-    return response.json()
-
 
 def extract_ips(url, data):
     """
@@ -386,11 +426,14 @@ def save_scan(url, data):
                 if all([previous_scan.qualys_rating == rating,
                         previous_scan.qualys_rating_no_trust == rating_no_trust]):
                     log.info("Scan on %s did not alter the rating, updating scan date only." % failmap_endpoint)
-                    previous_scan.last_scan_moment = datetime.now(pytz.utc)
-                    previous_scan.scan_time = datetime.now(pytz.utc)
-                    previous_scan.scan_date = datetime.now(pytz.utc)
-                    previous_scan.qualys_message = message
-                    previous_scan.save()
+                    if previous_scan.qualys_message == message:
+                        heartbeat.beat(previous_scan)
+                    else:
+                        previous_scan.last_scan_moment = datetime.now(pytz.utc)
+                        previous_scan.scan_time = datetime.now(pytz.utc)
+                        previous_scan.scan_date = datetime.now(pytz.utc)
+                        previous_scan.qualys_message = message
+                        previous_scan.save()
                     results.append('no-change')
 
                 else:
@@ -525,15 +568,6 @@ def kill_alive_and_get_endpoint(protocol, url, port, ip_version, message):
         return failmap_endpoint
 
 
-@app.task(queue='storage')
-def scratch(domain, data):
-    log.debug("Scratching data for %s", domain)
-    scratchpad = TlsQualysScratchpad()
-    scratchpad.domain = domain
-    scratchpad.data = json.dumps(data)
-    scratchpad.save()
-
-
 # "smart" rate limiting
 def endpoints_alive_in_past_24_hours(url):
     x = TlsQualysScan.objects.filter(endpoint__url=url,
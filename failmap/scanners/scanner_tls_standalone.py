@@ -1,14 +1,9 @@
 import logging
-import platform
-import re
-import subprocess
-from datetime import datetime
 
-import pytz
-import untangle
 from django.conf import settings
 
 from failmap.celery import app
+from failmap.scanners import tls_runner
 from failmap.scanners.models import Endpoint
 from failmap.scanners.timeout import timeout
 
@@ -114,7 +109,6 @@ What we should have used: https://www.owasp.org/index.php/O-Saft ... nah
 """
 
 
-sslscan = settings.TOOLS['sslscan']['executable'][platform.system()]
 output = settings.TOOLS['sslscan']['report_output_dir']
 
 anonymous_ciphers = ['ADH-AES256-SHA', 'ADH-AES128-SHA', 'ADH-RC4-MD5', 'ADH-DES-CBC3-SHA',
@@ -129,9 +123,12 @@ insecure_ciphers = ['0x4', '0x5', '0xc011', '0x9', '0x15', '0x64', '0x10080', '0
 # todo: options, host zetten. Anders SSLScan, dat valt op.
 
 def scan_url(url):
-    endpoints = Endpoint.objects.all().filter(url=url, protocol='https')
-    for endpoint in endpoints:
-        report = scan_endpoint(endpoint)
+    endpoints = list(Endpoint.objects.all().filter(url=url, protocol='https'))
+    # all endpoints are scanned at the same time, see tls_runner.
+    reports = tls_runner.scan([(endpoint.url.url, endpoint.port) for endpoint in endpoints])
+    for endpoint, report in zip(endpoints, reports):
+        if not report:
+            continue
         rating, trust_rating = determine_grade(report, endpoint.url.url)
         store_grade(rating, trust_rating, endpoint)
 
@@ -142,47 +139,12 @@ def scan_real_url(url, port=443):
     services.
     :param url: string, internet address, not an url object(!)
     :param port: integer, port number.
-    :return:
+    :return: summary of the sslscan report including CVE checks, see tls_runner.ReportParser. None on failure.
     """
-    url_and_port = "%s:%s" % (url, port)
-    now = str(datetime.now(pytz.utc).strftime("_%Y%m%d_%H%M%S_%f"))
-    filename = str(re.sub(r'[^a-zA-Z0-9_]', '', url_and_port + now)) + '.xml'
-    out = output + filename
-    subprocess.call([sslscan, '--show-certificate', '--xml=' + out, url_and_port])
-
-    # add some things to the XML file about external tools.
-    # hacky hacky code :)
-    file = open(out, 'r')
-    lines = file.readlines()
-    lines = lines[:-2]
-    try:
-        vulnerable = test_cve_2016_2107(url, port)
-        string = "  <CVE-2016-2107>" + str(bool(vulnerable)) + "</CVE-2016-2107>"
-        lines.append(string)
-    except TimeoutError:
-        pass
-
-    try:
-        vulnerable = test_cve_2016_9244(url, port)
-        string = "  <CVE-2016-9244>" + str(bool(vulnerable)) + "</CVE-2016-9244>"
-        lines.append(string)
-    except TimeoutError:
-        pass
-
-    lines.append(" </ssltest>")
-    lines.append("</document>")
-
-    file.close()
-
-    # overwrite it with the new "xml".
-    with open(out, 'w') as f:
-        f.write(''.join(lines))
-
-    return out
-
-# TODO: make queue explicit, split functionality in storage and scanner
+    return tls_runner.scan([(url, port)])[0]
 
 
+# TODO: make queue explicit, split functionality in storage and scanner
 @app.task
 def scan_endpoint(endpoint, IPv6=False):
     return scan_real_url(endpoint.url.url, endpoint.port)
@@ -239,7 +201,7 @@ def determine_grade(report, url):
 
     Please add your improvements into this function. Amazing that such an explanation is not in
     sslscan (if we could write C, we would).
-    :param report:
+    :param report: summary of a sslscan report (see tls_runner.ReportParser), or the path to a sslscan XML file.
     :return:
     """
     ratings = []
@@ -253,29 +215,31 @@ def determine_grade(report, url):
         logger.error('No report given: %s' % report)
         return
 
-    try:
-        logger.debug('untangle.parse("%s")' % report)
-        obj = untangle.parse(report)
-    except Exception:
-        logger.error('Something wrong with report file: %s' % report)
+    # a report on disk, such as the testcases.
+    if isinstance(report, str):
+        try:
+            report = tls_runner.parse_report(report)
+        except Exception:
+            logger.error('Something wrong with report file: %s' % report)
+            return
+
+    if not report['certificates']:
+        logger.error('No certificate in report of %s' % url)
         return
 
     # Used the --show-certificate option
     # you want to have the last one.
     # are chains missing if there is less than 2?
-    if obj.document.ssltest.certificate[1]:
-        certificate = obj.document.ssltest.certificate[len(obj.document.ssltest.certificate) - 1]
-    else:
-        # ratings.append(['B', "Chain of trust missing."]) -> you never see the full list.
-        certificate = obj.document.ssltest.certificate
+    # ratings.append(['B', "Chain of trust missing."]) -> you never see the full list.
+    certificate = report['certificates'][-1]
 
-    if hasattr(certificate, "self_signed") and certificate.self_signed.cdata == 'true':
+    if certificate.get('self-signed') == 'true':
         trust_rating.append(['False', "Certificate is self signed."])
 
-    if certificate.expired.cdata == 'true':
+    if certificate.get('expired') == 'true':
         trust_rating.append(['False', "Certificate expired."])
 
-    if 'sha1' in certificate.signature_algorithm.cdata:
+    if 'sha1' in certificate.get('signature-algorithm', ''):
         trust_rating.append(['False', "SHA1 signature Algorithm is obsolete."])
 
     # check if there is a mismatch, including all wildcard options
@@ -287,37 +251,37 @@ def determine_grade(report, url):
         myurl = t
         testurls.append('*.' + t)
 
-    altnames = certificate.altnames.cdata if hasattr(certificate, "altnames") else ""
+    altnames = certificate.get('altnames', "")
     name_or_wildcard_found = False
 
     for testurl in testurls:
         # can be a wildcard certificate with one of the valid urls in altnames.
-        if url == certificate.subject.cdata or ':' + testurl in altnames:
+        if url == certificate.get('subject') or ':' + testurl in altnames:
             name_or_wildcard_found = True
 
     if not name_or_wildcard_found:
         trust_rating.append(['False', "Certificate name mismatch."])
 
     # Heartbleed
-    for heartbleed in obj.document.ssltest.heartbleed:
-        if heartbleed['vulnerable'] == '1':
+    for heartbleed in report['heartbleed']:
+        if heartbleed.get('vulnerable') == '1':
             ratings.append(['F', "Vulnerable to heartbleed on %s." % heartbleed['sslversion']])
 
     # Insecure renegotiation
-    if obj.document.ssltest.renegotiation['supported'] == '1' and \
-            obj.document.ssltest.renegotiation['secure'] == '0':
+    if report['renegotiation'].get('supported') == '1' and \
+            report['renegotiation'].get('secure') == '0':
         ratings.append(['F', "Server does not support secure session renegotiation, "
                              "a Man In The Middle attack is possible."])
 
     # check for sslv2.
-    for cipher in obj.document.ssltest.cipher:
-        if cipher['sslversion'] == 'SSLv2':
+    for cipher in report['ciphers']:
+        if cipher.get('sslversion') == 'SSLv2':
             ratings.append(['F', "Insecure/Obsolete protocol supported (SSLv2)."])
             break
 
     # check for sslv3, poodle (this doesn't work that way)
-    for cipher in obj.document.ssltest.cipher:
-        if cipher['sslversion'] == 'SSLv3':
+    for cipher in report['ciphers']:
+        if cipher.get('sslversion') == 'SSLv3':
             ratings.append(['B', "Insecure/Obsolete protocol supported (SSLv3)."])
             break
 
@@ -326,8 +290,8 @@ def determine_grade(report, url):
     # Check for Missing TLSv1.2
     # todo: rewrite to more readable code without flag
     supports_tlsv12 = False
-    for cipher in reversed(obj.document.ssltest.cipher):
-        if cipher['sslversion'] == 'TLSv1.2':
+    for cipher in reversed(report['ciphers']):
+        if cipher.get('sslversion') == 'TLSv1.2':
             supports_tlsv12 = True
             break
 
@@ -337,52 +301,52 @@ def determine_grade(report, url):
     # Check for CRIME / TLS compression (BREACH?)
     # https://en.wikipedia.org/wiki/CRIME
     # todo: rating still unclear for compression enabled
-    if obj.document.ssltest.compression['supported'] == '1':
+    if report['compression'].get('supported') == '1':
         ratings.append(['C', "Vulnerable to CRIME attack, due to compression used."])
 
     # cipher checks
-    ciphers = obj.document.ssltest.cipher
+    ciphers = report['ciphers']
 
     # logjam (weak DH parameters), https://weakdh.org/ Everythiung under 1024 -preferably under 2048
     for cipher in ciphers:
-        if cipher['dhebits'] and int(cipher['dhebits']) < 1024:
+        if cipher.get('dhebits') and int(cipher.get('dhebits')) < 1024:
             ratings.append(['F', "Insecure Diffie-Hellman parameters used."])
             break
 
     # Weak diffie helman, now seen as 1024, might be > 768 < 2048?
     for cipher in ciphers:
-        if cipher['dhebits'] and int(cipher['dhebits']) == 1024:
+        if cipher.get('dhebits') and int(cipher.get('dhebits')) == 1024:
             ratings.append(['B', "Weak Diffie-Hellman parameters used."])
             break
 
     # RC4 for newer protocols (1.1, 1.2)
     for cipher in ciphers:
-        if "RC4" in cipher['cipher'] and cipher['sslversion'] in ['TLSv1.2', 'TLSv1.1']:
+        if "RC4" in cipher.get('cipher', '') and cipher.get('sslversion') in ['TLSv1.2', 'TLSv1.1']:
             ratings.append(['C', "RC4 cipher accepted in modern protocols."])
             break
 
     # RC4 for older protocls (2, 3, 1.0)
     for cipher in ciphers:
-        if "RC4" in cipher['cipher'] and cipher['sslversion'] in ['TLSv1.0', 'SSLv3', 'SSLv2']:
+        if "RC4" in cipher.get('cipher', '') and cipher.get('sslversion') in ['TLSv1.0', 'SSLv3', 'SSLv2']:
             ratings.append(['B', "RC4 cipher accepted in older protocols."])
             break
 
     # https://github.com/rbsec/sslscan/blob/master/sslscan.c
     # Null ciphers (insecure)
     for cipher in ciphers:
-        if "NULL" == cipher['cipher']:
+        if "NULL" == cipher.get('cipher', ''):
             ratings.append(['F', "NULL Cipher supported."])
             break
 
     # AnonymousDH or AnonymousECDH
     for cipher in ciphers:
-        if "ADH" in cipher['cipher'] or "AECDH" in cipher['cipher']:
+        if "ADH" in cipher.get('cipher', '') or "AECDH" in cipher.get('cipher', ''):
             ratings.append(['F', "Anonymous (insecure) suites used."])
             break
 
     # insecure ciphers (low bits)
     for cipher in ciphers:
-        if cipher['bits'] and int(cipher['bits']) < 56:
+        if cipher.get('bits') and int(cipher.get('bits')) < 56:
             ratings.append(['F', "Insecure ciphers used (low number of bits)."])
             break
 
@@ -390,29 +354,29 @@ def determine_grade(report, url):
     # Multiple times the EXPORT ciphers are not visible in SSL3, and TLS. Only in SSLv2 and only
     # a few versus a complete set.
     for cipher in ciphers:
-        if "EXP" in cipher['cipher'] or "EXPORT" in cipher['cipher']:
+        if "EXP" in cipher.get('cipher', '') or "EXPORT" in cipher.get('cipher', ''):
             ratings.append(['F', "RSA Export ciphers present, might be vulnerable to FREAK."])
             break
 
     # weak ciphers (low bits)
     # Even with weak ciphers, there is some security...(?)
-    # for cipher in obj.document.ssltest.cipher:
-    #     if cipher['bits'] and 56 <= int(cipher['bits']) <= 112:
+    # for cipher in ciphers:
+    #     if cipher.get('bits') and 56 <= int(cipher.get('bits')) <= 112:
     #         ratings.append(['C', "Weak ciphers used."])
     #         break
 
     # other insecure ciphers.
     for cipher in ciphers:
-        if cipher['id'] in insecure_ciphers:
+        if cipher.get('id') in insecure_ciphers:
             ratings.append(['F', "Insecure ciphers used (known weak id)."])
             break
 
     # check for old 64 bit stuff:
     low_bit_things = ['3DES', 'RC4', 'IDEA', 'RC2']
     for cipher in ciphers:
-        if cipher['sslversion'] in ['TLSv1.2', 'TLSv1.1', 'TLSv1.0']:
+        if cipher.get('sslversion') in ['TLSv1.2', 'TLSv1.1', 'TLSv1.0']:
             for low_bit_thing in low_bit_things:
-                if low_bit_thing in cipher['cipher']:
+                if low_bit_thing in cipher.get('cipher', ''):
                     ratings.append(
                         ['C', 'Using old 64-bit block cipher(s) (3DES / DES / RC2 / IDEA) '
                               'with modern protocols.'])
@@ -420,15 +384,13 @@ def determine_grade(report, url):
 
     # Check for padding oracle vulnerability
     # <CVE-2016-2107>False</CVE-2016-2107>
-    if hasattr(obj.document.ssltest, "CVE_2016_2107"):
-        if obj.document.ssltest.CVE_2016_2107.cdata == 'True':
-            ratings.append(['F', 'Vulnerable to CVE_2016-2107 (padding oracle).'])
+    if report['cve'].get('CVE_2016_2107') == 'True':
+        ratings.append(['F', 'Vulnerable to CVE_2016-2107 (padding oracle).'])
 
     # Check for ticketbleed vulnerability
     # <CVE-2016_9244>False</CVE-2016_9244>
-    if hasattr(obj.document.ssltest, "CVE_2016_9244"):
-        if obj.document.ssltest.CVE_2016_9244.cdata == 'True':
-            ratings.append(['F', 'Vulnerable to CVE_2016_9244 (ticketbleed).'])
+    if report['cve'].get('CVE_2016_9244') == 'True':
+        ratings.append(['F', 'Vulnerable to CVE_2016_9244 (ticketbleed).'])
 
     # Check for POODLE (CVE-2014-3566)
     # SSLv3 + CBC ciphersuites
@@ -436,14 +398,14 @@ def determine_grade(report, url):
     # this is incorrect? Or has this to do with the discovered software / server?
     # windows is not vulnerable?
     for cipher in ciphers:
-        if cipher['sslversion'] in ['SSLv3'] and "CBC" in cipher['cipher']:
+        if cipher.get('sslversion') in ['SSLv3'] and "CBC" in cipher.get('cipher', ''):
             ratings.append(
                 ['C', 'Vulnerable to CVE_2014_3566 (POOODLE) on SSLv3. Remove CBC ciphers.'])
             break
 
     # Poodle on TLS v1 (this is incorrect...) todo: other scan. Can have CBC, but specific thing?
     for cipher in ciphers:
-        if cipher['sslversion'] in ['TLSv1.0'] and "CBC" in cipher['cipher']:
+        if cipher.get('sslversion') in ['TLSv1.0'] and "CBC" in cipher.get('cipher', ''):
             ratings.append(
                 ['F', 'Vulnerable to CVE_2014_3566 (POOODLE) on TLS. Remove CBC ciphers.'])
             break
@@ -504,44 +466,6 @@ def store_grade(ratings, trust_ratings, endpoint):
     # EndpointScanManager.add_scan('ssl_tls', endpoint, grade, explanation)
 
 
-@timeout(3)
-def test_cve_2016_2107(url, port):
-    # The script will timeout sometimes.
-    # run GO package. go run main.go tweakers.net
-    # get the first line output.
-
-    # writes to stderror by default.
-    process = subprocess.Popen(['go',
-                                'run',
-                                settings.TOOLS['TLS']['cve_2016_2107'],
-                                "%s:%s" % (url, port)],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # get last word of first line. Can be true or false. Should only get one line.
-    out, err = process.communicate()
-    print(out)
-    print(err)
-    if "Vulnerable: true" in str(err) or "Vulnerable: true" in str(out):
-        return True
-    return False
-
-
-@timeout(3)
-def test_cve_2016_9244(url, port):
-    # The script will timeout sometimes.
-    # run GO package. go run main.go tweakers.net
-    # get the first line output.
-    process = subprocess.Popen(['go',
-                                'run',
-                                settings.TOOLS['TLS']['cve_2016_9244'],
-                                "%s:%s" % (url, port)],
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = process.communicate()
-    # print(out)
-    if "is vulnerable to Ticketbleed" in str(err) or "is vulnerable to Ticketbleed" in str(out):
-        return True
-    return False
-
-
 @timeout(10)
 def cert_chain_is_complete(url, port):
     """
@@ -0,0 +1,97 @@
+"""
+Plans scans by staleness: the targets that were scanned longest ago go first.
+
+Scanners used to pick their targets ad hoc: everything, shuffled, or everything that was not scanned in a week,
+sorted at random (order_by("?") sorts the whole table, which is expensive on MySQL). Nothing made sure that the
+stalest targets were scanned first, so some were scanned often and others hardly ever.
+
+Every scanner in SCAN_SCHEDULE has a freshness: a target that was not scanned for that many hours is overdue. And a
+budget: the amount of targets that can be scanned per hour. The scheduler keeps an index of the moment every target
+was last handed to a scanner (ScanSchedule) and hands out the most overdue targets first: never scanned, then
+oldest. A plan holds the budget of the hours since the previous plan, so running it every hour gives an even
+stream of work. Targets that were never planned are all overdue: the first plans go through everything once.
+
+Only the periodic, unfiltered runs of a scanner are planned. A run for a few organizations or urls (admin actions,
+scan commands with -o) scans what it is asked for, and leaves the plan and budget of the periodic run alone.
+
+Usage:
+    urls = plan('tls_qualys', Url.objects.filter(is_dead=False))
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import List
+
+import pytz
+from django.conf import settings
+from django.db.models import DateTimeField, F, OuterRef, Q, QuerySet, Subquery
+
+from failmap.scanners.models import ScanSchedule, State
+from failmap.scanners.state_manager import StateManager
+
+log = logging.getLogger(__package__)
+
+
+def plan(scanner: str, targets: QuerySet, now: datetime=None) -> List:
+    """
+    The most overdue targets, as many as the budget allows. They are registered as scanned at this moment.
+
+    :param scanner: a scanner in SCAN_SCHEDULE.
+    :param targets: queryset of urls or endpoints this scanner can scan.
+    :param now: moment of planning, defaults to now.
+    :return: list of targets, most overdue first.
+    """
+    now = now or datetime.now(pytz.utc)
+
+    selection = list(overdue(scanner, targets, now)[:budget(scanner, now)])
+    register(scanner, selection, now)
+    StateManager.set_state(state_key(scanner), "planned %s" % len(selection), since=now)
+
+    log.info("Planned %s %s scans, most overdue since %s." % (
+        len(selection), scanner, selection[0].scheduled_scan_moment if selection else None))
+    return selection
+
+
+def overdue(scanner: str, targets: QuerySet, now: datetime=None) -> QuerySet:
+    """Targets that were not scanned within the freshness of the scanner, never scanned first, then oldest."""
+    now = now or datetime.now(pytz.utc)
+    fresh_since = now - timedelta(hours=settings.SCAN_SCHEDULE[scanner]['freshness'])
+
+    last_scan = ScanSchedule.objects.filter(scanner=scanner, target_id=OuterRef('pk')).values('last_scan_moment')
+
+    # distinct: filters over related tables (such as endpoints of urls) return the same target more than once.
+    return targets.annotate(
+        scheduled_scan_moment=Subquery(last_scan[:1], output_field=DateTimeField())
+    ).filter(
+        Q(scheduled_scan_moment__isnull=True) | Q(scheduled_scan_moment__lt=fresh_since)
+    ).order_by(F('scheduled_scan_moment').asc(nulls_first=True), 'pk').distinct()
+
+
+def budget(scanner: str, now: datetime=None) -> int:
+    """
+    Amount of targets for the hours since the previous plan: at least one hour, at most the freshness of the scanner.
+    """
+    now = now or datetime.now(pytz.utc)
+    schedule = settings.SCAN_SCHEDULE[scanner]
+
+    previous = State.objects.all().filter(scanner=state_key(scanner)).values_list('since', flat=True).first()
+    hours = (now - previous).total_seconds() / 3600 if previous else schedule['freshness']
+
+    return int(schedule['budget'] * min(max(hours, 1), schedule['freshness']))
+
+
+def register(scanner: str, targets: List, moment: datetime):
+    """Registers targets as scanned at this moment: one update for known targets, one insert for new ones."""
+    ids = [target.pk for target in targets]
+    if not ids:
+        return
+
+    known = set(ScanSchedule.objects.all().filter(
+        scanner=scanner, target_id__in=ids).values_list('target_id', flat=True))
+
+    ScanSchedule.objects.all().filter(scanner=scanner, target_id__in=known).update(last_scan_moment=moment)
+    ScanSchedule.objects.bulk_create(
+        [ScanSchedule(scanner=scanner, target_id=pk, last_scan_moment=moment) for pk in ids if pk not in known])
+
+
+def state_key(scanner: str) -> str:
+    return "scheduler %s" % scanner
@@ -0,0 +1,178 @@
+"""
+Storage of debugging data of scanners (scratches).
+
+Scanners keep the raw data they received, such as all headers of a response or the complete answer of Qualys, so
+it's possible to see what happened afterwards. This data is written a lot and read almost never.
+
+There are two places to store scratches:
+- file (default): compressed, append only files, a directory per day. Files are rotated when they become too large
+  and days older than SCRATCH_MAX_AGE_DAYS are removed. Every day has an index with the location of the scratches
+  per domain, so reading the scratches of a domain does not require reading everything.
+- database: the EndpointGenericScanScratchpad and TlsQualysScratchpad tables. These grow without bound.
+
+Writing is done by a low priority task on its own queue, so it never delays storing scan results.
+
+Usage:
+    scratch('security headers', 'https://faalkaart.nl:443', "Status: 200, Headers: ...")
+    for record in read('faalkaart.nl'):
+        print(record['when'], record['data'])
+"""
+import fcntl
+import gzip
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+
+from failmap.celery import PRIO_LOW, app
+
+log = logging.getLogger(__package__)
+
+INDEX_FILE = 'index.tsv'
+LOCK_FILE = '.lock'
+
+
+def scratch(kind: str, domain: str, data):
+    """
+    Stores debugging data, in the background.
+
+    :param kind: the type of data, for example "qualys" or "security headers".
+    :param domain: what the data is about, an url or uri.
+    :param data: anything that can be serialized to JSON.
+    """
+    arguments = [kind, str(domain), data, datetime.now(pytz.utc)]
+    try:
+        store_scratch.apply_async(arguments, priority=PRIO_LOW)
+    except Exception as ex:
+        # debugging data is never a reason to fail a scan. Write it directly instead.
+        log.debug("Could not queue scratch, writing it directly: %s" % ex)
+        store_scratch(*arguments)
+
+
+@app.task(queue='scratch')
+def store_scratch(kind: str, domain: str, data, when: datetime):
+    get_sink().write(kind, domain, data, when)
+
+
+def read(domain: str, days: int=None):
+    """Returns all scratches of a domain (or uri containing that domain), oldest first."""
+    return get_sink().read(domain, days)
+
+
+def get_sink():
+    if settings.SCRATCH_BACKEND == 'database':
+        return DatabaseSink()
+    return FileSink(settings.SCRATCH_DIR, settings.SCRATCH_MAX_FILE_SIZE, settings.SCRATCH_MAX_AGE_DAYS)
+
+
+class DatabaseSink:
+    """The original scratchpad tables."""
+
+    def write(self, kind: str, domain: str, data, when: datetime):
+        # import here, so the file sink can be used without database.
+        from failmap.scanners.models import EndpointGenericScanScratchpad, TlsQualysScratchpad
+
+        if kind == 'qualys':
+            scratchpad = TlsQualysScratchpad(domain=domain, data=json.dumps(data))
+        else:
+            scratchpad = EndpointGenericScanScratchpad(type=kind, domain=domain, when=when,
+                                                       data=data if isinstance(data, str) else json.dumps(data))
+        scratchpad.save()
+
+    def read(self, domain: str, days: int=None):
+        from failmap.scanners.models import EndpointGenericScanScratchpad, TlsQualysScratchpad
+
+        since = datetime.now(pytz.utc) - timedelta(days=days) if days else None
+
+        records = []
+        for model, kind in [(TlsQualysScratchpad, 'qualys'), (EndpointGenericScanScratchpad, None)]:
+            scratches = model.objects.all().filter(domain__contains=domain)
+            if since:
+                scratches = scratches.filter(when__gte=since)
+            records += [{'when': s.when, 'kind': kind or s.type, 'domain': s.domain, 'data': s.data}
+                        for s in scratches]
+        return sorted(records, key=lambda record: record['when'])
+
+
+class FileSink:
+    """
+    A directory per day, containing:
+    - scratches-<n>.jsonl.gz: every scratch is a separate gzip member, so files can be appended to.
+    - index.tsv: domain, file, offset and length of every scratch.
+    """
+
+    def __init__(self, directory: str, max_file_size: int, max_age_days: int):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_age_days = max_age_days
+
+    def write(self, kind: str, domain: str, data, when: datetime):
+        day_directory = os.path.join(self.directory, when.strftime('%Y-%m-%d'))
+        new_day = not os.path.isdir(day_directory)
+        os.makedirs(day_directory, exist_ok=True)
+
+        record = json.dumps({'when': when.isoformat(), 'kind': kind, 'domain': domain, 'data': data})
+        compressed = gzip.compress(record.encode('utf-8'))
+
+        # multiple workers can write to the same day.
+        with open(os.path.join(day_directory, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            filename = self.current_file(day_directory)
+            with open(os.path.join(day_directory, filename), 'ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+
+            with open(os.path.join(day_directory, INDEX_FILE), 'a') as index:
+                index.write("%s\t%s\t%s\t%s\t%s\n" % (domain, filename, offset, len(compressed), kind))
+
+        if new_day:
+            self.prune()
+
+    def current_file(self, day_directory: str):
+        """The newest scratch file of the day, or a new one when that is too large."""
+        number = 0
+        while True:
+            filename = "scratches-%s.jsonl.gz" % number
+            path = os.path.join(day_directory, filename)
+            if not os.path.exists(path) or os.path.getsize(path) < self.max_file_size:
+                return filename
+            number += 1
+
+    def read(self, domain: str, days: int=None):
+        records = []
+        for day_directory in self.day_directories():
+            if days and day_directory < (datetime.now(pytz.utc) - timedelta(days=days)).strftime('%Y-%m-%d'):
+                continue
+
+            index_path = os.path.join(self.directory, day_directory, INDEX_FILE)
+            if not os.path.exists(index_path):
+                continue
+
+            with open(index_path) as index:
+                for line in index:
+                    indexed_domain, filename, offset, length, kind = line.rstrip('\n').split('\t')
+                    if domain not in indexed_domain:
+                        continue
+
+                    with open(os.path.join(self.directory, day_directory, filename), 'rb') as f:
+                        f.seek(int(offset))
+                        records.append(json.loads(gzip.decompress(f.read(int(length))).decode('utf-8')))
+        return records
+
+    def day_directories(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if os.path.isdir(os.path.join(self.directory, name)))
+
+    def prune(self):
+        """Removes days that are older than max_age_days."""
+        oldest = (datetime.now(pytz.utc) - timedelta(days=self.max_age_days)).strftime('%Y-%m-%d')
+        for day_directory in self.day_directories():
+            if day_directory < oldest:
+                log.info("Removing old scratches of %s." % day_directory)
+                shutil.rmtree(os.path.join(self.directory, day_directory), ignore_errors=True)
@@ -0,0 +1,348 @@
+"""
+Screenshots of many endpoints, made by a pool of long running headless browsers.
+
+Starting Chrome takes most of the time of making a screenshot the old way (about 20 screenshots per minute). This
+service starts a few browsers with a number of tabs each, which take endpoints from a queue until it's empty. The
+browsers are driven over the DevTools protocol with pyppeteer. That is optional: without it screenshots are made
+the old way, see scanner_screenshot.
+
+- every page has a deadline, kept by the event loop. No signals are used, so this works in any thread. A tab that
+  passed its deadline is closed and replaced, a browser that crashed is started again.
+- browsers are restarted after SCREENSHOT_PAGES_PER_BROWSER pages, as they grow over time.
+- images are hashed, written and thumbnailed in a process pool, so the browsers don't wait for that.
+
+Images are stored by content: <sha256>.png and <sha256>_small.png, in a subdirectory named after the first two
+characters of the hash. The same image is stored only once. <ip version>_<uri>_latest.png is a link to the
+thumbnail of the latest screenshot of an endpoint. Every image also gets a perceptual hash (a difference hash): images
+that look the same, have the same hash. The hash is made before anything is written: a page that looks the same as on
+the latest screenshot of the endpoint is not stored again, it only updates that screenshot (see save_screenshot). The
+hash is also used to find endpoints that show the same page (see identical_pages).
+
+Usage:
+    hashes = latest_perceptual_hashes(endpoints)
+    stats = ScreenshotService(endpoints, handle_result=save_screenshot,
+                              previous_hash=lambda endpoint: hashes.get(endpoint.id, '')).run()
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import platform
+import re
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image
+
+try:
+    import pyppeteer
+except ImportError:
+    pyppeteer = None
+
+logger = logging.getLogger(__package__)
+
+WIDTH = 1920
+HEIGHT = 3000
+THUMBNAIL_SIZE = 320, 500
+
+# the image is reduced to this size for the perceptual hash: 8 differences per row, 8 rows = 64 bits.
+HASH_SIZE = 9, 8
+
+# seconds to wait for closing a tab or browser, before giving up or killing it.
+CLOSE_TIMEOUT = 5
+
+# give up when a browser can't be started this many times in a row.
+MAX_LAUNCH_FAILURES = 3
+
+
+def available() -> bool:
+    """True if the browser pool can be used on this worker."""
+    return pyppeteer is not None and bool(executable()) and os.path.exists(executable())
+
+
+def executable() -> str:
+    return settings.TOOLS['chrome']['executable'].get(platform.system(), "")
+
+
+class ScreenshotService:
+
+    def __init__(self, endpoints, handle_result, output_dir: str=None, browsers: int=None, tabs: int=None,
+                 page_timeout: float=None, pages_per_browser: int=None, processes: int=None, previous_hash=None):
+        """
+        :param endpoints: Endpoint objects to make a screenshot of.
+        :param handle_result: called with the endpoint and the stored image (see store_image) after every attempt,
+            or None when no screenshot could be made.
+        :param previous_hash: called with an endpoint, returns the perceptual hash of its latest screenshot or an
+            empty string. Images that look the same are not written.
+        :param output_dir: where images are stored, default is the chrome screenshot_output_dir.
+        :param browsers: amount of browsers running at the same time.
+        :param tabs: amount of tabs per browser.
+        :param page_timeout: seconds a page may take, including making the screenshot.
+        :param pages_per_browser: the browser is restarted after this many pages.
+        :param processes: size of the process pool that writes images and thumbnails.
+        """
+        self.endpoints = list(endpoints)
+        self.handle_result = handle_result
+        self.output_dir = output_dir or settings.TOOLS['chrome']['screenshot_output_dir']
+        self.browsers = browsers or settings.SCREENSHOT_BROWSERS
+        self.tabs = tabs or settings.SCREENSHOT_TABS
+        self.page_timeout = page_timeout or settings.SCREENSHOT_PAGE_TIMEOUT
+        self.pages_per_browser = pages_per_browser or settings.SCREENSHOT_PAGES_PER_BROWSER
+        self.processes = processes or settings.SCREENSHOT_PROCESSES
+        self.previous_hash = previous_hash or (lambda endpoint: '')
+
+        self.launch_failures = 0
+        self.stats = Counter()
+
+    def run(self) -> dict:
+        """Makes all screenshots, returns statistics."""
+        if not self.endpoints:
+            return {}
+
+        start = time.monotonic()
+
+        # Every call gets its own loop: this function is called from celery workers that don't run an event loop.
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            self.pool.shutdown()
+            loop.close()
+            asyncio.set_event_loop(None)
+
+        elapsed = time.monotonic() - start
+        stats = dict(self.stats)
+        stats['seconds'] = round(elapsed, 1)
+        stats['screenshots_per_minute'] = round(self.stats['screenshots'] / elapsed * 60, 1)
+        if self.stats['screenshots']:
+            stats['average_page_seconds'] = round(self.stats['page_seconds'] / self.stats['screenshots'], 2)
+        stats.pop('page_seconds', None)
+
+        logger.info("Screenshots done: %s" % stats)
+        return stats
+
+    async def _run(self):
+        queue = asyncio.Queue()
+        for endpoint in self.endpoints:
+            queue.put_nowait(endpoint)
+
+        await asyncio.gather(*[self._browser(queue) for _ in range(self.browsers)])
+
+        if not queue.empty():
+            logger.error("No browser could be started, %s screenshots are not made." % queue.qsize())
+            self.stats['skipped'] += queue.qsize()
+
+    async def _browser(self, queue: asyncio.Queue):
+        """Runs a browser with tabs until the queue is empty, starting a new browser when needed."""
+        while not queue.empty() and self.launch_failures < MAX_LAUNCH_FAILURES:
+            try:
+                browser = await pyppeteer.launch(
+                    executablePath=executable(), headless=True, args=['--disable-gpu'],
+                    # signal handlers can only be installed from the main thread.
+                    handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False)
+            except Exception as e:
+                self.launch_failures += 1
+                logger.warning("Could not start browser: %s" % e)
+                await asyncio.sleep(1)
+                continue
+
+            self.launch_failures = 0
+            self.stats['browsers'] += 1
+
+            # shared by all tabs of this browser.
+            budget = {'pages': self.pages_per_browser}
+            try:
+                await asyncio.gather(*[self._tab(browser, queue, budget) for _ in range(self.tabs)])
+            finally:
+                await self._close_browser(browser)
+
+    async def _tab(self, browser, queue: asyncio.Queue, budget: dict):
+        tab = Tab(browser)
+        try:
+            while budget['pages'] > 0 and not queue.empty():
+                endpoint = queue.get_nowait()
+                budget['pages'] -= 1
+
+                stored = await self._screenshot(tab, endpoint)
+                self.handle_result(endpoint, stored)
+
+                if not alive(browser):
+                    logger.warning("Browser stopped, starting a new one.")
+                    budget['pages'] = 0
+        finally:
+            await tab.close()
+
+    async def _screenshot(self, tab: 'Tab', endpoint):
+        loop = asyncio.get_event_loop()
+        uri = endpoint.uri_url()
+        logger.debug("Screenshot: %s over IPv%s" % (uri, endpoint.ip_version))
+
+        start = loop.time()
+        try:
+            image = await asyncio.wait_for(tab.capture(uri, self.page_timeout), self.page_timeout)
+        except asyncio.TimeoutError:
+            logger.debug("Screenshot of %s took too long." % uri)
+            self.stats['timeouts'] += 1
+            await tab.close()
+            return None
+        except Exception as e:
+            # errors of the page (such as downloads, connection errors) and the browser connection.
+            logger.debug("Could not make screenshot of %s: %s" % (uri, e))
+            self.stats['errors'] += 1
+            await tab.close()
+            return None
+
+        self.stats['page_seconds'] += loop.time() - start
+
+        try:
+            stored = await loop.run_in_executor(self.pool, store_image, image, self.output_dir,
+                                                latest_path(self.output_dir, endpoint), self.previous_hash(endpoint))
+        except Exception as e:
+            logger.warning("Could not store screenshot of %s: %s" % (uri, e))
+            self.stats['errors'] += 1
+            return None
+
+        self.stats['screenshots'] += 1
+        if stored['unchanged']:
+            self.stats['unchanged_pages'] += 1
+        elif not stored['new']:
+            self.stats['duplicate_images'] += 1
+        return stored
+
+    async def _close_browser(self, browser):
+        try:
+            await asyncio.wait_for(browser.close(), CLOSE_TIMEOUT)
+        except Exception as e:
+            logger.debug("Could not close browser, killing it: %s" % e)
+            process = getattr(browser, 'process', None)
+            if process and process.poll() is None:
+                process.kill()
+
+
+class Tab:
+    """A browser tab that is reused for many pages. It's opened when needed and replaced after problems."""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.page = None
+
+    async def capture(self, uri: str, timeout: float) -> bytes:
+        if self.page is None:
+            self.page = await self.browser.newPage()
+            await self.page.setViewport({'width': WIDTH, 'height': HEIGHT})
+
+        await self.page.goto(uri, {'timeout': timeout * 1000, 'waitUntil': 'load'})
+        return await self.page.screenshot({'type': 'png'})
+
+    async def close(self):
+        page, self.page = self.page, None
+        if page is None:
+            return
+        try:
+            await asyncio.wait_for(page.close(), CLOSE_TIMEOUT)
+        except Exception as e:
+            # the page is gone with the browser, or the browser will be closed anyway.
+            logger.debug("Could not close tab: %s" % e)
+
+
+def alive(browser) -> bool:
+    process = getattr(browser, 'process', None)
+    return process is None or process.poll() is None
+
+
+def latest_path(output_dir: str, endpoint) -> str:
+    """Link to the thumbnail of the latest screenshot of an endpoint."""
+    name = re.sub(r'[^a-zA-Z0-9_]', '', str(endpoint.ip_version) + '_' + endpoint.uri_url())
+    return os.path.join(output_dir, name + '_latest.png')
+
+
+def content_paths(output_dir: str, content_hash: str):
+    """Image and thumbnail of an image with this hash."""
+    directory = os.path.join(output_dir, content_hash[0:2])
+    return (os.path.join(directory, content_hash + '.png'),
+            os.path.join(directory, content_hash + '_small.png'))
+
+
+def store_image(image: bytes, output_dir: str, latest: str=None, previous_hash: str='') -> dict:
+    """
+    Stores an image and its thumbnail by content, unless that image is already stored or looks the same as the
+    previous image. Runs in the process pool.
+
+    :param latest: path of a link that will point to the thumbnail.
+    :param previous_hash: perceptual hash of the latest screenshot of the endpoint. When the image has the same hash,
+        nothing is written and the link keeps pointing to the thumbnail of that screenshot.
+    :return: {'filename': path of the image, None when unchanged, 'content_hash': ..., 'perceptual_hash': ...,
+        'new': False if the image was already stored or is unchanged, 'unchanged': True if it looks the same}
+    """
+    content_hash = hashlib.sha256(image).hexdigest()
+    im = Image.open(io.BytesIO(image))
+    hashed = perceptual_hash(im)
+
+    if previous_hash and hashed == previous_hash:
+        return {'filename': None, 'content_hash': content_hash, 'perceptual_hash': hashed, 'new': False,
+                'unchanged': True}
+
+    image_path, thumbnail_path = content_paths(output_dir, content_hash)
+    new = not os.path.exists(image_path)
+    if new:
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+
+        thumbnail = io.BytesIO()
+        small = im.copy()
+        small.thumbnail(THUMBNAIL_SIZE, Image.ANTIALIAS)
+        small.save(thumbnail, "PNG")
+
+        # the image last: when it exists, the thumbnail exists as well.
+        _replace(thumbnail_path, lambda f: f.write(thumbnail.getvalue()))
+        _replace(image_path, lambda f: f.write(image))
+
+    if latest:
+        _link(thumbnail_path, latest)
+
+    return {'filename': image_path, 'content_hash': content_hash, 'perceptual_hash': hashed, 'new': new,
+            'unchanged': False}
+
+
+def perceptual_hash(im: Image.Image) -> str:
+    """
+    Difference hash: the image is reduced to 9x8 gray pixels, every bit tells if a pixel is brighter than the pixel
+    to its right. Small differences (such as a date or a counter) don't change the hash, different layouts do.
+    """
+    pixels = list(im.convert('L').resize(HASH_SIZE, Image.ANTIALIAS).getdata())
+    width, height = HASH_SIZE
+
+    value = 0
+    for row in range(height):
+        for column in range(width - 1):
+            left, right = pixels[row * width + column], pixels[row * width + column + 1]
+            value = value << 1 | (left > right)
+    return "%016x" % value
+
+
+def _replace(path: str, write):
+    """Writes a file at once, so it's never seen half written."""
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".screenshot")
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            write(f)
+        # mkstemp only allows the owner to read, the images are served by the web server.
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _link(target: str, link: str):
+    """Points link to target, replacing what was there."""
+    temporary = "%s.%s.tmp" % (link, os.getpid())
+    if os.path.lexists(temporary):
+        os.unlink(temporary)
+    os.symlink(os.path.relpath(target, os.path.dirname(link)), temporary)
+    os.replace(temporary, link)
@@ -11,18 +11,18 @@ from failmap.scanners.models import State
 class StateManager(models.Manager):
 
     @staticmethod
-    def set_state(scanner, value):
+    def set_state(scanner, value, since=None):
 
         try:
             state = State.objects.get(scanner=scanner)
             state.value = value
-            state.since = datetime.now(pytz.utc)
+            state.since = since or datetime.now(pytz.utc)
             state.save()
         except ObjectDoesNotExist:
             state = State()  # recursive exceptions?
             state.scanner = scanner
             state.value = value
-            state.since = datetime.now(pytz.utc)
+            state.since = since or datetime.now(pytz.utc)
             state.save()
 
     @staticmethod
@@ -0,0 +1,143 @@
+"""
+The known subdomains wordlist: every subdomain that is used by some organization, such as www, mail and intranet.
+
+What one organization uses, others are likely to use as well. This list used to be rebuilt from all urls in the
+database before every brute force. Now the frequency of every subdomain is kept (knownsubdomains.json) and updated
+with the urls that are added. The wordlist itself (knownsubdomains.txt), ordered by popularity, is only written
+when its contents change.
+
+Workers can add urls at the same time: updates are done under a lock and files are replaced, never rewritten in
+place, so a brute force never reads a half written list.
+
+Usage:
+    add(["www.example.com", "mail.example.com"])
+    words = words(minimum=2)
+    rebuild()  # from all urls in the database
+"""
+import fcntl
+import json
+import logging
+import os
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+
+from failmap.organizations.models import Url
+
+logger = logging.getLogger(__package__)
+
+WORDLIST = "knownsubdomains.txt"
+FREQUENCIES = "knownsubdomains.json"
+LOCK_FILE = ".knownsubdomains.lock"
+
+
+def prefix(url: str) -> str:
+    """The subdomain of an url: "www" for www.example.com, "" for example.com."""
+    positions = [pos for pos, char in enumerate(url) if char == '.']
+    if len(positions) > 1:
+        return url[0:positions[-2]].lower()
+    return ""
+
+
+def add(urls: Iterable[str]):
+    """
+    Counts the subdomains of new urls.
+
+    Nothing happens until the frequencies are built once (by words() or rebuild()), as that counts all urls.
+    """
+    prefixes = Counter(filter(None, (prefix(url) for url in urls)))
+    if not prefixes or not os.path.exists(path(FREQUENCIES)):
+        return
+
+    with locked():
+        frequencies = read_frequencies()
+        if frequencies is None:
+            return
+
+        before = ranked(frequencies)
+        frequencies.update(prefixes)
+        _write(FREQUENCIES, json.dumps(frequencies))
+
+        after = ranked(frequencies)
+        if after != before or not os.path.exists(path(WORDLIST)):
+            _write(WORDLIST, "".join(word + "\n" for word in after))
+
+    logger.debug("Counted %s subdomains for the known subdomains wordlist." % sum(prefixes.values()))
+
+
+def words(minimum: int=1, popular_first: bool=True) -> List[str]:
+    """
+    All known subdomains.
+
+    :param minimum: only subdomains that are used at least this often.
+    :param popular_first: most used subdomains first, otherwise alphabetical.
+    """
+    frequencies = read_frequencies()
+    if frequencies is None:
+        frequencies = rebuild()
+
+    selection = [word for word in ranked(frequencies) if frequencies[word] >= minimum]
+    return selection if popular_first else sorted(selection)
+
+
+def rebuild() -> Counter:
+    """Counts the subdomains of all urls in the database and writes both files."""
+    # todo: per branche wordlists, more to the point
+    frequencies = Counter(filter(None, (prefix(url) for url in
+                                        Url.objects.all().values_list('url', flat=True).iterator())))
+
+    with locked():
+        _write(FREQUENCIES, json.dumps(frequencies))
+        _write(WORDLIST, "".join(word + "\n" for word in ranked(frequencies)))
+
+    logger.info("Rebuilt known subdomains wordlist: %s subdomains." % len(frequencies))
+    return frequencies
+
+
+def ranked(frequencies: Dict[str, int]) -> List[str]:
+    return sorted(frequencies, key=lambda word: (-frequencies[word], word))
+
+
+def read_frequencies():
+    """Counter of subdomains, or None if it was never built."""
+    try:
+        with open(path(FREQUENCIES)) as f:
+            return Counter(json.load(f))
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        logger.warning("Known subdomains frequencies are unreadable, they will be rebuilt: %s" % e)
+        return None
+
+
+def directory() -> str:
+    return settings.TOOLS['dnsrecon']['wordlist_dir']
+
+
+def path(filename: str) -> str:
+    return os.path.join(directory(), filename)
+
+
+@contextmanager
+def locked():
+    os.makedirs(directory(), exist_ok=True)
+    with open(path(LOCK_FILE), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _write(filename: str, content: str):
+    """Replaces a file at once: readers see either the old or the new contents."""
+    handle, temporary = tempfile.mkstemp(dir=directory(), prefix="." + filename)
+    try:
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        # mkstemp only allows the owner to read.
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path(filename))
+    except BaseException:
+        os.unlink(temporary)
+        raise
@@ -1,25 +1,127 @@
-# https://stackoverflow.com/questions/2281850/timeout-function-if-it-takes-too-long-to-finish
-# without the duplicate timeout error class
+"""
+Deadlines for scanners, that work in any thread, greenlet or event loop.
+
+The timeout decorator used to set an alarm signal (SIGALRM). Signals are only delivered to the main thread of a
+process, so every scanner that used it needed a prefork worker with a process per task. These work everywhere:
+
+- Deadline: a moment after which our own code should stop. Code checks it between steps (deadline.check()) and hands
+  the remaining time to whatever it waits for: a socket timeout, asyncio.wait_for or run().
+- run: runs a program and kills it, including the programs it started, when the deadline passes.
+- timeout: decorator for blocking calls that can't be given a timeout themselves, such as socket.getaddrinfo. The
+  call is made in a separate thread and the caller stops waiting at the deadline. The thread can't be stopped: it
+  finishes in the background, and its result is thrown away. Don't use it for calls that may never end.
+
+A passed deadline raises TimeoutError, like the signal based decorator did.
+
+Usage:
+    deadline = Deadline(30)
+    run([browser, '--screenshot', url], deadline)
+    deadline.check()
+
+    @timeout(10)
+    def addresses(name):
+        return socket.getaddrinfo(name, None)
+"""
 import errno
+import logging
 import os
 import signal
+import subprocess
+import threading
+import time
 from functools import wraps
+from typing import List, Union
 
+from django.db import connection
+
+log = logging.getLogger(__package__)
+
+
+class Deadline:
+
+    def __init__(self, seconds: float, error_message: str=os.strerror(errno.ETIME)):
+        self.moment = time.monotonic() + seconds
+        self.error_message = error_message
+
+    def remaining(self) -> float:
+        """Seconds until the deadline, 0 when it passed."""
+        return max(0, self.moment - time.monotonic())
+
+    def expired(self) -> bool:
+        return not self.remaining()
+
+    def check(self):
+        """Raises TimeoutError when the deadline passed."""
+        if self.expired():
+            raise TimeoutError(self.error_message)
 
-def timeout(seconds=10, error_message=os.strerror(errno.ETIME)):
-    def decorator(func):
-        def _handle_timeout(signum, frame):
-            raise TimeoutError(error_message)
 
+def run(command: List[str], deadline: Union[Deadline, float], **kwargs) -> subprocess.CompletedProcess:
+    """
+    Runs a program, killing it when the deadline passes. Browsers and other programs that start programs of their own
+    are started in a new session, so all of them are killed at once.
+
+    :param deadline: a Deadline, or the amount of seconds the program may take.
+    :param kwargs: passed to subprocess.Popen, for example stdout=subprocess.PIPE.
+    :return: the completed process, the output is only available when stdout or stderr are piped.
+    """
+    if not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline)
+    deadline.check()
+
+    process = subprocess.Popen(command, start_new_session=True, **kwargs)
+    try:
+        stdout, stderr = process.communicate(timeout=deadline.remaining())
+    except subprocess.TimeoutExpired:
+        log.debug("Killing %s, it passed its deadline." % command[0])
+        kill(process)
+        raise TimeoutError(deadline.error_message)
+    except BaseException:
+        kill(process)
+        raise
+
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+def kill(process: subprocess.Popen):
+    """Kills a process started by run(), and everything it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # already gone.
+        pass
+    process.communicate()
+
+
+def timeout(seconds: float=10, error_message: str=os.strerror(errno.ETIME)):
+    def decorator(func):
         def wrapper(*args, **kwargs):
-            signal.signal(signal.SIGALRM, _handle_timeout)
-            signal.alarm(seconds)
-            try:
-                result = func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-            return result
+            return call_with_timeout(seconds, func, *args, error_message=error_message, **kwargs)
 
         return wraps(func)(wrapper)
 
     return decorator
+
+
+def call_with_timeout(seconds: float, func, *args, error_message: str=os.strerror(errno.ETIME), **kwargs):
+    """Calls a function in a separate thread and waits at most seconds for its result, see above."""
+    outcome = {}
+
+    def call():
+        try:
+            outcome['result'] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            # database connections are per thread, don't leave one behind.
+            connection.close()
+
+    thread = threading.Thread(target=call, name="timeout %s" % getattr(func, '__name__', func), daemon=True)
+    thread.start()
+    thread.join(seconds)
+
+    if thread.is_alive():
+        raise TimeoutError(error_message)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
@@ -0,0 +1,270 @@
+"""
+Concurrent sslscan and CVE checks, with streaming report parsing.
+
+Every endpoint is checked by sslscan and two vulnerability checks (CVE-2016-2107 padding oracle and CVE-2016-9244
+ticketbleed), which are all separate programs that mostly wait on the network. This module runs them for many
+endpoints at the same time from a single event loop, with at most `concurrency` programs running at once.
+
+sslscan writes its XML report to a pipe, which is parsed while it's being written. Only what is needed for grading
+is kept (see ReportParser), the document itself is never built completely.
+
+Every endpoint has a deadline. Programs that are still running at the deadline are killed. This does not use
+signals, so it also works outside the main thread, for example in threaded or eventlet workers.
+
+Usage:
+    summaries = scan([('faalkaart.nl', 443), ('example.com', 443)])
+"""
+import asyncio
+import logging
+import platform
+import subprocess
+from typing import List, Tuple
+from xml.etree.ElementTree import XMLPullParser
+
+from django.conf import settings
+
+logger = logging.getLogger(__package__)
+
+# maximum amount of programs running at the same time.
+CONCURRENCY = 8
+
+# seconds an endpoint may take, including all vulnerability checks.
+ENDPOINT_TIMEOUT = 300
+
+# seconds a vulnerability check may take. These used to be cut off after 3 seconds, which includes compiling.
+CVE_TIMEOUT = 10
+
+# name in the report, tool and the text that tells the endpoint is vulnerable.
+CVES = {
+    'CVE_2016_2107': ('cve_2016_2107', "Vulnerable: true"),
+    'CVE_2016_9244': ('cve_2016_9244', "is vulnerable to Ticketbleed"),
+}
+
+CERTIFICATE_FIELDS = ['subject', 'altnames', 'self-signed', 'expired', 'signature-algorithm']
+
+READ_SIZE = 64 * 1024
+
+# the start of the XML document in the output of sslscan.
+DOCUMENT_MARKERS = [b'<?xml', b'<document']
+
+
+class ReportParser:
+    """
+    Incrementally parses a sslscan XML report into a summary:
+
+    {
+        'renegotiation': {'supported': '1', 'secure': '1'},
+        'compression': {'supported': '0'},
+        'heartbleed': [{'sslversion': 'TLSv1.2', 'vulnerable': '0'}, ...],
+        'ciphers': [{'sslversion': 'TLSv1.2', 'bits': '256', 'cipher': 'ECDHE-RSA-AES256-GCM-SHA384', ...}, ...],
+        'certificates': [{'subject': '...', 'altnames': '...', 'expired': 'false', ...}, ...],
+        'cve': {'CVE_2016_2107': 'False', ...},
+    }
+
+    Elements are removed from the document as soon as they are read, the largest parts (certificate blobs and
+    public keys) are never kept.
+    """
+
+    def __init__(self):
+        self.parser = XMLPullParser(events=('start', 'end'))
+        self.stack = []
+        self.started = False
+        # output before the document, a marker can be split over two chunks.
+        self.preamble = b''
+        self.summary = {
+            'renegotiation': {},
+            'compression': {},
+            'heartbleed': [],
+            'ciphers': [],
+            'certificates': [],
+            'cve': {},
+        }
+
+    def feed(self, data: bytes):
+        if not self.started:
+            # sslscan can write other things before the document, such as warnings.
+            data = self.preamble + data
+            starts = [data.find(marker) for marker in DOCUMENT_MARKERS if marker in data]
+            if not starts:
+                # keep what could be the beginning of a marker.
+                self.preamble = data[-(max(len(marker) for marker in DOCUMENT_MARKERS) - 1):]
+                return
+            data = data[min(starts):]
+            self.preamble = b''
+            self.started = True
+
+        self.parser.feed(data)
+        self._read_events()
+
+    def close(self) -> dict:
+        if self.started:
+            self.parser.close()
+            self._read_events()
+        return self.summary
+
+    def _read_events(self):
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                if element.tag == 'certificate':
+                    self.summary['certificates'].append({})
+                self.stack.append(element)
+                continue
+
+            self.stack.pop()
+            parent = self.stack[-1] if self.stack else None
+            self._read(element, parent)
+
+            # the element is handled, don't keep it in the document.
+            if parent is not None:
+                parent.remove(element)
+
+    def _read(self, element, parent):
+        tag = element.tag
+        if tag == 'cipher':
+            self.summary['ciphers'].append(dict(element.attrib))
+        elif tag == 'heartbleed':
+            self.summary['heartbleed'].append(dict(element.attrib))
+        elif tag in ['renegotiation', 'compression']:
+            self.summary[tag] = dict(element.attrib)
+        elif tag in CERTIFICATE_FIELDS and parent is not None and parent.tag == 'certificate':
+            self.summary['certificates'][-1][tag] = (element.text or '').strip()
+        elif tag.upper().startswith('CVE'):
+            # both <CVE-2016-2107> and <CVE_2016_2107> are used.
+            self.summary['cve'][tag.replace('-', '_')] = (element.text or '').strip()
+
+
+def parse_report(path: str) -> dict:
+    """Summary of a sslscan XML report on disk, see ReportParser."""
+    parser = ReportParser()
+    with open(path, 'rb') as report:
+        for chunk in iter(lambda: report.read(READ_SIZE), b''):
+            parser.feed(chunk)
+    return parser.close()
+
+
+def scan(targets: List[Tuple[str, int]], concurrency: int=CONCURRENCY, timeout: float=ENDPOINT_TIMEOUT) -> List[dict]:
+    """
+    Runs sslscan and the vulnerability checks on all targets.
+
+    :param targets: list of (host, port).
+    :param concurrency: maximum number of programs running at the same time.
+    :param timeout: seconds per endpoint.
+    :return: list of summaries (see ReportParser), in the same order as the targets. None if sslscan failed.
+    """
+    if not targets:
+        return []
+
+    # Every call gets its own loop: this function is called from celery workers that don't run an event loop.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(_scan_all(targets, concurrency, timeout))
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+async def _scan_all(targets, concurrency, timeout):
+    programs = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[scan_endpoint(host, port, programs, timeout) for host, port in targets])
+
+
+async def scan_endpoint(host: str, port: int, programs: asyncio.Semaphore, timeout: float=ENDPOINT_TIMEOUT):
+    deadline = asyncio.get_event_loop().time() + timeout
+    address = "%s:%s" % (host, port)
+
+    parser = ReportParser()
+    sslscan = settings.TOOLS['sslscan']['executable'][platform.system()]
+    command = [sslscan, '--show-certificate', '--no-colour', '--xml=-', address]
+
+    checks = [_check_cve(name, address, programs, deadline) for name in sorted(CVES)]
+    results = await asyncio.gather(
+        run(command, programs, deadline, on_output=parser.feed, stderr=subprocess.DEVNULL),
+        *checks, return_exceptions=True)
+
+    if isinstance(results[0], Exception):
+        logger.info("sslscan on %s failed: %s" % (address, repr(results[0])))
+        return None
+
+    if not parser.started:
+        logger.info("sslscan on %s did not write a report." % address)
+        return None
+
+    try:
+        summary = parser.close()
+    except Exception as e:
+        logger.info("Could not read sslscan report of %s: %s" % (address, e))
+        return None
+
+    for name, vulnerable in zip(sorted(CVES), results[1:]):
+        if vulnerable is not None and not isinstance(vulnerable, Exception):
+            summary['cve'][name] = str(vulnerable)
+
+    return summary
+
+
+async def _check_cve(name: str, address: str, programs: asyncio.Semaphore, deadline: float):
+    """True or False when the check completed, None otherwise."""
+    tool, vulnerable = CVES[name]
+    loop = asyncio.get_event_loop()
+    deadline = min(deadline, loop.time() + CVE_TIMEOUT)
+
+    try:
+        returncode, output = await run(['go', 'run', settings.TOOLS['TLS'][tool], address], programs, deadline)
+    except (asyncio.TimeoutError, OSError) as e:
+        logger.debug("%s check on %s did not complete: %s" % (name, address, repr(e)))
+        return None
+
+    return vulnerable in output.decode('utf-8', errors='replace')
+
+
+async def run(command: List[str], programs: asyncio.Semaphore, deadline: float, on_output=None,
+              stderr=subprocess.STDOUT):
+    """
+    Runs a program, killing it at the deadline (loop time).
+
+    The process is a normal subprocess of which the output pipe is read by the event loop, and the exit status is
+    collected in a thread. Asyncio subprocesses need a child watcher which (before python 3.8) only works from the
+    main thread.
+
+    :param on_output: called with every chunk of output. When not given, the output is returned.
+    :return: exit status and output.
+    """
+    loop = asyncio.get_event_loop()
+
+    async with programs:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise asyncio.TimeoutError()
+
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr)
+        reader = asyncio.StreamReader(loop=loop)
+        transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader, loop=loop),
+                                                    process.stdout)
+        output = []
+
+        async def read_all():
+            while True:
+                chunk = await reader.read(READ_SIZE)
+                if not chunk:
+                    return
+                if on_output:
+                    on_output(chunk)
+                else:
+                    output.append(chunk)
+
+        try:
+            await asyncio.wait_for(read_all(), remaining)
+            returncode = await asyncio.wait_for(loop.run_in_executor(None, process.wait),
+                                                max(deadline - loop.time(), 0.1))
+        except BaseException as e:
+            # passed the deadline, unreadable output or the scan was cancelled: the program is not needed anymore.
+            if process.poll() is None:
+                logger.debug("Killing %s: %s" % (command[0], repr(e)))
+                process.kill()
+                await loop.run_in_executor(None, process.wait)
+            raise
+        finally:
+            transport.close()
+
+    return returncode, b''.join(output)
@@ -410,10 +410,36 @@ TOOLS = {
         }
     },
     'dnscheck': {
-        'executable': TOOLS_DIR + 'dnssec.pl'
+        'executable': TOOLS_DIR + 'dnssec.pl',
+        # keeps running and checks all zones given on stdin.
+        'batch_executable': TOOLS_DIR + 'dnssec_batch.pl',
     }
 }
 
+# DNSSEC is checked in batches of DNSSEC_BATCH_SIZE zones, by DNSSEC_CHECKERS checker processes per task. A zone
+# may take DNSSEC_TIMEOUT seconds.
+DNSSEC_BATCH_SIZE = int(os.environ.get('DNSSEC_BATCH_SIZE', 50))
+DNSSEC_CHECKERS = int(os.environ.get('DNSSEC_CHECKERS', 4))
+DNSSEC_TIMEOUT = int(os.environ.get('DNSSEC_TIMEOUT', 240))
+
+# Debugging data of scanners (scratches). Stored in compressed files per day by default, which are removed after
+# SCRATCH_MAX_AGE_DAYS. Set SCRATCH_BACKEND to 'database' to store them in the scratchpad tables instead.
+SCRATCH_BACKEND = os.environ.get('SCRATCH_BACKEND', 'file')
+SCRATCH_DIR = OUTPUT_DIR + os.environ.get('SCRATCH_DIR', "scanners/resources/output/scratch/")
+SCRATCH_MAX_FILE_SIZE = int(os.environ.get('SCRATCH_MAX_FILE_SIZE', 64 * 1024 * 1024))
+SCRATCH_MAX_AGE_DAYS = int(os.environ.get('SCRATCH_MAX_AGE_DAYS', 30))
+
+# Qualys SSL Labs API, used by the TLS scanner. The assessment manager keeps at most QUALYS_MAX_ASSESSMENTS running,
+# starts new ones at most every QUALYS_NEW_ASSESSMENT_INTERVAL seconds and checks running ones every
+# QUALYS_POLL_INTERVAL seconds. Concurrency and interval are lowered when the API asks for it.
+QUALYS_API_URL = os.environ.get('QUALYS_API_URL', "https://api.ssllabs.com/api/v2/")
+QUALYS_MAX_ASSESSMENTS = int(os.environ.get('QUALYS_MAX_ASSESSMENTS', 20))
+QUALYS_NEW_ASSESSMENT_INTERVAL = int(os.environ.get('QUALYS_NEW_ASSESSMENT_INTERVAL', 30))
+QUALYS_POLL_INTERVAL = int(os.environ.get('QUALYS_POLL_INTERVAL', 20))
+
+# Certificate transparency log search, used to discover subdomains.
+CERTIFICATE_TRANSPARENCY_URL = os.environ.get('CERTIFICATE_TRANSPARENCY_URL', "https://crt.sh/")
+
 # Compression
 # Django-compressor is used to compress css and js files in production
 # During development this is disabled as it does not provide any feature there
@@ -473,7 +499,8 @@ ENABLE_UTC = True
 # see: https://blog.nelhage.com/2011/03/exploiting-pickle/
 # Yet pickle is the only convenient way of transporting objects without having to lean in all kinds
 # of directions to get the job done. Intermediate tables to store results could be an option.
-CELERY_ACCEPT_CONTENT = ['pickle']
+# Tasks that only receive ids and other plain values (see failmap.celery.hydrate) are sent as json.
+CELERY_ACCEPT_CONTENT = ['pickle', 'json']
 CELERY_TASK_SERIALIZER = 'pickle'
 CELERY_RESULT_SERIALIZER = 'pickle'
 CELERY_TIMEZONE = 'UTC'
@@ -563,6 +590,77 @@ SENTRY_PROJECT_URL = 'https://sentry.io/%s/%s' % (SENTRY_ORGANIZATION, SENTRY_PR
 NETWORK_SUPPORTS_IPV4 = os.environ.get('NETWORK_SUPPORTS_IPV4', True)
 NETWORK_SUPPORTS_IPV6 = os.environ.get('NETWORK_SUPPORTS_IPV6', False)
 
+# DNS answers are cached for the time to live of the answer, within these bounds (seconds). Names without
+# addresses are cached for DNS_CACHE_NEGATIVE_TTL. The cache is shared between workers when the broker is Redis.
+DNS_CACHE_MIN_TTL = int(os.environ.get('DNS_CACHE_MIN_TTL', 60))
+DNS_CACHE_MAX_TTL = int(os.environ.get('DNS_CACHE_MAX_TTL', 3600))
+DNS_CACHE_NEGATIVE_TTL = int(os.environ.get('DNS_CACHE_NEGATIVE_TTL', 300))
+
+# Screenshots are made by SCREENSHOT_BROWSERS headless browsers with SCREENSHOT_TABS tabs each, when pyppeteer is
+# installed. A page may take SCREENSHOT_PAGE_TIMEOUT seconds. Browsers are restarted after
+# SCREENSHOT_PAGES_PER_BROWSER pages. Images and thumbnails are written by SCREENSHOT_PROCESSES processes.
+SCREENSHOT_BROWSERS = int(os.environ.get('SCREENSHOT_BROWSERS', 2))
+SCREENSHOT_TABS = int(os.environ.get('SCREENSHOT_TABS', 4))
+SCREENSHOT_PAGE_TIMEOUT = int(os.environ.get('SCREENSHOT_PAGE_TIMEOUT', 30))
+SCREENSHOT_PAGES_PER_BROWSER = int(os.environ.get('SCREENSHOT_PAGES_PER_BROWSER', 200))
+SCREENSHOT_PROCESSES = int(os.environ.get('SCREENSHOT_PROCESSES', 2))
+
+# DNS brute forcing asks at most this many questions per second. The name servers are a comma separated list of ip
+# addresses, the system name servers are used when empty.
+DNS_BRUTE_FORCE_RATE = int(os.environ.get('DNS_BRUTE_FORCE_RATE', 100))
+DNS_BRUTE_FORCE_NAMESERVERS = [nameserver.strip() for nameserver in
+                               os.environ.get('DNS_BRUTE_FORCE_NAMESERVERS', '').split(',') if nameserver.strip()]
+
+# Scans are planned by staleness, the targets that were scanned longest ago go first. A target is overdue when it was
+# not scanned for 'freshness' hours. Every scanner gets 'budget' targets per hour since its previous plan.
+SCAN_SCHEDULE = {
+    'tls_qualys': {
+        'freshness': int(os.environ.get('SCAN_SCHEDULE_TLS_QUALYS_FRESHNESS', 7 * 24)),
+        # qualys allows starting a scan every two minutes.
+        'budget': int(os.environ.get('SCAN_SCHEDULE_TLS_QUALYS_BUDGET', 30)),
+    },
+    'http': {
+        'freshness': int(os.environ.get('SCAN_SCHEDULE_HTTP_FRESHNESS', 3 * 24)),
+        'budget': int(os.environ.get('SCAN_SCHEDULE_HTTP_BUDGET', 500)),
+    },
+    'screenshot': {
+        'freshness': int(os.environ.get('SCAN_SCHEDULE_SCREENSHOT_FRESHNESS', 31 * 24)),
+        'budget': int(os.environ.get('SCAN_SCHEDULE_SCREENSHOT_BUDGET', 600)),
+    },
+}
+
+# Scanners with a task per endpoint publish their tasks in chunks of PRODUCER_CHUNK_SIZE targets. Publishing pauses
+# PRODUCER_PAUSE seconds at a time while more than PRODUCER_HIGH_WATER messages wait in the queues of the scanner:
+# the run is resumed by a new task after the pause.
+PRODUCER_CHUNK_SIZE = int(os.environ.get('PRODUCER_CHUNK_SIZE', 500))
+PRODUCER_HIGH_WATER = int(os.environ.get('PRODUCER_HIGH_WATER', 10000))
+PRODUCER_PAUSE = int(os.environ.get('PRODUCER_PAUSE', 10))
+
+# Scanners take a token of a few buckets before contacting a target, shared by all workers when the broker is Redis.
+# A bucket holds at most 'burst' tokens and gets 'rate' tokens per second. There is a global bucket for all
+# connections together, one per host (domain name) and one per ip address. A rate of 0 means no limit.
+RATE_LIMITS = {
+    'global': {
+        'rate': float(os.environ.get('RATE_LIMIT_GLOBAL_RATE', 100)),
+        'burst': int(os.environ.get('RATE_LIMIT_GLOBAL_BURST', 200)),
+    },
+    'host': {
+        'rate': float(os.environ.get('RATE_LIMIT_HOST_RATE', 1)),
+        'burst': int(os.environ.get('RATE_LIMIT_HOST_BURST', 10)),
+    },
+    'ip': {
+        # many domains share a server, and the firewall in front of it.
+        'rate': float(os.environ.get('RATE_LIMIT_IP_RATE', 5)),
+        'burst': int(os.environ.get('RATE_LIMIT_IP_BURST', 20)),
+    },
+    'qualys': {
+        # starting new assessments. 7 march 2018, qualys has new rate limits due to service outage: we used to do 1
+        # per minute which was fine, but we're now doing 1 every 2 minutes.
+        'rate': float(os.environ.get('RATE_LIMIT_QUALYS_RATE', 1 / 120)),
+        'burst': int(os.environ.get('RATE_LIMIT_QUALYS_BURST', 1)),
+    },
+}
+
 # atomic imports: fail completely, not half
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
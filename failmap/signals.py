@@ -6,7 +6,7 @@ import shutil
 import sys
 import tempfile
 
-from celery.signals import celeryd_init, worker_shutdown
+from celery.signals import celeryd_init, worker_process_shutdown, worker_shutdown
 from django.conf import settings
 
 from .celery.worker import tls_client_certificate, worker_configuration
@@ -45,3 +45,20 @@ def cleanup_certificates(sender=None, conf=None, **kwargs):
     """Remove worker temporary directory."""
 
     shutil.rmtree(settings.WORKER_TMPDIR)
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def close_http_sessions(**kwargs):
+    """Close kept-alive connections of scanners in this worker process, or in the worker itself (green threads)."""
+    from failmap.scanners import http_session
+
+    http_session.close()
+
+
+@worker_process_shutdown.connect
+def flush_heartbeats(**kwargs):
+    """Write scan heartbeats that are still waiting in this worker process."""
+    from failmap.scanners import heartbeat
+
+    heartbeat.flush()
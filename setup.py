@@ -72,7 +72,8 @@ setup(
         ],
     },
     scripts=[
-        'tools/dnssec.pl'
+        'tools/dnssec.pl',
+        'tools/dnssec_batch.pl',
     ],
     include_package_data=True,
 )
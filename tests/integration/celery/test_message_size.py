@@ -0,0 +1,75 @@
+"""
+Size and publish rate of task messages with objects versus ids as arguments (see failmap.celery.hydrate).
+
+Messages are published to a queue without worker and purged afterwards. Configure with the environment variable
+MESSAGE_BENCHMARK_MESSAGES (amount of messages published per variant).
+"""
+import logging
+import os
+import time
+
+import pytest
+from kombu.serialization import dumps
+
+from failmap.celery import app
+from failmap.organizations.models import Url
+from failmap.scanners.models import Endpoint
+from failmap.scanners.scanner_http import URLS_PER_TASK, resolve_and_scan_batch
+from failmap.scanners.scanner_security_headers import analyze_headers
+
+log = logging.getLogger(__name__)
+
+MESSAGES = int(os.environ.get('MESSAGE_BENCHMARK_MESSAGES', 2000))
+
+
+@pytest.fixture
+def benchmark_endpoints(transactional_db):
+    endpoints = []
+    for number in range(URLS_PER_TASK):
+        url = Url(url='benchmark%s.faalonie.test' % number)
+        url.save()
+        endpoint = Endpoint(ip_version=4, port=443, protocol='https', url=url)
+        endpoint.save()
+        endpoints.append(endpoint)
+    return endpoints
+
+
+def variants(endpoints):
+    urls = [endpoint.url for endpoint in endpoints]
+    return {
+        'analyze_headers, objects': (analyze_headers, (endpoints[0], True), 'pickle'),
+        'analyze_headers, ids': (analyze_headers, (endpoints[0].pk, True), 'json'),
+        'resolve_and_scan_batch, objects': (resolve_and_scan_batch, (urls, [('https', 443)]), 'pickle'),
+        'resolve_and_scan_batch, ids': (resolve_and_scan_batch, ([url.pk for url in urls], [('https', 443)]),
+                                        'json'),
+    }
+
+
+def publish_rate(task, args, serializer, queue) -> float:
+    """Messages per second."""
+    start = time.monotonic()
+    with app.producer_or_acquire() as producer:
+        for _ in range(MESSAGES):
+            task.apply_async(args, queue=queue, serializer=serializer, producer=producer)
+    elapsed = time.monotonic() - start
+
+    with app.connection_or_acquire() as connection:
+        connection.default_channel.queue_purge(queue)
+
+    return MESSAGES / elapsed
+
+
+def test_message_size(benchmark_endpoints, queues):
+    report = {}
+    for name, (task, args, serializer) in variants(benchmark_endpoints).items():
+        content_type, encoding, body = dumps((args, {}, {}), serializer=serializer)
+        report[name] = {
+            'bytes': len(body),
+            'messages per second': round(publish_rate(task, args, serializer, queues[0])),
+        }
+
+    log.info("Message size benchmark: %s" % report)
+
+    # the ids are a fraction of the pickled objects.
+    assert report['analyze_headers, ids']['bytes'] * 5 < report['analyze_headers, objects']['bytes']
+    assert report['resolve_and_scan_batch, ids']['bytes'] * 5 < report['resolve_and_scan_batch, objects']['bytes']
@@ -0,0 +1,82 @@
+"""
+Throughput per GB of memory of the prefork pool versus green threads, for tasks that wait on the network.
+
+Both workers get the same amount of tasks that only wait (like a scanner waiting for a server to answer). The
+prefork pool runs CELERY_WORKER_CONCURRENCY processes, the scanner_io role runs its green threads in one process.
+Reported: tasks per second, peak memory of the worker (all its processes) and tasks per second per GB.
+
+Configure with environment variables: POOL_BENCHMARK_TASKS (amount of tasks), POOL_BENCHMARK_WAIT (seconds every
+task waits).
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from failmap.celery import app, waitsome
+from failmap.celery.worker import WORKER_POOL_CONFIGURATION
+
+log = logging.getLogger(__name__)
+
+TASKS = int(os.environ.get('POOL_BENCHMARK_TASKS', 1000))
+WAIT = float(os.environ.get('POOL_BENCHMARK_WAIT', 0.5))
+TIMEOUT = 600
+
+
+def memory(session: int) -> int:
+    """Resident memory of all processes of a session, in bytes."""
+    output = subprocess.check_output(['ps', '-o', 'rss=', '--sid', str(session)], universal_newlines=True)
+    return sum(int(rss) for rss in output.split()) * 1024
+
+
+def benchmark(pool: str, concurrency: int, queue: str) -> dict:
+    worker_command = ['failmap', 'celery', 'worker', '-l', 'info', '--pool', pool, '--concurrency', str(concurrency),
+                      '--queues', queue]
+    log.info('Running worker with: %s', ' '.join(worker_command))
+    worker_process = subprocess.Popen(worker_command, stdout=sys.stdout.buffer, stderr=sys.stderr.buffer,
+                                      preexec_fn=os.setsid)
+
+    peak = [0]
+    running = threading.Event()
+
+    def measure():
+        while not running.wait(0.5):
+            peak[0] = max(peak[0], memory(worker_process.pid))
+
+    try:
+        waitsome.apply_async([0], queue=queue).get(timeout=TIMEOUT)
+        threading.Thread(target=measure, daemon=True).start()
+
+        start = time.monotonic()
+        with app.producer_or_acquire() as producer:
+            results = [waitsome.apply_async([WAIT], queue=queue, producer=producer) for _ in range(TASKS)]
+        for result in results:
+            result.get(timeout=TIMEOUT)
+        elapsed = time.monotonic() - start
+    finally:
+        running.set()
+        os.killpg(os.getpgid(worker_process.pid), signal.SIGKILL)
+
+    return {
+        'tasks per second': round(TASKS / elapsed, 1),
+        'memory (MB)': round(peak[0] / 1024 ** 2),
+        'tasks per second per GB': round(TASKS / elapsed / (peak[0] / 1024 ** 3), 1),
+    }
+
+
+def test_worker_pools(queues):
+    io_pool = WORKER_POOL_CONFIGURATION['scanner_io']
+
+    report = {
+        'prefork': benchmark('prefork', settings.CELERY_WORKER_CONCURRENCY, queues[0]),
+        'scanner_io': benchmark(io_pool['pool'], io_pool['concurrency'], queues[1]),
+    }
+
+    log.info("Worker pool benchmark: %s" % report)
+
+    assert report['scanner_io']['tasks per second per GB'] > report['prefork']['tasks per second per GB']
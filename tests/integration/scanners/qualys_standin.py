@@ -0,0 +1,172 @@
+"""
+Local stand-in for the SSL Labs API, for load testing the Qualys scanner without using the real API.
+
+Replays the recorded responses in tests/tls_scan_qualys_responses/:
+- the first request for a host starts an assessment, which is IN_PROGRESS for `duration` seconds and READY after.
+- hosts starting with "unresolvable" end in ERROR (unable to resolve domain).
+- READY results contain `endpoints` endpoints, alternating IPv4 and IPv6.
+
+The API limits are simulated as well:
+- at most `max_assessments` running assessments, after which new ones get "Concurrent assessment limit reached".
+- a fraction of new assessments (`full_capacity_rate`) gets "Running at full capacity".
+- every response has the X-Max-Assessments and X-Current-Assessments headers and is delayed by `latency` seconds.
+
+Usage, point QUALYS_API_URL to the printed url:
+    python -m tests.integration.scanners.qualys_standin --port 8011 --duration 60
+"""
+import argparse
+import copy
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+RESPONSE_DIR = 'tests/tls_scan_qualys_responses/'
+
+
+def load(name):
+    with open(RESPONSE_DIR + name) as f:
+        return json.load(f)
+
+
+class QualysStandin(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int=0, latency: float=0, duration: float=0, max_assessments: int=25,
+                 full_capacity_rate: float=0, endpoints: int=2, seed: int=0):
+        super(QualysStandin, self).__init__(('127.0.0.1', port), QualysRequestHandler)
+        self.latency = latency
+        self.duration = duration
+        self.max_assessments = max_assessments
+        self.full_capacity_rate = full_capacity_rate
+        self.endpoints = endpoints
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        # host: moment the assessment was started
+        self.assessments = {}
+        self.stats = Counter()
+
+        self.ready = load('www.faalkaart.nl.json')
+        self.in_progress = load('in_progress.json')
+        self.error = load('unable_to_resolve.json')
+
+    @property
+    def url(self):
+        return "http://%s:%s/api/v2/" % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def running(self):
+        now = time.monotonic()
+        return len([started for started in self.assessments.values() if now - started < self.duration])
+
+    def analyze(self, host: str):
+        """Returns status code and data for a request for host."""
+        with self.lock:
+            self.stats['requests'] += 1
+
+            if host not in self.assessments:
+                running = self.running()
+                if running >= self.max_assessments:
+                    self.stats['concurrent_limit'] += 1
+                    return 429, {'errors': [{'message': 'Concurrent assessment limit reached (%s/%s)' % (
+                        running, self.max_assessments)}]}
+
+                if self.random.random() < self.full_capacity_rate:
+                    self.stats['full_capacity'] += 1
+                    return 529, {'errors': [{'message': 'Running at full capacity. Please try again later.'}],
+                                 'status': 'FAILURE'}
+
+                self.stats['assessments'] += 1
+                self.assessments[host] = time.monotonic()
+
+            if time.monotonic() - self.assessments[host] < self.duration:
+                data = copy.deepcopy(self.in_progress)
+            elif host.startswith('unresolvable'):
+                data = copy.deepcopy(self.error)
+            else:
+                data = self.ready_result()
+                self.stats['ready'] += 1
+
+        data['host'] = host
+        return 200, data
+
+    def ready_result(self):
+        data = copy.deepcopy(self.ready)
+        ipv4, ipv6 = data['endpoints'][0], data['endpoints'][1]
+
+        endpoints = []
+        for number in range(self.endpoints):
+            if number % 2:
+                endpoint = copy.deepcopy(ipv6)
+                endpoint['ipAddress'] = '2001:db8::%x' % (number + 1)
+            else:
+                endpoint = copy.deepcopy(ipv4)
+                endpoint['ipAddress'] = '192.0.2.%s' % (number + 1)
+            endpoints.append(endpoint)
+        data['endpoints'] = endpoints
+        return data
+
+    def headers(self):
+        with self.lock:
+            return {'X-Max-Assessments': str(self.max_assessments),
+                    'X-Current-Assessments': str(self.running()),
+                    'X-ClientMaxAssessments': str(self.max_assessments)}
+
+
+class QualysRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        request = urlparse(self.path)
+        host = parse_qs(request.query).get('host', [''])[0]
+
+        if not request.path.endswith('/analyze') or not host:
+            status, data = 400, {'errors': [{'field': 'host', 'message': 'invalid request'}]}
+        else:
+            time.sleep(self.server.latency)
+            status, data = self.server.analyze(host)
+
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in self.server.headers().items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # the default logs every request to stderr.
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--latency', type=float, default=0.2, help="Seconds before every response.")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds an assessment takes.")
+    parser.add_argument('--max-assessments', type=int, default=25)
+    parser.add_argument('--full-capacity-rate', type=float, default=0.05)
+    parser.add_argument('--endpoints', type=int, default=2, help="Endpoints in every result.")
+    arguments = parser.parse_args()
+
+    server = QualysStandin(port=arguments.port, latency=arguments.latency, duration=arguments.duration,
+                           max_assessments=arguments.max_assessments,
+                           full_capacity_rate=arguments.full_capacity_rate, endpoints=arguments.endpoints)
+    print("Serving SSL Labs API stand-in on %s" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(server.stats))
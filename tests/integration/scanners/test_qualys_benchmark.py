@@ -0,0 +1,143 @@
+"""
+Throughput of the Qualys scanner, measured against a local stand-in of the SSL Labs API (see qualys_standin).
+
+Runs the complete pipeline with an in-process worker and a real broker:
+- tasks: compose_task -> qualys_scan -> process_qualys_result, polling by retrying through the broker.
+- manager: the assessment manager, handing results to process_qualys_results in batches.
+
+Reported: assessments per hour, broker messages per assessment and database queries per stored scan. The rate
+limit of qualys_scan is removed, as it would make the benchmark take hours and the stand-in does not need it.
+
+Configure with environment variables: QUALYS_BENCHMARK_URLS (amount of urls), QUALYS_BENCHMARK_DURATION (seconds
+an assessment takes).
+"""
+import logging
+import os
+import time
+
+import pytest
+from celery.contrib.testing.worker import start_worker
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.db import connection
+
+from failmap.celery import app
+from failmap.organizations.models import Organization, Url
+from failmap.scanners import scanner_tls_qualys
+from failmap.scanners.models import Endpoint, TlsQualysScan
+from failmap.scanners.qualys_manager import AssessmentManager
+
+from .qualys_standin import QualysStandin
+
+log = logging.getLogger(__name__)
+
+URLS = int(os.environ.get('QUALYS_BENCHMARK_URLS', 20))
+DURATION = float(os.environ.get('QUALYS_BENCHMARK_DURATION', 45))
+TIMEOUT = 3600
+
+QUEUES = ['scanners', 'scanners.qualys', 'storage', 'scratch']
+STORAGE_TASKS = ['failmap.scanners.scanner_tls_qualys.process_qualys_result',
+                 'failmap.scanners.scanner_tls_qualys.process_qualys_results']
+
+
+@pytest.fixture
+def standin():
+    server = QualysStandin(latency=0.2, duration=DURATION, max_assessments=25, full_capacity_rate=0.05,
+                           endpoints=2).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def benchmark_urls(transactional_db):
+    organization = Organization(name='qualys benchmark')
+    organization.save()
+
+    for number in range(URLS):
+        url = Url(url='benchmark%s.faalonie.test' % number)
+        url.save()
+        url.organization.add(organization)
+        Endpoint(ip_version=4, port=443, protocol='https', url=url).save()
+
+    return {'name__iregex': '^qualys benchmark$'}
+
+
+class Measurements:
+    """Counts broker messages and the database queries of storage tasks, in this process."""
+
+    def __init__(self):
+        self.messages = 0
+        self.queries = 0
+        self.query_start = {}
+
+    def published(self, **kwargs):
+        self.messages += 1
+
+    def task_started(self, task_id=None, task=None, **kwargs):
+        if task.name in STORAGE_TASKS:
+            connection.force_debug_cursor = True
+            self.query_start[task_id] = len(connection.queries)
+
+    def task_finished(self, task_id=None, task=None, **kwargs):
+        if task_id in self.query_start:
+            self.queries += len(connection.queries) - self.query_start.pop(task_id)
+
+    def __enter__(self):
+        before_task_publish.connect(self.published)
+        task_prerun.connect(self.task_started)
+        task_postrun.connect(self.task_finished)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.monotonic() - self.start
+        before_task_publish.disconnect(self.published)
+        task_prerun.disconnect(self.task_started)
+        task_postrun.disconnect(self.task_finished)
+
+    def report(self, pipeline, assessments, scans):
+        report = {
+            'pipeline': pipeline,
+            'assessments': assessments,
+            'assessments per hour': round(assessments / self.elapsed * 3600),
+            'broker messages per assessment': round(self.messages / max(assessments, 1), 1),
+            'database queries per stored scan': round(self.queries / max(scans, 1), 1),
+        }
+        log.info("Qualys benchmark: %s" % report)
+        return report
+
+
+def run_tasks(organizations_filter):
+    task = scanner_tls_qualys.compose_task(organizations_filter)
+    task.apply_async().get(timeout=TIMEOUT, propagate=False)
+
+
+def run_manager(organizations_filter):
+    batches = []
+
+    def store(results):
+        batches.append(scanner_tls_qualys.process_qualys_results.delay(results))
+
+    AssessmentManager(scanner_tls_qualys.urls_to_scan(organizations_filter), store).run()
+    for batch in batches:
+        batch.get(timeout=TIMEOUT, propagate=False)
+
+
+@pytest.mark.parametrize('pipeline', ['tasks', 'manager'])
+def test_qualys_throughput(pipeline, standin, benchmark_urls, settings, tmpdir):
+    settings.QUALYS_API_URL = standin.url
+    settings.QUALYS_NEW_ASSESSMENT_INTERVAL = 1
+    settings.SCRATCH_DIR = str(tmpdir)
+    settings.RATE_LIMITS = dict(settings.RATE_LIMITS, qualys=None)
+
+    with start_worker(app, concurrency=1, pool='solo', perform_ping_check=False, queues=QUEUES):
+        with Measurements() as measurements:
+            if pipeline == 'tasks':
+                run_tasks(benchmark_urls)
+            else:
+                run_manager(benchmark_urls)
+
+    scans = TlsQualysScan.objects.all().filter(endpoint__url__url__startswith='benchmark').count()
+    measurements.report(pipeline, standin.stats['ready'], scans)
+
+    # two endpoints (IPv4 and IPv6) per url.
+    assert scans == URLS * 2
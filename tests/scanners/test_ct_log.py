@@ -0,0 +1,77 @@
+"""Tests of subdomain discovery using certificate transparency."""
+
+import json
+
+import pytest
+
+from failmap.organizations.models import Url
+from failmap.scanners import ct_log, resolver
+from failmap.scanners.models import State
+
+CT_URL = 'https://crt.sh/'
+
+
+@pytest.fixture
+def crt_sh(responses, settings):
+    """Stand-in for crt.sh, answering with the certificates in the returned list."""
+
+    settings.CERTIFICATE_TRANSPARENCY_URL = CT_URL
+    certificates = []
+
+    def answer(request):
+        return 200, {'Content-Type': 'application/json'}, json.dumps(certificates)
+
+    responses.add_callback(responses.GET, CT_URL, callback=answer)
+    return certificates
+
+
+@pytest.fixture
+def resolved(monkeypatch):
+    """Everything resolves, the names that where looked up are returned."""
+
+    names = []
+
+    def resolve_many(urls):
+        names.extend(urls)
+        return {url: ('192.0.2.1', '') for url in urls}
+
+    monkeypatch.setattr(resolver, 'resolve_many', resolve_many)
+    return names
+
+
+def test_discover(db, crt_sh, resolved, faalonië):
+    """Only new names from new certificates are looked up."""
+
+    toplevel = Url(url='faalonie.test')
+    toplevel.save()
+    toplevel.organization.add(faalonië['organization'])
+
+    crt_sh += [
+        {'id': 10, 'name_value': 'www.faalonie.test'},
+        {'id': 11, 'name_value': 'mail.faalonie.test\n*.apps.faalonie.test', 'common_name': 'faalonie.test'},
+    ]
+    added = ct_log.discover(toplevel)
+
+    # www is already known, so it is not resolved again.
+    assert sorted(url.url for url in added) == ['apps.faalonie.test', 'mail.faalonie.test']
+    assert sorted(resolved) == ['apps.faalonie.test', 'mail.faalonie.test']
+    assert State.objects.get(scanner='certificate_transparency:faalonie.test').value == '11'
+
+    # certificates that where seen before are skipped.
+    crt_sh.append({'id': 12, 'name_value': 'vpn.faalonie.test\nmail.faalonie.test'})
+    added = ct_log.discover(toplevel)
+
+    assert [url.url for url in added] == ['vpn.faalonie.test']
+    assert len(resolved) == 3
+
+
+def test_parse_stream():
+    """Certificates are read from any size of chunks."""
+
+    data = json.dumps([{'id': number, 'name_value': 'ë%s.faalonie.test' % number} for number in range(100)])
+    data = data.encode('utf-8')
+
+    certificates = list(ct_log.parse_stream(data[start:start + 7] for start in range(0, len(data), 7)))
+
+    assert len(certificates) == 100
+    assert certificates[99]['name_value'] == 'ë99.faalonie.test'
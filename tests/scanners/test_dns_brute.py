@@ -0,0 +1,110 @@
+"""Tests of the DNS brute force, against a name server on localhost."""
+
+import socketserver
+import threading
+
+import dns.message
+import dns.rcode
+import dns.rrset
+import pytest
+
+from failmap.organizations.models import Url
+from failmap.scanners import dns_brute, resolver
+
+
+class NameServer(socketserver.UDPServer):
+    """Answers with an address for the names for which exists(name) is true."""
+
+    def __init__(self, exists):
+        super(NameServer, self).__init__(('127.0.0.1', 0), NameServerHandler)
+        self.exists = exists
+        self.questions = []
+
+
+class NameServerHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        query = dns.message.from_wire(data)
+        name = query.question[0].name.to_text(omit_final_dot=True)
+        self.server.questions.append(name)
+
+        response = dns.message.make_response(query)
+        if self.server.exists(name):
+            response.answer.append(dns.rrset.from_text(query.question[0].name, 60, 'IN', 'A', '192.0.2.1'))
+        else:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        sock.sendto(response.to_wire(), self.client_address)
+
+
+@pytest.fixture
+def nameserver():
+    servers = []
+
+    def start(exists):
+        server = NameServer(exists)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def toplevel(db, monkeypatch, faalonië):
+    # names that exist according to the brute force resolve as well.
+    monkeypatch.setattr(resolver, 'resolve_many', lambda urls: {url: ('192.0.2.1', '') for url in urls})
+
+    url = Url(url='faalonie.test')
+    url.save()
+    url.organization.add(faalonië['organization'])
+    return url
+
+
+def brute_force(url, words, server):
+    host, port = server.server_address
+    return dns_brute.brute_force(url, words, rate=1000, nameservers=[host], port=port)
+
+
+def test_brute_force(toplevel, nameserver):
+    """Existing subdomains are added, subdomains that are already known are skipped."""
+
+    server = nameserver(lambda name: name in ['www.faalonie.test', 'mail.faalonie.test'])
+    added = brute_force(toplevel, ['www', 'mail', 'intranet', 'www'], server)
+
+    # www.faalonie.test is part of faalonië already.
+    assert [url.url for url in added] == ['mail.faalonie.test']
+    assert Url.objects.filter(url='www.faalonie.test').count() == 1
+    assert not Url.objects.get(url='faalonie.test').uses_dns_wildcard
+
+    # duplicate words are asked once, next to the random wildcard checks.
+    assert len(server.questions) == dns_brute.WILDCARD_PROBES + 3
+
+
+def test_wildcard(toplevel, nameserver):
+    """Domains where everything exists are not brute forced."""
+
+    server = nameserver(lambda name: True)
+
+    assert brute_force(toplevel, ['www', 'mail'], server) == []
+    assert Url.objects.get(url='faalonie.test').uses_dns_wildcard
+    assert len(server.questions) == dns_brute.WILDCARD_PROBES
+
+
+def test_partial_wildcard(toplevel, nameserver, monkeypatch):
+    """When nearly all words exist the brute force stops, as this is a wildcard that the random names missed."""
+
+    monkeypatch.setattr(dns_brute, 'BATCH_SIZE', 10)
+    monkeypatch.setattr(dns_brute, 'WILDCARD_SAMPLE', 10)
+
+    # only names shorter than the random names exist.
+    server = nameserver(lambda name: len(name.split('.')[0]) < dns_brute.WILDCARD_LABEL_LENGTH)
+    words = ('word%s' % number for number in range(1000))
+
+    assert brute_force(toplevel, words, server) == []
+    assert Url.objects.get(url='faalonie.test').uses_dns_wildcard
+    assert len(server.questions) == dns_brute.WILDCARD_PROBES + 10
@@ -0,0 +1,59 @@
+"""Tests of batched DNSSEC checking, using a stand-in for dnssec_batch.pl."""
+
+import sys
+
+from failmap.scanners import dnssec_checker
+from failmap.scanners.models import UrlGenericScan
+from failmap.scanners.scanner_dnssec import store_dnssec_batch
+
+# answers like dnssec_batch.pl, zones starting with "slow" never finish, "crash" stops the checker and DNSCheck fails on
+# "broken".
+STANDIN = """
+import sys, time
+
+for zone in sys.stdin:
+    zone = zone.strip()
+    if zone.startswith('slow'):
+        time.sleep(60)
+    if zone.startswith('crash'):
+        sys.exit(1)
+    if zone.startswith('broken'):
+        print('DNSSEC_BATCH_FAILED %s Can not call method "dnssec" on an undefined value' % zone)
+        print('DNSSEC_BATCH_DONE %s' % zone, flush=True)
+        continue
+    print('0.000: INFO Begin testing DNSSEC for %s.' % zone)
+    print('0.001: INFO Did not find DS record for %s at parent.' % zone)
+    print('DNSSEC_BATCH_DONE %s' % zone, flush=True)
+"""
+
+
+def test_check(tmpdir):
+    """Zones that fail don't stop the other zones from being checked."""
+
+    standin = tmpdir.join('dnssec_batch.py')
+    standin.write(STANDIN)
+
+    zones = ['faalonie.test', 'slow.test', 'crash.test', 'broken.test', 'example.test', 'faalonie.test']
+    results = dnssec_checker.check(zones, checkers=2, timeout=1, command=[sys.executable, str(standin)])
+
+    assert sorted(results) == ['broken.test', 'crash.test', 'example.test', 'faalonie.test', 'slow.test']
+    assert results['faalonie.test'][1] == '0.001: INFO Did not find DS record for faalonie.test at parent.'
+    assert isinstance(results['slow.test'], dnssec_checker.CheckerError)
+    assert isinstance(results['crash.test'], dnssec_checker.CheckerError)
+    # a failure of DNSCheck is not a DNSSEC error of the zone.
+    assert isinstance(results['broken.test'], dnssec_checker.CheckerError)
+    assert len(results['example.test']) == 2
+
+
+def test_store_dnssec_batch(db, faalonië):
+    """Results of a batch are stored, failed checks are skipped."""
+
+    url = faalonië['url']
+    results = {url.url: ['0.000: INFO Begin testing DNSSEC for %s.' % url.url,
+                         '0.001: INFO Did not find DS record for %s at parent.' % url.url]}
+
+    assert store_dnssec_batch(results, [url])['stored'] == 1
+    assert UrlGenericScan.objects.get(url=url, type='DNSSEC').rating == 'ERROR'
+
+    result = store_dnssec_batch({url.url: dnssec_checker.CheckerError("took too long")}, [url])
+    assert result['failed'] == [url.url]
@@ -0,0 +1,127 @@
+"""Tests of the asynchronous http prober against servers on this machine."""
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from failmap.scanners import ratelimit
+from failmap.scanners.http_prober import Target, probe_batch
+
+TIMEOUTS = (1, 1)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    """Answers every connection with a status line, while counting how many connections are open at once."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.open = 0
+        self.most_open = 0
+        super().__init__(('127.0.0.1', 0), Handler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        with self.server.lock:
+            self.server.open += 1
+            self.server.most_open = max(self.server.most_open, self.server.open)
+        try:
+            self.request.recv(1024)
+            time.sleep(self.server.delay)
+            self.request.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        finally:
+            with self.server.lock:
+                self.server.open -= 1
+
+
+@pytest.fixture
+def server(settings):
+    settings.RATE_LIMITS = {}
+
+    servers = []
+
+    def start(delay=0):
+        running = Server(delay)
+        threading.Thread(target=running.serve_forever, daemon=True).start()
+        servers.append(running)
+        return running
+
+    yield start
+
+    for running in servers:
+        running.shutdown()
+        running.server_close()
+
+
+def unused_port():
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        return unused.getsockname()[1]
+
+
+def target(port, protocol='http'):
+    return Target(url_id=1, host='www.faalonie.test', ip='127.0.0.1', port=port, protocol=protocol)
+
+
+def test_probe_batch(server):
+    """Any answer means there is a server, also a failed TLS handshake. Refused and silent ports are not."""
+
+    http = server()
+
+    # accepted by the kernel, but nobody ever answers.
+    silent = socket.socket()
+    silent.bind(('127.0.0.1', 0))
+    silent.listen(10)
+
+    try:
+        results = probe_batch([
+            target(http.port),
+            target(unused_port()),
+            target(silent.getsockname()[1]),
+            # a plain http server answers the TLS handshake with garbage.
+            target(http.port, 'https'),
+        ], timeouts=TIMEOUTS)
+    finally:
+        silent.close()
+
+    assert results == [True, False, False, True]
+
+
+def test_per_host_concurrency(server):
+    """A single ip address is never contacted more than per_host_concurrency times at once."""
+
+    slow = server(delay=0.2)
+
+    results = probe_batch([target(slow.port)] * 8, per_host_concurrency=2, timeouts=TIMEOUTS)
+
+    assert all(results)
+    assert slow.most_open == 2
+
+
+def test_tokens_are_taken_in_a_thread(server, monkeypatch):
+    """Taking a token waits on redis, the event loop keeps probing in the mean time."""
+
+    http = server()
+
+    threads = []
+
+    def acquire(*buckets):
+        threads.append(threading.current_thread())
+        return 0
+
+    monkeypatch.setattr(ratelimit, 'acquire', acquire)
+
+    assert probe_batch([target(http.port)] * 2, timeouts=TIMEOUTS) == [True, True]
+    assert len(threads) == 2
+    assert threading.current_thread() not in threads
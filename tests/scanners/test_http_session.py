@@ -0,0 +1,76 @@
+"""Tests of the http sessions that are shared by scanners."""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from failmap.scanners import http_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    # keeps the connection open, so it can be reused.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    # start every test without sessions of earlier tests.
+    http_session.close()
+
+    running = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=running.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%s/' % running.server_address[1]
+
+    http_session.close()
+    running.shutdown()
+    running.server_close()
+
+
+def test_profiles():
+    """Probes never retry, other requests retry connection errors once."""
+
+    default = http_session.session()
+    assert default.default_timeout == (10, 10)
+    assert default.get_adapter('https://www.faalonie.test').max_retries.total == 1
+    assert default.get_adapter('https://www.faalonie.test').max_retries.connect == 1
+
+    probe = http_session.session('probe')
+    assert probe.default_timeout == (30, 30)
+    assert probe.get_adapter('http://www.faalonie.test').max_retries.total == 0
+
+
+def test_sessions_are_reused():
+    """Every thread gets its own session per profile, and keeps using it."""
+
+    assert http_session.session() is http_session.session()
+    assert http_session.session() is not http_session.session('probe')
+
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(http_session.session()))
+    thread.start()
+    thread.join()
+    assert other_thread[0] is not http_session.session()
+
+
+# pytest-responses intercepts all requests, this test needs the real server.
+@pytest.mark.withoutresponses
+def test_stats_and_close(server):
+    """Requests to the same host use the same connection, until the sessions are closed."""
+
+    for _ in range(3):
+        assert http_session.session().get(server).status_code == 200
+
+    assert http_session.stats() == {'default': {'pools': 1, 'connections': 1, 'requests': 3, 'reused': 2}}
+
+    used = http_session.session()
+    http_session.close()
+    assert http_session.stats() == {}
+    assert http_session.session() is not used
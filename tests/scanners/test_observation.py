@@ -0,0 +1,43 @@
+"""Tests of the observation scanner."""
+
+import json
+
+from django.core.management import call_command
+
+from failmap.scanners.models import EndpointGenericScan, EndpointObservation
+
+SECURITY_HEADERS = {
+    'X-XSS-Protection': '1',
+}
+
+TEST_ORGANIZATION = 'faalonië'
+
+
+def test_observation(responses, db, faalonië):
+    """An endpoint is visited once, after which the headers are rated from the observation."""
+
+    responses.add(responses.GET, 'https://' + faalonië['url'].url + ':443/', headers=SECURITY_HEADERS)
+
+    result = json.loads(call_command('scan_observation', '-v3', '-o', TEST_ORGANIZATION))
+
+    assert result[0]['status'] == 'success'
+    assert len(responses.calls) == 1
+
+    observation = EndpointObservation.objects.get(endpoint=faalonië['endpoint'])
+    assert observation.reachable
+    assert observation.tls == 'ok'
+
+    xss = EndpointGenericScan.objects.get(endpoint=faalonië['endpoint'], type='X-XSS-Protection')
+    assert xss.rating == 'True'
+
+
+def test_observation_unreachable(responses, db, faalonië):
+    """Endpoints that don't respond are declared dead."""
+
+    # responses raises a ConnectionError for urls that are not registered.
+    result = json.loads(call_command('scan_observation', '-v3', '-o', TEST_ORGANIZATION))
+
+    assert result[0]['status'] == 'success'
+
+    faalonië['endpoint'].refresh_from_db()
+    assert faalonië['endpoint'].is_dead
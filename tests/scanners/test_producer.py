@@ -0,0 +1,57 @@
+"""Tests of publishing scan tasks in chunks."""
+
+from failmap.scanners import producer
+
+MODULE = 'failmap.scanners.scanner_security_headers'
+
+
+def test_resume(responses, db, settings, faalonië):
+    """A run that stopped continues after the last published target."""
+
+    settings.PRODUCER_CHUNK_SIZE = 1
+    responses.add(responses.GET, 'https://' + faalonië['url'].url + ':443/')
+
+    assert producer.produce_tasks.apply((MODULE,)).get()[0]['status'] == 'success'
+    key = producer.state_key(MODULE)
+    assert producer.progress(key) == {'status': 'done', 'last_pk': faalonië['endpoint'].pk, 'targets': 1, 'tasks': 1}
+
+    # resuming a failed run skips the endpoint that was already published.
+    producer.save_progress(key, dict(producer.progress(key), status='failed'))
+    assert producer.produce_tasks.apply((MODULE,), {'resume': True}).get() == []
+    assert len(responses.calls) == 1
+
+
+def test_pause(db, settings, monkeypatch, faalonië):
+    """A run stops while the queues are above the high water mark, and is resumed by a new task later."""
+
+    settings.PRODUCER_HIGH_WATER = 100
+    monkeypatch.setattr(producer, 'queue_depth', lambda queues: 101)
+    later = []
+    monkeypatch.setattr(producer.produce_tasks, 'apply_async', lambda *args, **kwargs: later.append((args, kwargs)))
+    published = []
+    monkeypatch.setattr(producer, 'publish', published.extend)
+
+    assert producer.produce_tasks(MODULE)['status'] == 'paused'
+    assert later == [(((MODULE, {}, {}, {}), {'resume': True}), {'countdown': settings.PRODUCER_PAUSE})]
+    assert not published
+
+    monkeypatch.setattr(producer, 'queue_depth', lambda queues: 100)
+    assert producer.produce_tasks(MODULE, resume=True)['status'] == 'done'
+    assert len(published) == 1
+
+
+def test_filtered_runs_keep_their_own_progress(db, settings, monkeypatch, faalonië):
+    """A filtered run does not overwrite the progress of a paused periodic run, which resumes where it was."""
+
+    monkeypatch.setattr(producer, 'publish', lambda tasks: None)
+    monkeypatch.setattr(producer, 'queue_depth', lambda queues: 0)
+    paused = {'status': 'paused', 'last_pk': faalonië['endpoint'].pk, 'targets': 1, 'tasks': 1}
+    producer.save_progress(producer.state_key(MODULE), paused)
+
+    urls_filter = {'url': faalonië['url'].url}
+    assert producer.produce_tasks(MODULE, urls_filter=urls_filter)['status'] == 'done'
+    assert producer.state_key(MODULE, urls_filter=urls_filter) != producer.state_key(MODULE)
+    assert producer.progress(producer.state_key(MODULE)) == paused
+
+    # the periodic run continues after its own last target: there is nothing left.
+    assert producer.produce_tasks(MODULE, resume=True) == dict(paused, status='done')
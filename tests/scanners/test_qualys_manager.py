@@ -0,0 +1,56 @@
+"""Tests of the Qualys assessment manager."""
+
+import json
+
+from failmap.scanners.qualys_manager import AssessmentManager
+
+RESPONSE_DIR = 'tests/tls_scan_qualys_responses/'
+API_URL = 'https://qualys.faalonie.test/api/v2/'
+
+
+def load(name):
+    with open(RESPONSE_DIR + name) as f:
+        return json.load(f)
+
+
+def test_assessment_manager(responses, db, settings, tmpdir, faalonië):
+    """Assessments are polled until ready, after which results are handed over in batches."""
+
+    settings.QUALYS_API_URL = API_URL
+    settings.SCRATCH_DIR = str(tmpdir)
+
+    responses.add(responses.GET, API_URL + 'analyze', json=load('in_progress.json'))
+    responses.add(responses.GET, API_URL + 'analyze', json=load('www.faalkaart.nl.json'))
+
+    batches = []
+    manager = AssessmentManager([faalonië['url']], batches.append, new_assessment_interval=0, poll_interval=0)
+    stats = manager.run()
+
+    assert stats['finished'] == 1
+    assert stats['polls'] == 2
+    assert len(batches) == 1
+    data, url = batches[0][0]
+    assert data['status'] == 'READY'
+    assert url == faalonië['url'].pk
+
+
+def test_assessment_manager_capacity(responses, db, settings, tmpdir, faalonië):
+    """When the API is at its limit, fewer assessments are run and the assessment is started again later."""
+
+    settings.QUALYS_API_URL = API_URL
+    settings.SCRATCH_DIR = str(tmpdir)
+
+    limit_reached = {'errors': [{'message': 'Concurrent assessment limit reached (7/7)'}]}
+    responses.add(responses.GET, API_URL + 'analyze', json=limit_reached, status=429)
+    responses.add(responses.GET, API_URL + 'analyze', json=load('www.faalkaart.nl.json'),
+                  headers={'X-Max-Assessments': '3', 'X-Current-Assessments': '1'})
+
+    batches = []
+    manager = AssessmentManager([faalonië['url']], batches.append, max_assessments=5,
+                                new_assessment_interval=0, poll_interval=0)
+    stats = manager.run()
+
+    assert stats['capacity_errors'] == 1
+    assert stats['finished'] == 1
+    assert manager.capacity < 5
+    assert manager.interval > 0
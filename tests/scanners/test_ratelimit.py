@@ -0,0 +1,89 @@
+"""Tests of the rate limit that is shared by all scanners."""
+from types import SimpleNamespace
+
+import pytest
+from celery.exceptions import Ignore
+
+from failmap.celery import app
+from failmap.scanners import ratelimit
+
+
+@app.task(bind=True, max_retries=3)
+def contact(self, host):
+    """A task that contacts a host."""
+    ratelimit.throttle(self, *ratelimit.target(host))
+    return host
+
+
+@pytest.fixture
+def clock(monkeypatch, settings):
+    """Memory buckets and a clock that only moves when sleeping."""
+
+    settings.RATE_LIMIT_BACKEND = 'memory'
+    settings.RATE_LIMITS = {
+        'global': {'rate': 100, 'burst': 100},
+        'host': {'rate': 1, 'burst': 2},
+        'ip': None,
+    }
+    monkeypatch.setattr(ratelimit, '_memory_buckets', ratelimit.MemoryBuckets())
+
+    clock = SimpleNamespace(now=1000.0, slept=[])
+
+    def sleep(seconds):
+        clock.slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(time=lambda: clock.now, sleep=sleep))
+    return clock
+
+
+def test_acquire(clock):
+    """Tokens are taken from all buckets of a target, or from none."""
+
+    target = ratelimit.target('www.faalonie.test', '192.0.2.1')
+    assert ratelimit.acquire(*target) == 0
+    assert ratelimit.acquire(*target) == 0
+
+    # the host is out of tokens, the next one is expected in a second.
+    assert ratelimit.acquire(*target) == 1
+
+    # that attempt did not take a token of the global bucket, other hosts can still be contacted.
+    assert ratelimit._memory_buckets.buckets['global:all'][0] == 98
+    assert ratelimit.acquire(*ratelimit.target('mail.faalonie.test')) == 0
+
+    clock.now += 1
+    assert ratelimit.acquire(*target) == 0
+
+
+def test_throttle(clock, monkeypatch):
+    """
+    A task on a worker is published again when there is no token, without using up its retries. A task that is called
+    directly waits for the token.
+    """
+
+    target = ratelimit.target('www.faalonie.test')
+    ratelimit.acquire(*target)
+    ratelimit.acquire(*target)
+
+    published = []
+    monkeypatch.setattr(contact, 'apply_async', lambda args, kwargs, **options: published.append((args, options)))
+
+    # more often than max_retries allows.
+    for _ in range(5):
+        contact.push_request(id='contact-1', args=['www.faalonie.test'], kwargs={}, retries=3, called_directly=False,
+                             delivery_info={'exchange': '', 'routing_key': 'scanners'})
+        try:
+            with pytest.raises(Ignore):
+                contact.run('www.faalonie.test')
+        finally:
+            contact.pop_request()
+
+    assert len(published) == 5
+    for args, options in published:
+        assert list(args) == ['www.faalonie.test']
+        assert (options['task_id'], options['queue'], options['retries']) == ('contact-1', 'scanners', 3)
+        assert 1 <= options['countdown'] <= 2
+    assert not clock.slept
+
+    assert contact('www.faalonie.test') == 'www.faalonie.test'
+    assert clock.slept == [1]
@@ -0,0 +1,97 @@
+"""Tests of the cached DNS resolver."""
+from types import SimpleNamespace
+
+import dns.exception
+import dns.name
+import dns.resolver
+import pytest
+
+from failmap.scanners import resolver
+
+
+@pytest.fixture
+def fake_dns(monkeypatch, settings):
+    """Replace DNS with a dictionary and count the questions asked."""
+
+    settings.DNS_CACHE_SHARED = False
+    settings.NETWORK_SUPPORTS_IPV4 = True
+    settings.NETWORK_SUPPORTS_IPV6 = True
+    monkeypatch.setattr(resolver, '_local_cache', {})
+
+    records = {
+        ('www.faalonie.test', 'A'): ['192.0.2.1'],
+        ('www.faalonie.test', 'AAAA'): ['2001:db8::1'],
+        ('v4only.faalonie.test', 'A'): ['192.0.2.2'],
+        ('1.2.0.192.in-addr.arpa', 'PTR'): ['server.faalonie.test.'],
+    }
+    questions = []
+
+    def resolver_query(name, rdtype):
+        questions.append((name, rdtype))
+        if name == '3.2.0.192.in-addr.arpa':
+            raise dns.exception.Timeout()
+        if (name, rdtype) not in records:
+            raise dns.resolver.NXDOMAIN()
+        return SimpleNamespace(rrset=RRSet(records[(name, rdtype)]))
+
+    monkeypatch.setattr(resolver, '_resolver_query', resolver_query)
+    return questions
+
+
+class RRSet(list):
+    """Answer with a TTL, containing records with an address, or a name for PTR records."""
+
+    ttl = 600
+
+    def __init__(self, addresses):
+        super().__init__(SimpleNamespace(address=address, target=dns.name.from_text(address))
+                         for address in addresses)
+
+
+def test_resolve_is_cached(fake_dns):
+    """The same name is only asked once."""
+
+    assert resolver.resolve('www.faalonie.test') == ('192.0.2.1', '2001:db8::1')
+    assert resolver.resolve('www.faalonie.test') == ('192.0.2.1', '2001:db8::1')
+
+    assert len(fake_dns) == 2
+
+
+def test_negative_answers_are_cached(fake_dns):
+    """Missing names and missing record types are not asked again."""
+
+    assert resolver.resolve('v4only.faalonie.test') == ('192.0.2.2', '')
+    assert resolver.resolve('nonexisting.faalonie.test') == ('', '')
+    resolver.resolve('v4only.faalonie.test')
+    resolver.resolve('nonexisting.faalonie.test')
+
+    assert len(fake_dns) == 4
+
+
+def test_resolve_many(fake_dns):
+    """Resolving in bulk gives the same answers as resolving one by one."""
+
+    names = ['www.faalonie.test', 'v4only.faalonie.test', 'nonexisting.faalonie.test', 'www.faalonie.test']
+    answers = resolver.resolve_many(names)
+
+    assert answers == {
+        'www.faalonie.test': ('192.0.2.1', '2001:db8::1'),
+        'v4only.faalonie.test': ('192.0.2.2', ''),
+        'nonexisting.faalonie.test': ('', ''),
+    }
+    assert len(fake_dns) == 6
+
+
+def test_reverse(fake_dns):
+    """Reverse names are cached like addresses, also for addresses without one."""
+
+    answers = resolver.reverse_many(['192.0.2.1', '192.0.2.2', '192.0.2.3', 'not an address'])
+    assert answers == {'192.0.2.1': 'server.faalonie.test', '192.0.2.2': '', '192.0.2.3': None, 'not an address': ''}
+
+    assert resolver.reverse('192.0.2.1') == 'server.faalonie.test'
+    assert resolver.reverse('192.0.2.2') == ''
+    assert len(fake_dns) == 3
+
+    # a failed lookup is not cached, it's asked again.
+    assert resolver.reverse('192.0.2.3') is None
+    assert len(fake_dns) == 4
@@ -0,0 +1,68 @@
+"""Tests of storing scans in bulk."""
+from datetime import datetime, timedelta
+
+import pytz
+
+from failmap.scanners import heartbeat
+from failmap.scanners.endpoint_scan_manager import EndpointScanManager
+from failmap.scanners.models import EndpointGenericScan
+from failmap.scanners.url_scan_manager import UrlScanManager
+
+
+def test_endpoint_add_scans(db, faalonië):
+    """Only changed scans result in a new scan, unchanged scans only update the last scan moment."""
+
+    endpoint = faalonië['endpoint']
+
+    EndpointScanManager.add_scans([
+        ('X-Frame-Options', endpoint, 'True', 'DENY'),
+        ('X-XSS-Protection', endpoint, 'False', 'Security Header not present: X-XSS-Protection'),
+    ])
+    assert EndpointGenericScan.objects.filter(endpoint=endpoint).count() == 2
+    first_scan = EndpointGenericScan.objects.get(endpoint=endpoint, type='X-Frame-Options')
+
+    EndpointScanManager.add_scans([
+        ('X-Frame-Options', endpoint, 'True', 'DENY'),
+        ('X-XSS-Protection', endpoint, 'True', '1'),
+    ])
+    assert EndpointGenericScan.objects.filter(endpoint=endpoint).count() == 3
+
+    # the unchanged scan is only written when heartbeats are flushed.
+    heartbeat.flush()
+    assert EndpointGenericScan.objects.get(endpoint=endpoint, type='X-Frame-Options').last_scan_moment > \
+        first_scan.last_scan_moment
+
+    # the same as add_scan
+    EndpointScanManager.add_scan('X-XSS-Protection', endpoint, 'True', '1')
+    assert EndpointGenericScan.objects.filter(endpoint=endpoint).count() == 3
+
+
+def test_url_add_scans(db, faalonië):
+    """Evidence is optional."""
+
+    url = faalonië['url']
+
+    UrlScanManager.add_scans([('DNSSEC', url, 'ERROR', 'Broken', 'evidence')])
+    UrlScanManager.add_scans([('DNSSEC', url, 'ERROR', 'Broken')])
+
+    assert url.urlgenericscan_set.count() == 1
+    assert url.urlgenericscan_set.first().evidence == 'evidence'
+
+
+def test_heartbeats_keep_their_own_moment(db, faalonië, settings):
+    """A flush does not move an older scan past the moment of a newer one."""
+    settings.HEARTBEAT_BACKEND = 'memory'
+
+    endpoint = faalonië['endpoint']
+    EndpointScanManager.add_scans([('X-Frame-Options', endpoint, 'True', 'DENY')])
+    EndpointScanManager.add_scans([('X-Frame-Options', endpoint, 'False', 'Security Header not present')])
+    old, new = EndpointGenericScan.objects.filter(endpoint=endpoint).order_by('id')
+
+    earlier = datetime(2018, 1, 1, tzinfo=pytz.utc)
+    heartbeat.beat(old, earlier)
+    heartbeat.beat(new, earlier + timedelta(hours=1))
+    heartbeat.flush()
+
+    old.refresh_from_db()
+    new.refresh_from_db()
+    assert (old.last_scan_moment, new.last_scan_moment) == (earlier, earlier + timedelta(hours=1))
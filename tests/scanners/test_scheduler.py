@@ -0,0 +1,48 @@
+"""Tests of planning scans by staleness."""
+
+from datetime import datetime, timedelta
+
+import pytz
+
+from failmap.organizations.models import Url
+from failmap.scanners import scanner_http, scheduler
+from failmap.scanners.models import ScanSchedule, State
+
+
+def test_plan(db, settings, faalonië):
+    """Never scanned targets go first, then the oldest, as many as the budget of the past hours allows."""
+
+    settings.SCAN_SCHEDULE = {'http': {'freshness': 2, 'budget': 1}}
+    for url in ['mail.faalonie.test', 'intranet.faalonie.test']:
+        Url(url=url).save()
+    urls = Url.objects.all().filter(url__endswith='faalonie.test')
+    now = datetime.now(pytz.utc)
+
+    # the first plan gets the budget of the freshness period.
+    assert [url.url for url in scheduler.plan('http', urls, now)] == ['www.faalonie.test', 'mail.faalonie.test']
+    assert [url.url for url in scheduler.plan('http', urls, now + timedelta(hours=1))] == ['intranet.faalonie.test']
+
+    # nothing is overdue until the freshness has passed.
+    assert scheduler.overdue('http', urls, now + timedelta(hours=1)).count() == 0
+    assert [url.url for url in scheduler.plan('http', urls, now + timedelta(hours=3))] == [
+        'www.faalonie.test', 'mail.faalonie.test']
+    assert scheduler.plan('http', urls, now + timedelta(hours=3)) == []
+
+    # the budget is counted from the moment of the previous plan.
+    assert State.objects.get(scanner=scheduler.state_key('http')).since == now + timedelta(hours=3)
+
+
+def test_filtered_runs_are_not_planned(db, settings, faalonië):
+    """Scanning a single organization scans all its urls, without using the budget of the periodic run."""
+
+    settings.SCAN_SCHEDULE = {'http': {'freshness': 2, 'budget': 1}}
+    url = Url(url='mail.faalonie.test')
+    url.save()
+    url.organization.add(faalonië['organization'])
+
+    task = scanner_http.compose_task(organizations_filter={'name': 'faalonië'})
+
+    assert len(task.tasks) == 1
+    assert sorted(task.tasks[0].args[0]) == sorted(Url.objects.filter(url__endswith='faalonie.test').values_list(
+        'pk', flat=True))
+    assert not ScanSchedule.objects.exists()
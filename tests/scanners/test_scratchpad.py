@@ -0,0 +1,41 @@
+"""Tests of the file storage of scratches."""
+import os
+from datetime import datetime, timedelta
+
+import pytz
+
+from failmap.scanners.scratchpad import FileSink
+
+
+def test_file_sink(tmpdir):
+    """Scratches can be read back per domain."""
+
+    sink = FileSink(str(tmpdir), max_file_size=1024 * 1024, max_age_days=30)
+    now = datetime.now(pytz.utc)
+
+    sink.write('qualys', 'www.faalonie.test', {'status': 'READY'}, now)
+    sink.write('security headers', 'https://www.faalonie.test:443', "Status: 200", now)
+    sink.write('qualys', 'www.example.test', {'status': 'ERROR'}, now)
+
+    records = sink.read('faalonie.test')
+
+    assert [record['kind'] for record in records] == ['qualys', 'security headers']
+    assert records[0]['data'] == {'status': 'READY'}
+
+
+def test_file_sink_rotation(tmpdir):
+    """Large files are rotated, old days are removed."""
+
+    sink = FileSink(str(tmpdir), max_file_size=100, max_age_days=30)
+    now = datetime.now(pytz.utc)
+
+    sink.write('qualys', 'www.faalonie.test', {'status': 'READY'}, now - timedelta(days=40))
+    for i in range(10):
+        sink.write('qualys', 'www.faalonie.test', {'status': 'READY', 'padding': 'x' * 100}, now)
+
+    # the old day is removed when a new day is started
+    assert sink.day_directories() == [now.strftime('%Y-%m-%d')]
+
+    files = os.listdir(os.path.join(str(tmpdir), now.strftime('%Y-%m-%d')))
+    assert len([name for name in files if name.startswith('scratches-')]) > 1
+    assert len(sink.read('faalonie.test')) == 10
@@ -0,0 +1,120 @@
+"""Tests of the screenshot browser pool (using a stand-in for the browser) and screenshot storage."""
+
+import asyncio
+import io
+import os
+from types import SimpleNamespace
+
+from PIL import Image
+
+from failmap.scanners import screenshot_service
+from failmap.scanners.models import Endpoint, Screenshot
+from failmap.scanners.scanner_screenshot import (endpoints_showing, identical_pages,
+                                                 latest_perceptual_hashes, save_screenshot)
+
+
+def png():
+    image = io.BytesIO()
+    Image.new('RGB', (screenshot_service.WIDTH, screenshot_service.HEIGHT), 'white').save(image, 'PNG')
+    return image.getvalue()
+
+
+class Page:
+
+    def __init__(self, browser):
+        self.browser = browser
+
+    async def setViewport(self, viewport):
+        pass
+
+    async def goto(self, uri, options):
+        if 'slow' in uri:
+            await asyncio.sleep(60)
+        if 'download' in uri:
+            raise Exception('net::ERR_ABORTED')
+
+    async def screenshot(self, options):
+        return self.browser.image
+
+    async def close(self):
+        self.browser.closed_tabs += 1
+
+
+class Browser:
+    process = None
+
+    def __init__(self, image):
+        self.image = image
+        self.closed_tabs = 0
+
+    async def newPage(self):
+        return Page(self)
+
+    async def close(self):
+        pass
+
+
+def test_screenshot_service(tmpdir, monkeypatch):
+    """Pages that take too long or fail are skipped, browsers are replaced after a number of pages."""
+
+    browsers = []
+    image = png()
+
+    async def launch(**options):
+        browsers.append(Browser(image))
+        return browsers[-1]
+
+    monkeypatch.setattr(screenshot_service, 'pyppeteer', SimpleNamespace(launch=launch))
+
+    endpoints = [SimpleNamespace(ip_version=4, uri_url=lambda name=name: 'https://%s.faalonie.test:443' % name)
+                 for name in ['www', 'slow', 'download', 'mail', 'intranet']]
+    results = []
+
+    service = screenshot_service.ScreenshotService(
+        endpoints, handle_result=lambda endpoint, path: results.append((endpoint, path)), output_dir=str(tmpdir),
+        browsers=1, tabs=2, page_timeout=0.5, pages_per_browser=3, processes=1)
+    stats = service.run()
+
+    assert len(results) == 5
+    assert stats['screenshots'] == 3
+    assert stats['timeouts'] == 1
+    assert stats['errors'] == 1
+    assert stats['browsers'] == len(browsers) == 2
+
+    # the same image is stored once, the latest links point to it.
+    stored = [result for endpoint, result in results if result]
+    assert len(stored) == 3
+    assert len(set(result['content_hash'] for result in stored)) == 1
+    assert stats['duplicate_images'] == 2
+    assert os.path.exists(stored[0]['filename'])
+    assert Image.open(str(tmpdir.join('4_httpsmailfaalonietest443_latest.png'))).size == (320, 500)
+
+
+def test_save_screenshot(db, tmpdir, faalonië):
+    """Pages that look the same as before are not written again, and can be found on all endpoints that show them."""
+
+    endpoint = faalonië['endpoint']
+    other = Endpoint(ip_version=4, port=443, protocol='https', url=faalonië['url'])
+    other.save()
+
+    image = png()
+    # a small difference, such as a date, looks the same.
+    changed = Image.open(io.BytesIO(image))
+    changed.putpixel((10, 10), (0, 0, 0))
+    changed_image = io.BytesIO()
+    changed.save(changed_image, 'PNG')
+
+    first = save_screenshot(endpoint, screenshot_service.store_image(image, str(tmpdir)))
+    assert latest_perceptual_hashes([endpoint, other]) == {endpoint.id: first.perceptual_hash}
+
+    unchanged = screenshot_service.store_image(changed_image.getvalue(), str(tmpdir),
+                                               previous_hash=first.perceptual_hash)
+    second = save_screenshot(endpoint, unchanged)
+    save_screenshot(other, screenshot_service.store_image(image, str(tmpdir)))
+
+    assert first.id == second.id
+    assert unchanged['unchanged']
+    assert not os.path.exists(screenshot_service.content_paths(str(tmpdir), unchanged['content_hash'])[0])
+    assert Screenshot.objects.all().filter(endpoint=endpoint).count() == 1
+    assert identical_pages() == [{'perceptual_hash': first.perceptual_hash, 'endpoints': 2}]
+    assert set(endpoints_showing(first.perceptual_hash)) == {endpoint, other}
@@ -0,0 +1,25 @@
+"""Tests of the incrementally maintained known subdomains wordlist."""
+
+from failmap.organizations.models import Url
+from failmap.scanners import subdomain_wordlist
+
+
+def test_wordlist(db, tmpdir, monkeypatch):
+    """Subdomains are counted once from the database, after that only added urls are counted."""
+
+    monkeypatch.setattr(subdomain_wordlist, 'directory', lambda: str(tmpdir))
+    for url in ['www.faalonie.test', 'mail.faalonie.test', 'www.example.test', 'a.b.example.test', 'example.test']:
+        Url(url=url).save()
+
+    assert subdomain_wordlist.words() == ['www', 'a.b', 'mail']
+    assert subdomain_wordlist.words(minimum=2) == ['www']
+    assert tmpdir.join('knownsubdomains.txt').read() == "www\na.b\nmail\n"
+
+    # no new subdomain and the order is the same: the wordlist is not written.
+    tmpdir.join('knownsubdomains.txt').write("untouched")
+    subdomain_wordlist.add(['www.other.test'])
+    assert tmpdir.join('knownsubdomains.txt').read() == "untouched"
+
+    subdomain_wordlist.add(['mail.other.test', 'mail.another.test', 'intranet.other.test'])
+    assert tmpdir.join('knownsubdomains.txt').read() == "mail\nwww\na.b\nintranet\n"
+    assert subdomain_wordlist.words(popular_first=False) == ['a.b', 'intranet', 'mail', 'www']
@@ -0,0 +1,41 @@
+"""Tests of deadlines that don't depend on signals."""
+import subprocess
+import threading
+import time
+
+import pytest
+
+from failmap.scanners.timeout import Deadline, run, timeout
+
+
+def test_deadlines_outside_main_thread():
+    """Deadlines also work in threads, where signals can't be used."""
+
+    @timeout(0.5)
+    def slow():
+        time.sleep(5)
+
+    outcome = {}
+
+    def scanner():
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            slow()
+        with pytest.raises(TimeoutError):
+            run(['sleep', '5'], Deadline(0.5))
+        outcome['seconds'] = time.monotonic() - start
+
+    thread = threading.Thread(target=scanner)
+    thread.start()
+    thread.join()
+    assert outcome['seconds'] < 3
+
+
+def test_run():
+    assert run(['echo', 'faalonië'], 5, stdout=subprocess.PIPE).stdout.strip() == 'faalonië'.encode()
+
+    deadline = Deadline(0)
+    with pytest.raises(TimeoutError):
+        deadline.check()
+    with pytest.raises(TimeoutError):
+        run(['echo'], deadline)
@@ -0,0 +1,36 @@
+"""Tests of grading sslscan reports."""
+import pytest
+
+from failmap.scanners import tls_runner
+from failmap.scanners.scanner_tls_standalone import determine_grade
+
+TESTCASES = 'failmap/scanners/resources/output/sslscan/testcases/'
+
+
+def test_determine_grade():
+    """Reports are graded from the summary of the streaming parser."""
+
+    ratings, trust_ratings = determine_grade(TESTCASES + 'A1.xml', 'example.com')
+    assert ratings == [['A', "Looks good!"]]
+    assert not trust_ratings
+
+    ratings, trust_ratings = determine_grade(TESTCASES + 'F_ticketbleed_paddingoracle.xml', 'example.com')
+    assert ['F', 'Vulnerable to CVE_2016_9244 (ticketbleed).'] in ratings
+    assert ['F', 'Vulnerable to CVE_2016-2107 (padding oracle).'] in ratings
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, 100])
+def test_report_parser_streaming(size):
+    """The report can be fed in any size of chunks after other output, also when that splits the start."""
+
+    with open(TESTCASES + 'A1.xml', 'rb') as report:
+        data = b'Version: 1.11.10-static\n' + report.read()
+
+    parser = tls_runner.ReportParser()
+    for start in range(0, len(data), size):
+        parser.feed(data[start:start + size])
+    summary = parser.close()
+
+    assert summary == tls_runner.parse_report(TESTCASES + 'A1.xml')
+    assert summary['ciphers']
+    assert summary['certificates'][-1]['expired'] == 'false'
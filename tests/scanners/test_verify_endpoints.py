@@ -0,0 +1,55 @@
+"""Tests of verifying known endpoints in batches."""
+from failmap.scanners import scanner_http
+from failmap.scanners.models import Endpoint, UrlIp
+
+
+def test_verify_endpoints(db, faalonië, settings, monkeypatch):
+    """Every url is resolved once, all its endpoints are probed together and only unreachable ones are killed."""
+    settings.CELERY_TASK_ALWAYS_EAGER = True
+
+    url = faalonië['url']
+    http = Endpoint.objects.create(ip_version=4, port=80, protocol='http', url=url)
+    ipv6 = Endpoint.objects.create(ip_version=6, port=443, protocol='https', url=url)
+
+    resolved = []
+
+    def resolve_many(hosts):
+        resolved.extend(hosts)
+        # this worker has no IPv6.
+        return {host: ('192.0.2.1', '') for host in hosts}
+
+    monkeypatch.setattr(scanner_http.resolver, 'resolve_many', resolve_many)
+    monkeypatch.setattr(scanner_http, 'probe_batch', lambda targets: [target.port == 443 for target in targets])
+    monkeypatch.setattr(scanner_http.resolver, 'reverse_many', lambda ips: {ip: 'server.faalonie.test' for ip in ips})
+
+    scanner_http.verify_endpoints()
+
+    assert resolved == ['www.faalonie.test']
+    assert not Endpoint.objects.get(pk=faalonië['endpoint'].pk).is_dead
+    assert Endpoint.objects.get(pk=http.pk).is_dead
+    # there is no address to verify it with.
+    assert not Endpoint.objects.get(pk=ipv6.pk).is_dead
+    # the address is stored first, its reverse name is filled in afterwards.
+    url_ip = UrlIp.objects.get(url=url, is_unused=False)
+    assert (url_ip.ip, url_ip.rdns_name) == ('192.0.2.1', 'server.faalonie.test')
+
+    # an url without addresses is not resolvable anymore, with all its endpoints.
+    monkeypatch.setattr(scanner_http.resolver, 'resolve_many', lambda hosts: {host: ('', '') for host in hosts})
+    scanner_http.verify_endpoints()
+
+    url.refresh_from_db()
+    assert url.not_resolvable
+    assert not Endpoint.objects.filter(url=url, is_dead=False).exists()
+
+
+def test_failed_reverse_lookups_are_retried(db, faalonië):
+    """An address of which the reverse lookup failed stays without a name, so it's looked up again later."""
+
+    url = faalonië['url']
+    UrlIp.objects.create(url=url, ip='192.0.2.1', is_unused=False, rdns_name=None)
+    UrlIp.objects.create(url=url, ip='192.0.2.3', is_unused=False, rdns_name=None)
+
+    scanner_http.store_rdns_names({'192.0.2.1': 'server.faalonie.test', '192.0.2.3': None})
+
+    assert UrlIp.objects.get(ip='192.0.2.1').rdns_name == 'server.faalonie.test'
+    assert UrlIp.objects.get(ip='192.0.2.3').rdns_name is None
@@ -1,4 +1,5 @@
-from failmap.organizations.models import Organization, OrganizationType
+from failmap.organizations.models import Organization, OrganizationType, Url
+from failmap.scanners import resolver
 
 
 def test_create_organization(db):
@@ -9,3 +10,25 @@ def test_create_organization(db):
     assert org
     assert org.name == 'test'
     assert org.type.name == 'municipality'
+
+
+def test_add_subdomains(db, monkeypatch):
+    """Only new subdomains that resolve are added, to all organizations of the parent url."""
+
+    monkeypatch.setattr(resolver, 'resolve_many', lambda names: {
+        name: ('192.0.2.1', '') if not name.startswith('dead') else ('', '') for name in names})
+
+    organizations = [Organization(name=name, type=OrganizationType.objects.get(pk=1)) for name in ['a', 'b']]
+    url = Url(url='faalonie.test')
+    url.save()
+    for organization in organizations:
+        organization.save()
+        url.organization.add(organization)
+    url.add_subdomain('www')
+
+    added = url.add_subdomains(['www', 'mail', 'dead', 'MAIL'] + ['host%s' % number for number in range(600)])
+
+    assert len(added) == 601
+    assert 'www.faalonie.test' not in [new_url.url for new_url in added]
+    mail = Url.objects.get(url='mail.faalonie.test')
+    assert set(mail.organization.all()) == set(organizations)
@@ -0,0 +1,41 @@
+#!/usr/bin/perl
+#
+# Batch version of dnssec.pl: keeps running and checks every zone that is written to stdin (one per line).
+#
+# The output of a zone is the same as that of dnssec.pl, followed by a line with:
+# DNSSEC_BATCH_DONE <zonename>
+#
+# When DNSCheck itself fails, the zone is not checked. Instead of its output there is a line with:
+# DNSSEC_BATCH_FAILED <zonename> <error>
+#
+# Loading perl and the DNSCheck modules takes most of the time of a single check, this is done only once.
+
+require 5.008;
+use warnings;
+use strict;
+
+use DNSCheck;
+
+######################################################################
+
+# results are read while the next zone is checked.
+$| = 1;
+
+while (my $zone = <STDIN>) {
+    chomp $zone;
+    $zone =~ s/^\s+|\s+$//g;
+    next unless ($zone);
+
+    # a new checker per zone, so nothing (logs, cached answers) is carried over.
+    my $check = new DNSCheck({ interactive => 1, extras => { debug => 0 }, localefile => 'locale/en.yaml' });
+
+    eval { $check->dnssec->test($zone); };
+    if ($@) {
+        # not a DNSSEC error: the zone was never checked.
+        (my $error = $@) =~ s/\s+/ /g;
+        $error =~ s/\s+$//;
+        print "DNSSEC_BATCH_FAILED $zone $error\n";
+    }
+
+    print "DNSSEC_BATCH_DONE $zone\n";
+}